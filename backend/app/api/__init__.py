@@ -1,5 +1,5 @@
 from . import auth, users_prisma, teachers_prisma, students_prisma, parents_prisma, classes_prisma, events_prisma, messages_prisma, websockets, results_prisma
-from . import webhook
+from . import webhook, report_cards
 
 # Re-export for easier importing in main
 auth = auth
@@ -12,4 +12,5 @@ events = events_prisma
 messages = messages_prisma
 results = results_prisma
 websockets = websockets
-webhook = webhook
\ No newline at end of file
+webhook = webhook
+report_cards = report_cards
\ No newline at end of file
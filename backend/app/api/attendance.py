@@ -6,6 +6,9 @@ from prisma import Prisma
 
 from app.api.auth import get_current_user, get_current_user_or_dev, require_role
 from app.db.prisma_client import prisma as _prisma, init_prisma as _init_prisma
+from app.core.scope import resolve_scope
+from app.core.delivery import delivery_queue
+from app.services.digest import notify_parents
 
 async def get_prisma() -> Prisma:
     """FastAPI dependency returning a connected global Prisma client.
@@ -36,17 +39,6 @@ def _date_to_iso(date_str: str) -> str:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
 
 
-async def _teacher_can_access_student(prisma: Prisma, teacher_id: int, student_id: int) -> bool:
-    """Check if teacher can access student (must be student's class teacher)"""
-    student = await prisma.student.find_unique(
-        where={"id": student_id},
-        include={"classModel": True}
-    )
-    if not student or not student.classModel:
-        return False
-    return student.classModel.teacher_id == teacher_id
-
-
 @router.post("/", response_model=dict)
 async def create_attendance_record(
     student_id: int,
@@ -70,15 +62,19 @@ async def create_attendance_record(
     # Validate date format
     iso_date = _date_to_iso(date)
 
-    # Check if student exists and teacher can access
-    if not await _teacher_can_access_student(prisma, user.teacher.id, student_id):
+    # Check if student exists and teacher can access (must be student's class teacher)
+    scope = await resolve_scope(user)
+    if not scope.can_access_student(student_id):
         raise HTTPException(status_code=403, detail="Not allowed to record attendance for this student")
 
     # Get student details for class_id if not provided
     if not class_id:
-        student = await prisma.student.find_unique(where={"id": student_id})
-        if student:
-            class_id = student.class_id
+        if student_id in scope.student_classes:
+            class_id = scope.student_classes[student_id]
+        else:
+            student = await prisma.student.find_unique(where={"id": student_id})
+            if student:
+                class_id = student.class_id
 
     try:
         # Check for existing record (unique constraint on student_id + date)
@@ -104,6 +100,7 @@ async def create_attendance_record(
                 "created_at": _now_iso()
             }
         )
+        delivery_queue.submit("normal", notify_parents, [(student_id, "attendance", f"{{student}} was marked {status} on {iso_date}")])
 
         return {
             "id": attendance.id,
@@ -137,32 +134,16 @@ async def list_attendance_records(
 ):
     """List attendance records with role-based filtering"""
 
-    # Build filters based on role
-    where_conditions = {}
-
-    if user.role == 'teacher' and user.teacher:
-        # Teachers can only see attendance for their classes
-        teacher_classes = await prisma.classmodel.find_many(
-            where={"teacher_id": user.teacher.id},
-            select={"id": True}
-        )
-        class_ids = [cls.id for cls in teacher_classes]
-        if class_ids:
-            where_conditions["class_id"] = {"in": class_ids}
-        else:
-            return []  # Teacher has no classes
+    # Build filters based on role: teachers see their classes, parents their children
+    scope = await resolve_scope(user)
+    if scope.is_empty:
+        return []
+    where_conditions = dict(scope.attendance_where() or {})
 
-    elif user.role == 'parent' and user.parent:
-        # Parents can only see attendance for their children
-        parent_students = await prisma.student.find_many(
-            where={"parent_id": user.parent.id},
-            select={"id": True}
-        )
-        student_ids = [s.id for s in parent_students]
-        if student_ids:
-            where_conditions["student_id"] = {"in": student_ids}
-        else:
-            return []  # Parent has no children
+    # Filters may narrow the scope but never widen it
+    if (student_id is not None and scope.role == 'parent' and not scope.can_access_student(student_id)) or \
+            (class_id is not None and scope.role == 'teacher' and not scope.can_access_class(class_id)):
+        return []
 
     # Apply additional filters
     if student_id is not None:
@@ -240,11 +221,11 @@ async def update_attendance_record(
         raise HTTPException(status_code=404, detail="Attendance record not found")
 
     # Authorization check
-    if user.role == 'teacher' and user.teacher:
-        if not await _teacher_can_access_student(prisma, user.teacher.id, attendance.student_id):
-            raise HTTPException(status_code=403, detail="Not allowed to modify this attendance record")
-    elif user.role != 'admin':
+    scope = await resolve_scope(user)
+    if scope.role not in ('admin', 'teacher'):
         raise HTTPException(status_code=403, detail="Forbidden")
+    if not scope.can_access_student(attendance.student_id):
+        raise HTTPException(status_code=403, detail="Not allowed to modify this attendance record")
 
     # Validate status if provided
     if status is not None:
@@ -269,6 +250,9 @@ async def update_attendance_record(
         where={"id": attendance_id},
         data=update_data
     )
+    if status is not None and status != attendance.status:
+        delivery_queue.submit("normal", notify_parents, [(
+            attendance.student_id, "attendance", f"{{student}}'s attendance on {attendance.date} changed to {status}")])
 
     return {
         "id": updated_attendance.id,
@@ -298,11 +282,11 @@ async def delete_attendance_record(
         raise HTTPException(status_code=404, detail="Attendance record not found")
 
     # Authorization check
-    if user.role == 'teacher' and user.teacher:
-        if not await _teacher_can_access_student(prisma, user.teacher.id, attendance.student_id):
-            raise HTTPException(status_code=403, detail="Not allowed to delete this attendance record")
-    elif user.role != 'admin':
+    scope = await resolve_scope(user)
+    if scope.role not in ('admin', 'teacher'):
         raise HTTPException(status_code=403, detail="Forbidden")
+    if not scope.can_access_student(attendance.student_id):
+        raise HTTPException(status_code=403, detail="Not allowed to delete this attendance record")
 
     # Delete the record
     await prisma.attendance.delete(where={"id": attendance_id})
@@ -322,29 +306,15 @@ async def get_attendance_summary(
     """Get attendance summary statistics"""
 
     # Build base filter conditions
-    where_conditions = {}
-
-    if user.role == 'teacher' and user.teacher:
-        teacher_classes = await prisma.classmodel.find_many(
-            where={"teacher_id": user.teacher.id},
-            select={"id": True}
-        )
-        class_ids = [cls.id for cls in teacher_classes]
-        if class_ids:
-            where_conditions["class_id"] = {"in": class_ids}
-        else:
-            return {"total": 0, "present": 0, "absent": 0, "late": 0, "excused": 0, "percentage": 0}
-
-    elif user.role == 'parent' and user.parent:
-        parent_students = await prisma.student.find_many(
-            where={"parent_id": user.parent.id},
-            select={"id": True}
-        )
-        student_ids = [s.id for s in parent_students]
-        if student_ids:
-            where_conditions["student_id"] = {"in": student_ids}
-        else:
-            return {"total": 0, "present": 0, "absent": 0, "late": 0, "excused": 0, "percentage": 0}
+    scope = await resolve_scope(user)
+    if scope.is_empty:
+        return {"total": 0, "present": 0, "absent": 0, "late": 0, "excused": 0, "percentage": 0}
+    where_conditions = dict(scope.attendance_where() or {})
+
+    # Filters may narrow the scope but never widen it
+    if (student_id is not None and scope.role == 'parent' and not scope.can_access_student(student_id)) or \
+            (class_id is not None and scope.role == 'teacher' and not scope.can_access_class(class_id)):
+        return {"total": 0, "present": 0, "absent": 0, "late": 0, "excused": 0, "percentage": 0}
 
     # Apply filters
     if student_id is not None:
@@ -5,6 +5,9 @@ from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
 from typing import Optional
 from app.db.prisma_client import prisma
+from app.core import realtime
+from app.core.cache import KeyedCache
+from app.services import email as email_service
 from typing import Any
 
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret")
@@ -16,6 +19,11 @@ LOGIN_WINDOW_SEC = int(os.getenv("LOGIN_RATE_WINDOW", "300"))
 
 _login_attempts = {}  # ip -> [timestamps]
 
+# user_id -> user with parent/teacher loaded. Every authenticated request and
+# websocket handshake resolves its principal here instead of re-reading the row.
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", "30"))
+_principal_cache = KeyedCache(maxsize=4096, ttl=PRINCIPAL_CACHE_TTL)
+
 pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 # Optional scheme to allow missing tokens without triggering a 401 automatically
@@ -72,15 +80,35 @@ def validate_refresh(user: Any, token: str) -> bool:
         return False
     return _hash_refresh(token) == user.refresh_token_hash
 
-async def verify_token(token: str):
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
-        user_id = int(payload.get("sub"))
+async def load_principal(user_id: int):
+    user = _principal_cache.get(user_id)
+    if user is None:
         # Include role relations so downstream role-based filters work
-        return await prisma.user.find_unique(
+        user = await prisma.user.find_unique(
             where={"id": user_id},
             include={"parent": True, "teacher": True}
         )
+        if user:
+            _principal_cache.set(user_id, user)
+    return user
+
+async def forget_principal(user_id: Optional[int] = None):
+    """Drop a cached principal (all of them when user_id is None) in every worker."""
+    await realtime.publish("auth.principal", {"user_id": user_id})
+
+async def _on_principal_changed(data: dict):
+    if data.get("user_id") is None:
+        _principal_cache.clear()
+    else:
+        _principal_cache.pop(data["user_id"])
+
+realtime.subscribe("auth.principal", _on_principal_changed)
+
+async def verify_token(token: str):
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALG])
+        user_id = int(payload.get("sub"))
+        return await load_principal(user_id)
     except Exception:
         return None
 
@@ -137,6 +165,13 @@ async def refresh_token(payload: RefreshRequest):
     access = create_access_token(user.id)
     return TokenResponse(access_token=access, refresh_token=new_refresh, expires_in=ACCESS_EXP)
 
+async def send_verification_email(user, token: str) -> None:
+    await email_service.enqueue("verify_email", [(user.email, {
+        "name": user.name,
+        "token": token,
+        "link": f"{email_service.APP_BASE_URL}/verify-email?token={token}",
+    })], priority="high")
+
 @router.post("/request-email-verification")
 async def request_email_verification(payload: RequestEmail):
     email = LoginRequest.normalized_email(payload.email)
@@ -145,6 +180,7 @@ async def request_email_verification(payload: RequestEmail):
         return {"sent": True}
     token = secrets.token_urlsafe(32)
     await prisma.user.update(where={"id": user.id}, data={"email_verification_token": token, "email_verified": False})
+    await send_verification_email(user, token)
     resp = {"sent": True}
     if AUTH_DEV_MODE:
         resp["verification_token"] = token
@@ -156,6 +192,7 @@ async def verify_email(payload: VerifyEmail):
     if not user:
         raise HTTPException(status_code=400, detail="Invalid verification token")
     await prisma.user.update(where={"id": user.id}, data={"email_verified": True, "email_verification_token": None})
+    await forget_principal(user.id)
     return {"verified": True}
 
 @router.post("/forgot-password")
@@ -167,6 +204,11 @@ async def forgot_password(payload: ForgotPasswordRequest):
         reset_token = secrets.token_urlsafe(32)
         expires = (datetime.utcnow() + timedelta(hours=1)).isoformat()
         await prisma.user.update(where={"id": user.id}, data={"password_reset_token": reset_token, "password_reset_expires_at": expires})
+        await email_service.enqueue("password_reset", [(user.email, {
+            "name": user.name,
+            "token": reset_token,
+            "link": f"{email_service.APP_BASE_URL}/reset-password?token={reset_token}",
+        })], priority="high")
         resp = {"sent": True}
         if AUTH_DEV_MODE:
             resp["reset_token"] = reset_token
@@ -0,0 +1,86 @@
+from email.utils import parsedate_to_datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from pydantic import BaseModel
+
+from app.api.auth import get_current_user, load_principal
+from app.core.scope import resolve_scope
+from app.services import calendar, calendar_feeds
+
+router = APIRouter(prefix="/calendar", tags=["calendar"])
+
+ICS_MEDIA_TYPE = "text/calendar; charset=utf-8"
+
+class FeedTokenOut(BaseModel):
+    token: str
+    role_feed: str
+    class_feed_template: str  # replace {class_id}
+
+def _feed_base(request: Request, token: str) -> str:
+    return str(request.url_for("role_feed", token=token)).rsplit("/", 1)[0]
+
+@router.post("/feed-token", response_model=FeedTokenOut)
+async def create_feed_token(request: Request, user=Depends(get_current_user)):
+    """Issue (or rotate) the caller's feed token; shown once, only its hash is stored."""
+    token = await calendar_feeds.issue_token(user.id)
+    base = _feed_base(request, token)
+    return FeedTokenOut(token=token, role_feed=f"{base}/role.ics", class_feed_template=f"{base}/class/{{class_id}}.ics")
+
+@router.delete("/feed-token")
+async def revoke_feed_token(user=Depends(get_current_user)):
+    return {"revoked": await calendar_feeds.revoke_token(user.id)}
+
+async def _feed_user(token: str):
+    user_id = await calendar_feeds.token_user_id(token)
+    user = await load_principal(user_id) if user_id is not None else None
+    if not user:
+        raise HTTPException(status_code=404, detail="Feed not found")
+    role = (getattr(user, 'role', '') or '').lower()
+    if role not in calendar_feeds.ROLES:
+        raise HTTPException(status_code=404, detail="Feed not found")
+    return user, role
+
+def _not_modified(request: Request, etag: str, last_modified) -> bool:
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        return etag in [t.strip() for t in if_none_match.split(',')] or if_none_match.strip() == '*'
+    since = request.headers.get('if-modified-since')
+    if since:
+        try:
+            return calendar.as_utc(last_modified) <= calendar.as_utc(parsedate_to_datetime(since))
+        except (TypeError, ValueError):
+            return False
+    return False
+
+async def _serve(request: Request, role: str, class_id=None):
+    try:
+        etag, last_modified, body = await calendar_feeds.cached_feed(role, class_id)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Feed not found")
+    headers = {'ETag': etag, 'Last-Modified': calendar_feeds.http_date(last_modified),
+               'Cache-Control': 'private, no-cache'}
+    if _not_modified(request, etag, last_modified):
+        calendar_feeds.stats["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    calendar_feeds.stats["served"] += 1
+    return Response(content=body, media_type=ICS_MEDIA_TYPE, headers=headers)
+
+@router.get("/feeds/{token}/role.ics", name="role_feed")
+async def role_feed(token: str, request: Request):
+    """School-wide events for the token owner's role."""
+    _, role = await _feed_user(token)
+    return await _serve(request, role)
+
+@router.get("/feeds/{token}/class/{class_id}.ics")
+async def class_feed(token: str, class_id: int, request: Request):
+    """Events of one class the token owner can see (their own or their children's)."""
+    user, role = await _feed_user(token)
+    if not (await resolve_scope(user)).can_access_class(class_id):
+        raise HTTPException(status_code=404, detail="Feed not found")
+    return await _serve(request, role, class_id)
+
+@router.get("/feeds/stats")
+async def feed_stats(user=Depends(get_current_user)):
+    if (getattr(user, 'role', '') or '').lower() != 'admin':
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return calendar_feeds.feed_stats()
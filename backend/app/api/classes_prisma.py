@@ -1,8 +1,11 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
-from typing import List, Optional
+from fastapi import APIRouter, Depends, Query, HTTPException, Response
+from typing import List, Optional, Union
 from pydantic import BaseModel
 from app.api.auth import get_current_user, get_current_user_or_dev, require_role
 from app.db.prisma_client import prisma
+from app.core.scope import resolve_scope, invalidate_scopes
+from app.core.pagination import paginate
+from app.core import totals
 
 router = APIRouter(prefix="/classes", tags=["classes"])  # replacing legacy
 
@@ -30,27 +33,25 @@ async def create_class(payload: ClassCreate, user=Depends(require_role("admin"))
         'subjects': ",".join(payload.subjects) if payload.subjects else None,
         'expected_students': payload.expected_students,
     })
+    if cls.teacher_id is not None:
+        await invalidate_scopes()
+    await totals.record("classmodel", added=[cls])
     subs = cls.subjects.split(',') if cls.subjects else []
     return ClassOut(id=cls.id, name=cls.name, teacher_id=cls.teacher_id, room=cls.room, subjects=subs, expected_students=cls.expected_students)
 
-@router.get("/", response_model=List[ClassOut])
-async def list_classes(user=Depends(get_current_user_or_dev), offset: int = Query(0, ge=0), limit: int = Query(50, le=100), with_meta: bool = Query(False)):
-    where = {}
-    if user.role == 'teacher' and user.teacher:
-        where['teacher_id'] = user.teacher.id
-    elif user.role == 'parent' and user.parent:
-        # classes of their children
-        children = await prisma.student.find_many(where={'parent_id': user.parent.id})
-        class_ids = list({c.class_id for c in children if c.class_id})
-        if class_ids:
-            where['id'] = {'in': class_ids}
-        else:
-            return [] if not with_meta else {"data": [], "meta": {"total": 0, "offset": offset, "limit": limit}}  # type: ignore
-    total = await prisma.classmodel.count(where=where or None)
-    classes = await prisma.classmodel.find_many(where=where or None, skip=offset, take=limit, order={'id': 'desc'})
+@router.get("/", response_model=Union[List[ClassOut], dict])
+async def list_classes(response: Response, user=Depends(get_current_user_or_dev), offset: int = Query(0, ge=0), limit: int = Query(50, le=100),
+                       with_meta: bool = Query(False), cursor: Optional[str] = None, approximate: bool = Query(False)):
+    """``approximate=true`` lets ``meta.total`` come from a possibly stale cached count instead of waiting for a recount."""
+    scope = await resolve_scope(user)
+    if scope.is_empty or (scope.role == 'parent' and not scope.class_ids):
+        return [] if not with_meta else {"data": [], "meta": {"total": 0, "offset": offset, "limit": limit, "approximate": False}}  # type: ignore
+    where = dict(scope.class_where() or {})
+    classes = await paginate(prisma.classmodel, where=where, limit=limit, offset=offset, cursor=cursor, response=response)
     out = [ClassOut(id=c.id, name=c.name, teacher_id=c.teacher_id, room=c.room, subjects=c.subjects.split(',') if c.subjects else [], expected_students=c.expected_students) for c in classes]
     if with_meta:
-        return {"data": out, "meta": {"total": total, "offset": offset, "limit": limit}}  # type: ignore
+        total, exact = await totals.total("classmodel", where, approximate)
+        return {"data": out, "meta": {"total": total, "offset": offset, "limit": limit, "approximate": not exact}}  # type: ignore
     return out
 
 @router.patch("/{class_id}", response_model=ClassOut)
@@ -67,7 +68,11 @@ async def update_class(class_id: int, payload: dict, user=Depends(get_current_us
     if 'subjects' in payload and isinstance(payload['subjects'], list):
         data['subjects'] = ",".join(payload['subjects'])
     if data:
+        old = cls
         cls = await prisma.classmodel.update(where={'id': class_id}, data=data)
+        if 'teacher_id' in data:
+            await invalidate_scopes()
+            await totals.record("classmodel", added=[cls], removed=[old])
     subs = cls.subjects.split(',') if cls.subjects else []
     return ClassOut(id=cls.id, name=cls.name, teacher_id=cls.teacher_id, room=cls.room, subjects=subs, expected_students=cls.expected_students)
 
@@ -79,4 +84,6 @@ async def delete_class(class_id: int, user=Depends(get_current_user_or_dev)):
     if not cls:
         raise HTTPException(status_code=404, detail="Class not found")
     await prisma.classmodel.delete(where={'id': class_id})
+    await invalidate_scopes()
+    await totals.record("classmodel", removed=[cls])
     return {"deleted": True}
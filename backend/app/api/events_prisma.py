@@ -1,11 +1,21 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Request, Response
 from typing import List, Optional
+from datetime import datetime, timedelta
 from pydantic import BaseModel
 from app.api.auth import get_current_user, get_current_user_or_dev
 from app.db.prisma_client import prisma
+from app.core.delivery import delivery_queue
+from app.core.pagination import paginate
+from app.core.scope import resolve_scope
+from app.services import calendar
+from app.services.digest import notify_class_parents
 
 router = APIRouter(prefix="/events", tags=["events"])  # replacing legacy
 
+EVENT_FIELDS = {"title", "description", "date", "time", "type", "status", "audience", "class_id", "starts_at", "ends_at", "rrule", "exdates"}
+AUDIENCES = {"all", "parent", "teacher", "admin"}
+PARENT_AUDIENCES = {"all", "parent"}
+
 class EventCreate(BaseModel):
     title: str
     description: Optional[str] = None
@@ -13,6 +23,12 @@ class EventCreate(BaseModel):
     time: Optional[str] = None
     type: Optional[str] = None
     status: Optional[str] = None
+    audience: Optional[str] = None  # all | parent | teacher | admin (default all)
+    class_id: Optional[int] = None  # class events show only in that class's feeds
+    starts_at: Optional[datetime] = None
+    ends_at: Optional[datetime] = None
+    rrule: Optional[str] = None  # e.g. FREQ=WEEKLY;BYDAY=TU;UNTIL=20250725
+    exdates: Optional[List[str]] = None  # YYYY-MM-DD occurrences to skip
 
 class EventOut(BaseModel):
     id: int
@@ -22,48 +38,119 @@ class EventOut(BaseModel):
     time: Optional[str]
     type: Optional[str]
     status: str
+    audience: str = "all"
+    class_id: Optional[int] = None
+    starts_at: Optional[str] = None
+    ends_at: Optional[str] = None
+    rrule: Optional[str] = None
+    exdates: List[str] = []
+    occurrence: bool = False  # one expanded occurrence of a recurring event
 
-@router.post("/", response_model=EventOut)
-<<<<<<< HEAD
-async def create_event(payload: EventCreate, user=Depends(require_role("admin"))):
-    # Ensure status is set if not provided
-    event_data = payload.dict()
-    if not event_data.get("status"):
-        event_data["status"] = "scheduled"
-    
-    ev = await prisma.event.create(data=event_data)
-=======
-async def create_event(payload: EventCreate, user=Depends(get_current_user_or_dev)):
+def _require_admin(user):
     # Allow only admins; in dev mode, the dev user has role 'admin'
     if (getattr(user, 'role', None) or '').lower() != 'admin':
         raise HTTPException(status_code=403, detail="Forbidden")
-    ev = await prisma.event.create(data=payload.dict())
->>>>>>> 531a8cc5ace9cbff3807ed96b99e4e6a2e7e3aa1
-    return EventOut(**ev.dict())
+
+def _with_recurrence(data: dict, current=None) -> dict:
+    try:
+        return calendar.with_recurrence(data, current)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _check_audience(data: dict):
+    if "audience" in data:
+        data["audience"] = (data["audience"] or "all").strip().lower()
+        if data["audience"] not in AUDIENCES:
+            raise HTTPException(status_code=400, detail="Invalid audience")
+
+async def _visible_where(user) -> Optional[dict]:
+    scope = await resolve_scope(user)
+    return calendar.visible_where(scope.role, scope.class_ids, scope.unrestricted)
+
+def _check_window(data: dict):
+    starts_at, ends_at = calendar.as_utc(data.get("starts_at")), calendar.as_utc(data.get("ends_at"))
+    if starts_at and ends_at and ends_at <= starts_at:
+        raise HTTPException(status_code=400, detail="ends_at must be after starts_at")
+
+@router.post("/", response_model=EventOut)
+async def create_event(payload: EventCreate, user=Depends(get_current_user_or_dev)):
+    _require_admin(user)
+    event_data = {k: v for k, v in payload.dict().items() if v is not None}
+    for key in ("starts_at", "ends_at"):
+        if key in event_data:
+            event_data[key] = calendar.as_utc(event_data[key])
+    # Ensure status is set if not provided
+    event_data.setdefault("status", "scheduled")
+    _check_audience(event_data)
+    event_data = calendar.with_window(event_data)
+    if event_data.get("starts_at") and not event_data.get("ends_at"):
+        event_data["ends_at"] = event_data["starts_at"] + timedelta(minutes=calendar.EVENT_DEFAULT_MINUTES)
+    _check_window(event_data)
+    event_data = _with_recurrence(event_data)
+    ev = await prisma.event.create(data=event_data)
+    await calendar.events_changed()
+    if (ev.audience or "all") in PARENT_AUDIENCES:
+        when = f" on {ev.date}" if ev.date else ""
+        delivery_queue.submit("normal", notify_class_parents, [ev.class_id], "event", f"New event: {ev.title}{when}")
+    return EventOut(**calendar.event_dict(ev))
 
 @router.get("/", response_model=List[EventOut])
-async def list_events(user=Depends(get_current_user_or_dev), offset: int = Query(0, ge=0), limit: int = Query(50, le=100)):
-    events = await prisma.event.find_many(skip=offset, take=limit, order={'id': 'desc'})
-    return [EventOut(**e.dict()) for e in events]
+async def list_events(response: Response, user=Depends(get_current_user_or_dev), offset: int = Query(0, ge=0), limit: int = Query(50, le=100),
+                      cursor: Optional[str] = None):
+    events = await paginate(prisma.event, where=await _visible_where(user), limit=limit, offset=offset, cursor=cursor, response=response)
+    return [EventOut(**calendar.event_dict(e)) for e in events]
+
+@router.get("/range", response_model=List[EventOut])
+async def events_in_range(request: Request, user=Depends(get_current_user_or_dev),
+                          from_: str = Query(..., alias="from"), to: str = Query(...), type: Optional[str] = None):
+    """Events overlapping [from, to), earliest first; ISO dates or datetimes (UTC if no offset).
+
+    Only events the caller's role and classes may see are returned. Served
+    with an ETag that changes whenever any event is written, so an unchanged
+    calendar answers If-None-Match with 304.
+    """
+    try:
+        start, end = calendar.parse_instant(from_), calendar.parse_instant(to)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from and to must be ISO dates or datetimes")
+    if end <= start:
+        raise HTTPException(status_code=400, detail="to must be after from")
+    if end - start > timedelta(days=calendar.CALENDAR_MAX_RANGE_DAYS):
+        raise HTTPException(status_code=400, detail=f"Range is limited to {calendar.CALENDAR_MAX_RANGE_DAYS} days")
+    etag, body = await calendar.cached_range(start, end, type, await _visible_where(user))
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+    if etag in [t.strip() for t in (request.headers.get('if-none-match') or '').split(',')]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @router.patch("/{event_id}", response_model=EventOut)
 async def update_event(event_id: int, payload: dict, user=Depends(get_current_user_or_dev)):
-    if (getattr(user, 'role', None) or '').lower() != 'admin':
-        raise HTTPException(status_code=403, detail="Forbidden")
+    _require_admin(user)
     ev = await prisma.event.find_unique(where={'id': event_id})
     if not ev:
         raise HTTPException(status_code=404, detail="Event not found")
-    data = {k: v for k, v in payload.items() if k in {"title","description","date","time","type","status"}}
+    data = {k: v for k, v in payload.items() if k in EVENT_FIELDS}
+    _check_audience(data)
+    for key in ("starts_at", "ends_at"):
+        if data.get(key):
+            try:
+                data[key] = calendar.parse_instant(data[key])
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail=f"{key} must be an ISO datetime")
+    data = calendar.with_window(data, ev)
+    _check_window({"starts_at": data.get("starts_at", ev.starts_at), "ends_at": data.get("ends_at", ev.ends_at)})
+    data = _with_recurrence(data, ev)
     if data:
         ev = await prisma.event.update(where={'id': event_id}, data=data)
-    return EventOut(**ev.dict())
+        await calendar.events_changed()
+    return EventOut(**calendar.event_dict(ev))
 
 @router.delete("/{event_id}")
 async def delete_event(event_id: int, user=Depends(get_current_user_or_dev)):
-    if (getattr(user, 'role', None) or '').lower() != 'admin':
-        raise HTTPException(status_code=403, detail="Forbidden")
+    _require_admin(user)
     ev = await prisma.event.find_unique(where={'id': event_id})
     if not ev:
         raise HTTPException(status_code=404, detail="Event not found")
     await prisma.event.delete(where={'id': event_id})
+    await calendar.events_changed()
     return {"deleted": True}
@@ -1,19 +1,44 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, BackgroundTasks, Depends, Query, HTTPException, Response
 from typing import List, Optional
 from datetime import datetime
 from prisma import models
+import json
+import uuid
 
 from app.db.prisma_client import prisma
-from app.api.auth import get_current_user, get_current_user_or_dev, require_role
+from app.api.auth import get_current_user, get_current_user_or_dev, require_role, load_principal
+from app.core import realtime
+from app.core.delivery import PRIORITIES, chunks, delivery_queue
+from app.core.pagination import paginate, parse_cursor, set_next_cursor
+from app.core.scope import resolve_scope
+from app.services import conversations, email as email_service, message_archive, unread
+from app.services.message_search import count_matches, search_messages
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/messages", tags=["messages"])  # canonical path
 
+# Role-wide audiences are stored once (recipient_id NULL) and resolved at read time
+ANNOUNCEMENT_AUDIENCES = {'all_parents': 'parent', 'all_teachers': 'teacher', 'all_admins': 'admin', 'all': 'all'}
+MESSAGE_TYPES = ('general', 'announcement', 'alert')
+
+def _priority_and_type(priority: Optional[str], message_type: Optional[str], default_type: str) -> tuple:
+    """Validate the delivery fields; alerts default to the urgent lane."""
+    message_type = (message_type or default_type).lower()
+    if message_type not in MESSAGE_TYPES:
+        raise HTTPException(status_code=400, detail="Invalid message_type")
+    priority = (priority or ('urgent' if message_type == 'alert' else 'normal')).lower()
+    if priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail="Invalid priority")
+    return priority, message_type
+
 class MessageCreate(BaseModel):
     subject: str
     body: str
     recipient_id: Optional[int] = None
     recipient_role: Optional[str] = None
+    reply_to_id: Optional[int] = None
+    priority: Optional[str] = None  # urgent | high | normal
+    message_type: Optional[str] = None  # general | announcement | alert
 
 class MessageOut(BaseModel):
     id: int
@@ -24,168 +49,375 @@ class MessageOut(BaseModel):
     recipient_role: Optional[str]
     created_at: str
     read_at: Optional[str]
+    message_type: Optional[str] = None
+    priority: Optional[str] = None
+    reply_to_id: Optional[int] = None
+    conversation_key: Optional[str] = None
+    archived: bool = False
 
     class Config:
         from_attributes = True
 
+def _recipient_role(value: Optional[str]) -> Optional[str]:
+    """Canonical stored role ('parent', ..., 'all'); audience names like 'all_parents' are accepted too."""
+    if value is None or not value.strip():
+        return None
+    role = value.strip().lower()
+    role = ANNOUNCEMENT_AUDIENCES.get(role, role)
+    if role not in ANNOUNCEMENT_AUDIENCES.values():
+        raise HTTPException(status_code=422, detail="recipient_role must be one of: " + ", ".join(sorted(ANNOUNCEMENT_AUDIENCES.values())))
+    return role
+
+def _announcement_where(role: str) -> dict:
+    return {'recipient_id': None, 'recipient_role': {'in': [role, 'all']}}
+
+def _visible_where(user) -> dict:
+    role = (getattr(user, 'role', '') or '').lower()
+    return {'OR': [{'sender_id': user.id}, {'recipient_id': user.id}, _announcement_where(role)]}
+
+def _message_out(m, user_id: Optional[int] = None) -> MessageOut:
+    data = m.dict(exclude={'receipts', 'sender', 'recipient'})
+    data['body'] = data.get('body') or ''
+    if m.recipient_id is None and m.recipient_role:
+        # announcements keep per-user read state in MessageReceipt
+        receipts = getattr(m, 'receipts', None) or []
+        data['read_at'] = next((r.read_at for r in receipts if r.user_id == user_id), None)
+    return MessageOut(**data)
+
+async def _push_message(frame: str, user_ids: list, recipient_id: Optional[int]):
+    await realtime.send_to_users(frame, user_ids)
+    if recipient_id:
+        recipient = await load_principal(recipient_id)
+        if recipient:
+            await unread.push_unread([(recipient.id, recipient.role)])
+
 @router.post("/", response_model=MessageOut)
 async def create_message(payload: MessageCreate, user=Depends(get_current_user)):
+    priority, message_type = _priority_and_type(payload.priority, payload.message_type, 'general')
+    recipient_role = _recipient_role(payload.recipient_role)
+    recipient_id = payload.recipient_id
+    conversation_key = None
+    if payload.reply_to_id is not None:
+        parent = await prisma.message.find_first(where={'AND': [{'id': payload.reply_to_id}, _visible_where(user)]})
+        if not parent:
+            raise HTTPException(status_code=404, detail="Message to reply to not found")
+        if recipient_id is None:
+            # reply to whoever is on the other side of the parent message
+            recipient_id = parent.sender_id if parent.sender_id != user.id else parent.recipient_id
+        if recipient_id is None:
+            raise HTTPException(status_code=400, detail="recipient_id is required")
+        conversation_key = parent.conversation_key
+    if recipient_id is None and recipient_role and user.role != 'admin':
+        raise HTTPException(status_code=403, detail="Only admins can message a whole role")
+    if recipient_id is not None and conversation_key is None:
+        conversation_key = conversations.pair_key(user.id, recipient_id)
     msg = await prisma.message.create(
         data={
             "subject": payload.subject,
             "body": payload.body,
             "sender_id": user.id,
-            "recipient_id": payload.recipient_id,
-            "recipient_role": payload.recipient_role,
+            "recipient_id": recipient_id,
+            "recipient_role": recipient_role,
+            "reply_to_id": payload.reply_to_id,
+            "conversation_key": conversation_key,
+            "priority": priority,
+            "message_type": message_type,
             "created_at": datetime.utcnow().isoformat()
         }
     )
-    # echo via websocket if manager available
-    try:
-        from app.api.websockets import manager
-        import json
-        message_dict = {
-            "id": msg.id,
-            "subject": msg.subject,
-            "body": msg.body,
-            "sender_id": msg.sender_id,
-            "recipient_id": msg.recipient_id,
-            "recipient_role": msg.recipient_role,
-            "created_at": msg.created_at,
-            "read_at": msg.read_at,
-        }
-        if msg.recipient_id:
-            await manager.send_personal_message(json.dumps(message_dict), msg.recipient_id)
-        if msg.sender_id != msg.recipient_id:
-            await manager.send_personal_message(json.dumps(message_dict), msg.sender_id)
-    except Exception:
-        pass
-    return MessageOut(**msg.dict())
+    if conversation_key:
+        await conversations.record_message(msg.id)
+    if msg.recipient_id:
+        await unread.on_direct_messages([msg.recipient_id])
+    elif msg.recipient_role:
+        await unread.on_announcement(msg.recipient_role)
+    # websocket echo goes through the delivery lane for the message's priority
+    message_dict = {
+        "id": msg.id,
+        "subject": msg.subject,
+        "body": msg.body,
+        "sender_id": msg.sender_id,
+        "recipient_id": msg.recipient_id,
+        "recipient_role": msg.recipient_role,
+        "created_at": msg.created_at,
+        "read_at": msg.read_at,
+        "reply_to_id": msg.reply_to_id,
+        "conversation_key": msg.conversation_key,
+        "priority": msg.priority,
+        "message_type": msg.message_type,
+    }
+    delivery_queue.submit(msg.priority, _push_message, json.dumps(message_dict), [msg.recipient_id, msg.sender_id], msg.recipient_id)
+    return _message_out(msg, user.id)
 
 @router.get("/", response_model=List[MessageOut])
-async def list_messages(user=Depends(get_current_user_or_dev), offset: int = Query(0, ge=0), limit: int = Query(50, le=100)):
-    # Admin can see all messages, others only see their own
+async def list_messages(response: Response, user=Depends(get_current_user_or_dev), offset: int = Query(0, ge=0), limit: int = Query(50, le=100),
+                        include_archived: bool = False, cursor: Optional[str] = None):
+    # Admin can see all messages, others see their own plus announcements for their role
+    where = None
     if user.role == "admin":
-        msgs = await prisma.message.find_many(
-            skip=offset,
-            take=limit,
-            order={'id': 'desc'}
-        )
+        msgs = await paginate(prisma.message, limit=limit, offset=offset, cursor=cursor)
     else:
-        msgs = await prisma.message.find_many(
-            where={
-                'OR': [
-                    {'sender_id': user.id},
-                    {'recipient_id': user.id}
-                ]
-            },
-            skip=offset,
-            take=limit,
-            order={'id': 'desc'}
+        where = _visible_where(user)
+        msgs = await paginate(prisma.message, where=where, limit=limit, offset=offset, cursor=cursor,
+                              include={'receipts': {'where': {'user_id': user.id}}})
+    out = [_message_out(m, user.id) for m in msgs]
+    if include_archived and len(out) < limit:
+        # archived messages are all older than hot ones, so they continue the same order
+        if cursor:
+            before = out[-1].id if out else parse_cursor(cursor)[0]
+            older = await message_archive.archived_messages(user, limit=limit - len(out), predicate=lambda r: r["id"] < before)
+        else:
+            hot_total = offset + len(msgs) if msgs else await prisma.message.count(where=where)
+            older = await message_archive.archived_messages(user, offset=max(offset - hot_total, 0), limit=limit - len(out))
+        out += [MessageOut(**m) for m in older]
+    set_next_cursor(response, out, limit)
+    return out
+
+class MessageSearchHit(MessageOut):
+    subject_highlight: str
+    snippet: str
+    score: float
+
+@router.get("/search", response_model=List[MessageSearchHit])
+async def search(q: str = Query(..., min_length=1, max_length=200), prefix: bool = False,
+                 sort: str = Query("rank", pattern="^(rank|recent)$"), include_archived: bool = False,
+                 user=Depends(get_current_user_or_dev), offset: int = Query(0, ge=0), limit: int = Query(20, le=100)):
+    # Ranked by bm25 (subject weighted); snippets are HTML-escaped with <mark> around hits
+    rows = await search_messages(user, q, prefix=prefix, sort=sort, offset=offset, limit=limit)
+    hits = [MessageSearchHit(**row) for row in rows]
+    if include_archived and len(hits) < limit:
+        # the archive has no FTS index; it is scanned (newest first) only on request
+        hot_total = offset + len(rows) if rows else await count_matches(user, q, prefix=prefix)
+        older = await message_archive.archived_messages(
+            user, offset=max(offset - hot_total, 0), limit=limit - len(hits),
+            predicate=message_archive.text_predicate(q, prefix),
         )
-    return [MessageOut(**m.dict()) for m in msgs]
+        hits += [MessageSearchHit(**m, **message_archive.highlight(m, q, prefix), score=0.0) for m in older]
+    return hits
 
-<<<<<<< HEAD
-# Admin-only endpoint to send messages to all users of a specific role
-class BroadcastMessagePayload(BaseModel):
-    subject: str
-    body: str
-    recipient_role: str  # "teacher", "parent", "admin", or "all"
+@router.get("/unread-count", response_model=dict)
+async def unread_count(user=Depends(get_current_user)):
+    # served from maintained counters: one primary-key lookup, no message scan
+    return (await unread.unread_counts([(user.id, user.role)]))[user.id]
+
+class MarkReadRequest(BaseModel):
+    ids: Optional[List[int]] = None
+    up_to_id: Optional[int] = None
+    conversation_key: Optional[str] = None
+
+@router.post("/read", response_model=dict)
+async def mark_messages_read(payload: MarkReadRequest, user=Depends(get_current_user)):
+    if not payload.ids and payload.up_to_id is None and not payload.conversation_key:
+        raise HTTPException(status_code=400, detail="Provide ids, up_to_id or conversation_key")
+    if payload.ids and len(payload.ids) > 500:
+        raise HTTPException(status_code=400, detail="At most 500 ids per request; use up_to_id for ranges")
+    marked = await unread.mark_read(user, ids=payload.ids, up_to_id=payload.up_to_id, conversation_key=payload.conversation_key)
+    if marked["direct"]:
+        await conversations.refresh_unread(user.id)
+    return {"marked": marked, "unread": (await unread.unread_counts([(user.id, user.role)]))[user.id]}
+
+
+class ConversationOut(BaseModel):
+    key: str
+    peer_id: Optional[int]
+    peer_name: Optional[str]
+    last_message_id: int
+    last_activity: str
+    unread_count: int
+    subject: Optional[str]
+    preview: str
+    last_sender_id: Optional[int]
+
+@router.get("/inbox", response_model=List[ConversationOut])
+async def inbox(response: Response, user=Depends(get_current_user), cursor: Optional[str] = None, limit: int = Query(20, ge=1, le=100)):
+    """Conversations by last activity; pass the X-Next-Cursor header back as ``cursor`` for the next page."""
+    after = None
+    if cursor:
+        after = conversations.decode_cursor(cursor)
+        if after is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    rows = await conversations.inbox(user.id, limit=limit, after=after)
+    if len(rows) == limit:
+        response.headers['X-Next-Cursor'] = conversations.encode_cursor(rows[-1]['last_activity'], rows[-1]['key'])
+    return [ConversationOut(
+        key=r['key'], peer_id=r['peer_id'], peer_name=r['peer_name'],
+        last_message_id=r['last_message_id'], last_activity=r['last_activity'], unread_count=r['unread_count'],
+        subject=r['subject'], preview=(r['body'] or '')[:140], last_sender_id=r['sender_id'],
+    ) for r in rows]
+
+@router.get("/conversations/{key}", response_model=List[MessageOut])
+async def conversation_messages(key: str, user=Depends(get_current_user_or_dev), before_id: Optional[int] = None, limit: int = Query(50, ge=1, le=100)):
+    if (getattr(user, 'role', '') or '').lower() != 'admin':
+        member = await prisma.conversation.find_unique(where={'user_id_key': {'user_id': user.id, 'key': key}})
+        if not member:
+            raise HTTPException(status_code=404, detail="Conversation not found")
+    where: dict = {'conversation_key': key}
+    if before_id is not None:
+        where['id'] = {'lt': before_id}
+    # newest first on the (conversation_key, id) index; page with before_id
+    msgs = await prisma.message.find_many(where=where, order={'id': 'desc'}, take=limit)
+    return [_message_out(m, user.id) for m in msgs]
+
+
+@router.post("/archive/run", response_model=dict)
+async def run_message_archive(background_tasks: BackgroundTasks, force: bool = False, max_batches: Optional[int] = Query(None, ge=1),
+                              user=Depends(get_current_user_or_dev)):
+    """Start an archival pass; outside the off-peak window it only runs with force=true."""
+    if (getattr(user, 'role', '') or '').lower() != 'admin':
+        raise HTTPException(status_code=403, detail="Forbidden")
+    background_tasks.add_task(message_archive.run_archival, force, max_batches)
+    return {"scheduled": True, "cutoff": message_archive.retention_cutoff(), "in_window": message_archive.in_offpeak_window()}
+
+@router.get("/email/status", response_model=dict)
+async def email_outbox_status(user=Depends(get_current_user_or_dev)):
+    if (getattr(user, 'role', '') or '').lower() != 'admin':
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return await email_service.email_status()
+
+@router.get("/archive/status", response_model=dict)
+async def message_archive_status(user=Depends(get_current_user_or_dev)):
+    if (getattr(user, 'role', '') or '').lower() != 'admin':
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return await message_archive.archive_status()
 
-@router.post("/broadcast", response_model=MessageOut)
-async def broadcast_message(payload: BroadcastMessagePayload, admin=Depends(require_role("admin"))):
-    # Create a broadcast message
-    msg = await prisma.message.create(
-        data={
-            "subject": payload.subject,
-            "body": payload.body,
-            "sender_id": admin.id,
-            "recipient_id": None,  # No specific recipient for broadcast
-            "recipient_role": payload.recipient_role,
-            "created_at": datetime.utcnow().isoformat()
-        }
-    )
-    
-    # Echo via websocket if manager available
-    try:
-        from app.api.websockets import manager
-        import json
-        message_dict = {
-            "id": msg.id,
-            "subject": msg.subject,
-            "body": msg.body,
-            "sender_id": msg.sender_id,
-            "recipient_id": msg.recipient_id,
-            "recipient_role": msg.recipient_role,
-            "created_at": msg.created_at,
-            "read_at": msg.read_at,
-        }
-        # Send to all connected users of the specified role
-        await manager.broadcast_to_role(json.dumps(message_dict), payload.recipient_role)
-    except Exception:
-        pass
-    
-    return MessageOut(**msg.dict())
-=======
 
 class BroadcastRequest(BaseModel):
     subject: str
     body: Optional[str] = None
-    audience: str  # all_parents | all_teachers | class
+    audience: Optional[str] = None  # all_parents | all_teachers | all_admins | all | class
     class_id: Optional[int] = None
+    recipient_role: Optional[str] = None  # legacy form: parent | teacher | admin | all
+    priority: Optional[str] = None  # urgent | high | normal (default normal; alerts default urgent)
+    message_type: Optional[str] = None  # announcement | alert | general
+    email: bool = False  # also send an email copy to each recipient
+
+async def _push_frames(frames: list, recipients: list):
+    await realtime.send_frames(frames)
+    await unread.push_unread(recipients)
+
+async def _deliver_broadcast(broadcast_id: str):
+    """Push a stored broadcast to connected recipients in chunks on its priority lane.
+
+    Chunks are separate jobs so urgent deliveries run between them instead of
+    waiting for the whole audience.
+    """
+    msgs = await prisma.message.find_many(where={'broadcast_id': broadcast_id}, order={'id': 'asc'})
+    if not msgs:
+        return
+    first = msgs[0]
+    # Serialize the shared fields once; each frame only prepends its id/recipient
+    common = json.dumps({
+        'subject': first.subject,
+        'body': first.body,
+        'sender_id': first.sender_id,
+        'recipient_role': first.recipient_role,
+        'created_at': first.created_at,
+        'read_at': None,
+        'broadcast_id': broadcast_id,
+        'priority': first.priority,
+        'message_type': first.message_type,
+    })[1:]
+    # One bus event per chunk; each worker only enqueues frames for the recipients connected to it
+    for part in chunks([m for m in msgs if m.recipient_id]):
+        frames = [(m.recipient_id, f'{{"id": {m.id}, "recipient_id": {m.recipient_id}, {common}') for m in part]
+        delivery_queue.submit(first.priority, _push_frames, frames, [(m.recipient_id, 'parent') for m in part])
+
+async def _deliver_announcement(message_id: int):
+    msg = await prisma.message.find_unique(where={'id': message_id})
+    if not msg:
+        return
+    frame = json.dumps({
+        'id': msg.id,
+        'subject': msg.subject,
+        'body': msg.body,
+        'sender_id': msg.sender_id,
+        'recipient_id': None,
+        'recipient_role': msg.recipient_role,
+        'created_at': msg.created_at,
+        'read_at': None,
+        'message_type': msg.message_type,
+        'priority': msg.priority,
+    })
+    await realtime.send_to_role(frame, msg.recipient_role)
+
+async def _email_copies(where: Optional[dict], subject: str, body: str, sender: str, priority: str):
+    users = await prisma.user.find_many(where=where)
+    await email_service.enqueue("broadcast", (
+        (u.email, {"name": u.name, "subject": subject, "body": body, "sender": sender})
+        for u in users if getattr(u, 'status', 'active') == 'active'
+    ), priority=priority)
 
 @router.post("/broadcast")
 async def broadcast_message(payload: BroadcastRequest, user=Depends(get_current_user_or_dev)):
     role = (getattr(user, 'role', '') or '').lower()
-    if role != 'admin' and not (role == 'teacher' and payload.audience == 'class'):
+    audience = payload.audience
+    if audience is None and payload.recipient_role:
+        legacy = payload.recipient_role.strip().lower()
+        audience = 'all' if legacy == 'all' else f"all_{legacy}s"
+    if role != 'admin' and not (role == 'teacher' and audience == 'class'):
         raise HTTPException(status_code=403, detail="Forbidden")
+    priority, message_type = _priority_and_type(
+        payload.priority, payload.message_type, 'announcement' if audience in ANNOUNCEMENT_AUDIENCES else 'general')
+
+    if audience in ANNOUNCEMENT_AUDIENCES:
+        # Fan-out-on-read: one row regardless of audience size
+        target_role = ANNOUNCEMENT_AUDIENCES[audience]
+        msg = await prisma.message.create(data={
+            'subject': payload.subject,
+            'body': payload.body or '',
+            'sender_id': getattr(user, 'id', None),
+            'recipient_id': None,
+            'recipient_role': target_role,
+            'message_type': message_type,
+            'priority': priority,
+            'created_at': datetime.utcnow().isoformat(),
+        })
+        await unread.on_announcement(target_role)
+        audience_size = await prisma.user.count(where=None if target_role == 'all' else {'role': target_role})
+        delivery_queue.submit(priority, _deliver_announcement, msg.id)
+        if payload.email:
+            delivery_queue.submit(priority, _email_copies, None if target_role == 'all' else {'role': target_role},
+                                  payload.subject, payload.body or '', getattr(user, 'name', None) or 'PTS Manager', priority)
+        return {"broadcast_id": None, "message_id": msg.id, "sent": 1, "recipient_count": audience_size}
 
     recipients: List[int] = []
-    if payload.audience == 'all_parents':
-        parents = await prisma.parent.find_many()
-        recipients = [p.user_id for p in parents]
-    elif payload.audience == 'all_teachers':
-        teachers = await prisma.teacher.find_many()
-        recipients = [t.user_id for t in teachers]
-    elif payload.audience == 'class':
+    if audience == 'class':
         if not payload.class_id:
             raise HTTPException(status_code=400, detail="class_id is required for class audience")
-        students = await prisma.student.find_many(where={'class_id': payload.class_id})
-        parent_ids = {s.parent_id for s in students if s.parent_id}
-        if parent_ids:
-            parents = await prisma.parent.find_many(where={'id': {'in': list(parent_ids)}})
-            recipients = [p.user_id for p in parents]
+        if role == 'teacher' and not (await resolve_scope(user)).can_access_class(payload.class_id):
+            raise HTTPException(status_code=403, detail="Forbidden")
+        parents = await prisma.parent.find_many(where={'students': {'some': {'class_id': payload.class_id}}})
+        recipients = [p.user_id for p in parents]
     else:
         raise HTTPException(status_code=400, detail="Invalid audience")
+    recipients = list(dict.fromkeys(recipients))
 
-    created_ids: List[int] = []
-    for uid in recipients:
-        msg = await prisma.message.create(data={
-            'subject': payload.subject,
-            'body': payload.body,
-            'sender_id': getattr(user, 'id', None),
-            'recipient_id': uid,
-            'recipient_role': 'parent' if payload.audience in ('all_parents','class') else 'teacher',
-            'created_at': datetime.utcnow().isoformat(),
-        })
-        created_ids.append(msg.id)
-        try:
-            from app.api.websockets import manager
-            import json
-            await manager.send_personal_message(json.dumps({
-                'id': msg.id,
-                'subject': msg.subject,
-                'body': msg.body,
-                'sender_id': msg.sender_id,
-                'recipient_id': msg.recipient_id,
-                'recipient_role': msg.recipient_role,
-                'created_at': msg.created_at,
-                'read_at': msg.read_at,
-            }), uid)
-        except Exception:
-            pass
-
-    return {"sent": len(created_ids), "recipient_count": len(recipients)}
+    # All rows land in one transaction so a failure never leaves a partial broadcast
+    broadcast_id = uuid.uuid4().hex
+    created_at = datetime.utcnow().isoformat()
+    sent = 0
+    if recipients:
+        async with prisma.tx() as tx:
+            sent = await tx.message.create_many(data=[{
+                'subject': payload.subject,
+                'body': payload.body or '',
+                'sender_id': getattr(user, 'id', None),
+                'recipient_id': uid,
+                'recipient_role': 'parent',
+                'created_at': created_at,
+                'broadcast_id': broadcast_id,
+                'conversation_key': conversations.pair_key(user.id, uid),
+                'priority': priority,
+                'message_type': message_type,
+            } for uid in recipients])
+        await conversations.record_broadcast(broadcast_id)
+        await unread.on_direct_messages(recipients)
+        delivery_queue.submit(priority, _deliver_broadcast, broadcast_id)
+        if payload.email:
+            delivery_queue.submit(priority, _email_copies, {'id': {'in': recipients}},
+                                  payload.subject, payload.body or '', getattr(user, 'name', None) or 'PTS Manager', priority)
+
+    return {"broadcast_id": broadcast_id, "sent": sent, "recipient_count": len(recipients)}
 
 
 @router.get("/admin", response_model=List[MessageOut])
@@ -193,5 +425,4 @@ async def admin_list_messages(user=Depends(get_current_user_or_dev), offset: int
     if (getattr(user, 'role', '') or '').lower() != 'admin':
         raise HTTPException(status_code=403, detail="Forbidden")
     msgs = await prisma.message.find_many(skip=offset, take=limit, order={'id': 'desc'})
-    return [MessageOut(**m.dict()) for m in msgs]
->>>>>>> 531a8cc5ace9cbff3807ed96b99e4e6a2e7e3aa1
+    return [_message_out(m) for m in msgs]
@@ -0,0 +1,54 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import List, Optional
+from pydantic import BaseModel
+
+from app.api.auth import get_current_user, get_current_user_or_dev
+from app.db.prisma_client import prisma
+from app.services import digest
+
+router = APIRouter(prefix="/notifications", tags=["notifications"])
+
+class PreferenceIn(BaseModel):
+    mode: str  # realtime | digest | off
+
+class PreferenceOut(BaseModel):
+    mode: str
+
+class DigestItemOut(BaseModel):
+    id: int
+    kind: str
+    text: str
+    created_at: str
+
+def _require_admin(user):
+    if (getattr(user, 'role', '') or '').lower() != 'admin':
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@router.get("/preferences", response_model=PreferenceOut)
+async def get_preference(user=Depends(get_current_user)):
+    return PreferenceOut(mode=(await digest.preference_modes([user.id]))[user.id])
+
+@router.put("/preferences", response_model=PreferenceOut)
+async def update_preference(payload: PreferenceIn, user=Depends(get_current_user)):
+    try:
+        return PreferenceOut(mode=await digest.set_preference(user.id, payload.mode.strip().lower()))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/digest/pending", response_model=List[DigestItemOut])
+async def pending_digest(user=Depends(get_current_user), limit: int = Query(100, ge=1, le=500)):
+    """Notifications waiting for the user's next digest."""
+    items = await prisma.digestitem.find_many(
+        where={'user_id': user.id, 'sent_at': None}, order={'id': 'asc'}, take=limit,
+    )
+    return [DigestItemOut(id=i.id, kind=i.kind, text=i.text, created_at=i.created_at) for i in items]
+
+@router.post("/digest/run", response_model=dict)
+async def run_digest(user=Depends(get_current_user_or_dev)):
+    _require_admin(user)
+    return await digest.send_digests()
+
+@router.get("/metrics", response_model=dict)
+async def notification_metrics(user=Depends(get_current_user_or_dev), days: Optional[int] = Query(None, ge=1, le=365)):
+    _require_admin(user)
+    return await digest.digest_metrics(days or digest.DIGEST_RETENTION_DAYS)
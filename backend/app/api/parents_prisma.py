@@ -1,8 +1,11 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Response
 from typing import List, Optional
 from pydantic import BaseModel
-from app.api.auth import get_current_user, get_current_user_or_dev, require_role
+from app.api.auth import get_current_user, get_current_user_or_dev, require_role, forget_principal
 from app.db.prisma_client import prisma
+from app.core.scope import invalidate_scopes
+from app.core.pagination import paginate
+from app.core import totals
 
 router = APIRouter(prefix="/parents", tags=["parents"])
 
@@ -25,11 +28,13 @@ async def create_parent(payload: ParentCreate, user=Depends(require_role("admin"
     if existing:
         raise HTTPException(status_code=400, detail="Parent already exists for user")
     parent = await prisma.parent.create(data=payload.dict())
+    await forget_principal(payload.user_id)
     return ParentOut(**parent.dict())
 
 @router.get("/", response_model=List[ParentOut])
-async def list_parents(user=Depends(get_current_user_or_dev), offset: int = Query(0, ge=0), limit: int = Query(50, le=100)):
-    parents = await prisma.parent.find_many(skip=offset, take=limit, order={"id": "desc"})
+async def list_parents(response: Response, user=Depends(get_current_user_or_dev), offset: int = Query(0, ge=0), limit: int = Query(50, le=100),
+                       cursor: Optional[str] = None):
+    parents = await paginate(prisma.parent, limit=limit, offset=offset, cursor=cursor, response=response)
     return [ParentOut(**p.dict()) for p in parents]
 
 @router.get("/engagement/admin", response_model=dict)
@@ -59,4 +64,7 @@ async def delete_parent(parent_id: int, user=Depends(get_current_user)):
     if not p:
         raise HTTPException(status_code=404, detail="Parent not found")
     await prisma.parent.delete(where={"id": parent_id})
+    await invalidate_scopes()
+    await totals.invalidate("student")  # their children's parent_id is set to null
+    await forget_principal(p.user_id)
     return {"deleted": True}
@@ -0,0 +1,36 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+from typing import Optional
+import os
+from app.api.auth import get_current_user, require_role
+from app.db.prisma_client import prisma
+from app.core.scope import resolve_scope
+from app.services.report_cards import card_path, generate_class_report_cards
+
+router = APIRouter(prefix="/report-cards", tags=["report-cards"])
+
+@router.post("/generate", response_model=dict)
+async def generate_report_cards(class_id: int, term: str, date_from: Optional[str] = None, date_to: Optional[str] = None, user=Depends(require_role("teacher"))):
+    scope = await resolve_scope(user)
+    if not scope.can_access_class(class_id):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    cards = await generate_class_report_cards(class_id, term.strip(), date_from, date_to)
+    rendered = sum(1 for c in cards if not c["cached"])
+    return {"class_id": class_id, "term": term.strip(), "rendered": rendered, "cached": len(cards) - rendered, "cards": cards}
+
+@router.get("/{student_id}")
+async def download_report_card(student_id: int, term: str, request: Request, user=Depends(get_current_user)):
+    scope = await resolve_scope(user)
+    if not scope.can_access_student(student_id):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    card = await prisma.reportcard.find_unique(where={'student_id_term': {'student_id': student_id, 'term': term.strip()}})
+    if not card:
+        raise HTTPException(status_code=404, detail="Report card not generated yet")
+    etag = f'"{card.digest}"'
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers={'ETag': etag})
+    path = card_path(card.digest)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Report card file missing; regenerate the class")
+    filename = f"report-card-{student_id}-{term.strip()}.html"
+    return FileResponse(path, media_type="text/html", filename=filename, headers={'ETag': etag, 'Cache-Control': 'private, max-age=0'})
@@ -1,9 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from typing import Any, Dict, Iterable, List, Optional
+from datetime import timedelta
+import json
 import time
 from pydantic import BaseModel
 from app.api.auth import get_current_user, get_current_user_or_dev, require_role
 from app.db.prisma_client import prisma
+from app.core import realtime
+from app.core.scope import resolve_scope
+from app.core.pagination import paginate
+from app.core.delivery import delivery_queue
+from app.services.digest import notify_parents
+from app.services.result_stats import class_term_stats
+from app.services.rankings import get_class_rankings, recompute_class_rankings
+from app.services.result_trends import student_trends
+from app.services.gradebook import cells_from_csv, cells_from_json, validate_cells
 
 router = APIRouter(prefix="/results", tags=["results"])
 
@@ -12,6 +23,14 @@ router = APIRouter(prefix="/results", tags=["results"])
 def _now_iso() -> str:
     return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
+async def _after_result_write(class_id: Optional[int], term: Optional[str], student_ids: Iterable[int] = ()):
+    # Keep derived read models in step with the Result table; the stats and
+    # trends caches subscribe to this in every worker
+    student_ids = [sid for sid in student_ids if sid is not None]
+    await realtime.publish("results.changed", {"class_id": class_id, "term": term, "student_ids": student_ids})
+    if class_id is not None and term:
+        await recompute_class_rankings(class_id, term)
+
 class ResultCreate(BaseModel):
     student_id: int
     class_id: Optional[int] = None
@@ -50,17 +69,14 @@ async def create_result(payload: ResultCreate, user=Depends(require_role("teache
         raise HTTPException(status_code=403, detail="Teacher profile not found. Please contact admin.")
     
     # teacher must own class of student
-    st = await prisma.student.find_unique(where={'id': payload.student_id})
-    if not st:
-        raise HTTPException(status_code=404, detail="Student not found")
-    cls = None
-    if st.class_id:
-        cls = await prisma.classmodel.find_unique(where={'id': st.class_id})
-    if not cls or cls.teacher_id != user.teacher.id:
+    scope = await resolve_scope(user)
+    if not scope.can_access_student(payload.student_id):
+        if not await prisma.student.find_unique(where={'id': payload.student_id}):
+            raise HTTPException(status_code=404, detail="Student not found")
         raise HTTPException(status_code=403, detail="Not allowed to post results for this student")
     res = await prisma.result.create(data={
         'student_id': payload.student_id,
-        'class_id': payload.class_id or st.class_id,
+        'class_id': payload.class_id or scope.student_classes[payload.student_id],
         'teacher_id': user.teacher.id,
         'subject': payload.subject.strip(),
         'term': payload.term.strip(),
@@ -70,31 +86,113 @@ async def create_result(payload: ResultCreate, user=Depends(require_role("teache
         'comments': payload.comments,
         'created_at': _now_iso(),
     })
+    await _after_result_write(res.class_id, res.term, [res.student_id])
+    delivery_queue.submit("normal", notify_parents, [(
+        res.student_id, "result", f"{{student}} has a new {res.subject} result for {res.term}: {res.score} ({res.grade})")])
     return ResultOut(**res.dict())
 
+class GradebookUpload(BaseModel):
+    class_id: int
+    term: str
+    date: Optional[str] = None
+    rows: List[Dict[str, Any]]
+
+@router.post("/bulk", response_model=dict)
+async def bulk_upload_results(request: Request, user=Depends(require_role("teacher")), class_id: Optional[int] = None, term: Optional[str] = None, date: Optional[str] = None):
+    """Upsert a class gradebook (JSON matrix or CSV) in one transaction.
+
+    Valid cells are written; invalid ones are returned in ``errors`` with
+    their row number, student and subject.
+    """
+    content_type = (request.headers.get('content-type') or '').lower()
+    parse_errors: List[dict] = []
+    if 'csv' in content_type:
+        if class_id is None or not term:
+            raise HTTPException(status_code=400, detail="class_id and term query parameters are required for CSV uploads")
+        try:
+            cells = cells_from_csv((await request.body()).decode('utf-8-sig'))
+        except (UnicodeDecodeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        try:
+            payload = GradebookUpload(**(await request.json()))
+        except (json.JSONDecodeError, ValueError, TypeError):
+            raise HTTPException(status_code=422, detail="Expected a JSON gradebook with class_id, term and rows")
+        class_id, term, date = payload.class_id, payload.term, payload.date or date
+        cells, parse_errors = cells_from_json(payload.rows)
+    term = term.strip()
+    if not term:
+        raise HTTPException(status_code=400, detail="term must not be blank")
+
+    # One query gives both the ownership check and the roster
+    cls = await prisma.classmodel.find_unique(where={'id': class_id}, include={'students': True})
+    if not cls:
+        raise HTTPException(status_code=404, detail="Class not found")
+    if user.role == 'teacher':
+        if not user.teacher or cls.teacher_id != user.teacher.id:
+            raise HTTPException(status_code=403, detail="Not allowed to post results for this class")
+        teacher_id = user.teacher.id
+    else:
+        if cls.teacher_id is None:
+            raise HTTPException(status_code=400, detail="Class has no teacher assigned")
+        teacher_id = cls.teacher_id
+    roster = {s.id for s in (cls.students or [])}
+    valid, errors = validate_cells(cells, roster)
+    errors = parse_errors + errors
+
+    created = updated = 0
+    if valid:
+        existing = await prisma.result.find_many(where={
+            'student_id': {'in': list({c.student_id for c in valid})},
+            'class_id': class_id,
+            'term': term,
+            'subject': {'in': list({c.subject for c in valid})},
+        })
+        existing_ids = {(r.student_id, r.subject): r.id for r in existing}
+        now = _now_iso()
+        to_create = []
+        to_update = []
+        for c in valid:
+            data = {'score': c.score, 'grade': c.grade, 'teacher_id': teacher_id, 'class_id': class_id}
+            if date is not None:
+                data['date'] = date
+            if c.comments is not None:
+                data['comments'] = c.comments
+            rid = existing_ids.get((c.student_id, c.subject))
+            if rid is None:
+                to_create.append({**data, 'student_id': c.student_id, 'subject': c.subject, 'term': term, 'created_at': now})
+            else:
+                to_update.append((rid, data))
+        async with prisma.tx(timeout=timedelta(seconds=60)) as tx:
+            if to_create:
+                created = await tx.result.create_many(data=to_create)
+            for rid, data in to_update:
+                await tx.result.update(where={'id': rid}, data=data)
+        updated = len(to_update)
+        per_student: Dict[int, int] = {}
+        for c in valid:
+            per_student[c.student_id] = per_student.get(c.student_id, 0) + 1
+        await _after_result_write(class_id, term, per_student)
+        # one notification per student rather than per cell
+        delivery_queue.submit("normal", notify_parents, [
+            (sid, "result", f"{n} {term} result{'s' if n != 1 else ''} posted for {{student}}") for sid, n in per_student.items()
+        ])
+    return {"class_id": class_id, "term": term, "created": created, "updated": updated, "errors": errors}
+
 @router.get("/", response_model=List[ResultOut])
-async def list_results(user=Depends(get_current_user_or_dev), offset: int = Query(0, ge=0), limit: int = Query(50, le=200), student_id: Optional[int] = None, term: Optional[str] = None):
-    where: dict = {}
-    if user.role == 'teacher' and user.teacher:
-        classes = await prisma.classmodel.find_many(where={'teacher_id': user.teacher.id})
-        cls_ids = [c.id for c in classes]
-        if cls_ids:
-            where['class_id'] = {'in': cls_ids}
-        else:
-            return []
-    elif user.role == 'parent' and user.parent:
-        children = await prisma.student.find_many(where={'parent_id': user.parent.id})
-        ch_ids = [c.id for c in children]
-        if ch_ids:
-            where['student_id'] = {'in': ch_ids}
-        else:
-            return []
-    # admin sees all
+async def list_results(response: Response, user=Depends(get_current_user_or_dev), offset: int = Query(0, ge=0), limit: int = Query(50, le=200),
+                       student_id: Optional[int] = None, term: Optional[str] = None, cursor: Optional[str] = None):
+    scope = await resolve_scope(user)
+    if scope.is_empty:
+        return []
+    where: dict = dict(scope.result_where() or {})
     if student_id is not None:
+        if not scope.can_access_student(student_id) and scope.role == 'parent':
+            return []
         where['student_id'] = student_id
     if term is not None and term.strip():
         where['term'] = term.strip()
-    res = await prisma.result.find_many(where=where or None, skip=offset, take=limit, order={'id': 'desc'})
+    res = await paginate(prisma.result, where=where, limit=limit, offset=offset, cursor=cursor, response=response)
     return [ResultOut(**r.dict()) for r in res]
 
 @router.get("/admin/teacher-performance", response_model=dict)
@@ -111,24 +209,64 @@ async def teacher_performance(user=Depends(get_current_user_or_dev)):
     averages = {str(tid): round(v["sum"]/v["count"], 2) if v["count"] else 0 for tid, v in totals.items()}
     return {"averages": averages, "teacher_count": len(averages)}
 
+@router.get("/stats", response_model=dict)
+async def result_stats(user=Depends(get_current_user_or_dev), class_id: Optional[int] = None, term: Optional[str] = None, subject: Optional[str] = None):
+    scope = await resolve_scope(user)
+    if scope.role == 'teacher':
+        if class_id is None:
+            raise HTTPException(status_code=400, detail="class_id is required")
+        if not scope.can_access_class(class_id):
+            raise HTTPException(status_code=403, detail="Forbidden")
+    elif not scope.unrestricted:
+        raise HTTPException(status_code=403, detail="Forbidden")
+    term = term.strip() if term and term.strip() else None
+    stats = await class_term_stats(class_id, term)
+    subjects = stats["subjects"]
+    overall = stats["overall"]
+    if subject is not None and subject.strip():
+        subject = subject.strip()
+        if subject not in subjects:
+            raise HTTPException(status_code=404, detail="No results for subject")
+        subjects = {subject: subjects[subject]}
+        overall = subjects[subject]
+    return {"class_id": class_id, "term": term, "subject": subject, "overall": overall, "subjects": subjects}
+
+@router.get("/trends", response_model=dict)
+async def result_trends(student_id: int, user=Depends(get_current_user_or_dev)):
+    scope = await resolve_scope(user)
+    if not scope.can_access_student(student_id):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return await student_trends(student_id)
+
+@router.get("/rankings", response_model=dict)
+async def class_rankings(class_id: int, term: str, user=Depends(get_current_user_or_dev)):
+    term = term.strip()
+    scope = await resolve_scope(user)
+    student_ids = None
+    if not scope.can_access_class(class_id):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if scope.role == 'parent':
+        # parents only see their own children's positions
+        student_ids = [sid for sid, cid in scope.student_classes.items() if cid == class_id]
+    rankings = await get_class_rankings(class_id, term, student_ids=student_ids)
+    return {"class_id": class_id, "term": term, "rankings": rankings}
+
 @router.patch("/{result_id}", response_model=ResultOut)
 async def update_result(result_id: int, payload: ResultUpdate, user=Depends(get_current_user)):
     res = await prisma.result.find_unique(where={'id': result_id})
     if not res:
         raise HTTPException(status_code=404, detail="Result not found")
     # Authorization
-    if user.role == 'teacher' and user.teacher:
-        st = await prisma.student.find_unique(where={'id': res.student_id})
-        if not st or not st.class_id:
-            raise HTTPException(status_code=403, detail="Forbidden")
-        cls = await prisma.classmodel.find_unique(where={'id': st.class_id})
-        if not cls or cls.teacher_id != user.teacher.id:
-            raise HTTPException(status_code=403, detail="Forbidden")
-    elif user.role != 'admin':
+    scope = await resolve_scope(user)
+    if scope.role not in ('admin', 'teacher') or not scope.can_access_student(res.student_id):
         raise HTTPException(status_code=403, detail="Forbidden")
     data = {k: v for k, v in payload.dict(exclude_unset=True).items()}
     if data:
+        old_term = res.term
         res = await prisma.result.update(where={'id': result_id}, data=data)
+        await _after_result_write(res.class_id, old_term, [res.student_id])
+        if res.term != old_term:
+            await _after_result_write(res.class_id, res.term)
     return ResultOut(**res.dict())
 
 @router.delete("/{result_id}")
@@ -136,14 +274,9 @@ async def delete_result(result_id: int, user=Depends(get_current_user)):
     res = await prisma.result.find_unique(where={'id': result_id})
     if not res:
         raise HTTPException(status_code=404, detail="Result not found")
-    if user.role == 'teacher' and user.teacher:
-        st = await prisma.student.find_unique(where={'id': res.student_id})
-        if not st or not st.class_id:
-            raise HTTPException(status_code=403, detail="Forbidden")
-        cls = await prisma.classmodel.find_unique(where={'id': st.class_id})
-        if not cls or cls.teacher_id != user.teacher.id:
-            raise HTTPException(status_code=403, detail="Forbidden")
-    elif user.role != 'admin':
+    scope = await resolve_scope(user)
+    if scope.role not in ('admin', 'teacher') or not scope.can_access_student(res.student_id):
         raise HTTPException(status_code=403, detail="Forbidden")
     await prisma.result.delete(where={'id': result_id})
+    await _after_result_write(res.class_id, res.term, [res.student_id])
     return {"deleted": True}
@@ -0,0 +1,13 @@
+from fastapi import APIRouter, Depends, HTTPException
+
+from app.api.auth import get_current_user
+from app.core.scheduler import scheduler
+
+router = APIRouter(prefix="/scheduler", tags=["scheduler"])
+
+@router.get("/jobs", response_model=dict)
+async def scheduled_jobs(user=Depends(get_current_user)):
+    """Each job's schedule, last and next run times, start lag and failures."""
+    if (getattr(user, 'role', '') or '').lower() != 'admin':
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return await scheduler.status()
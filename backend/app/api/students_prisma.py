@@ -1,11 +1,23 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from typing import List, Optional, Union, Any
+from datetime import timedelta
+import json
+import os
 from pydantic import BaseModel
 from app.api.auth import get_current_user, get_current_user_or_dev, require_role
 from app.db.prisma_client import prisma
+from app.core.scope import resolve_scope, invalidate_scopes
+from app.core.pagination import paginate
+from app.core import totals
+from app.core.delivery import chunks
+from app.services.enrolment import lookups, rows_from_csv, rows_from_ndjson, validate_rows
 
 router = APIRouter(prefix="/students", tags=["students"])
 
+STUDENT_BULK_MAX_ROWS = int(os.getenv("STUDENT_BULK_MAX_ROWS", "20000"))
+STUDENT_BULK_CHUNK = int(os.getenv("STUDENT_BULK_CHUNK", "500"))
+
 class StudentCreate(BaseModel):
     name: str
     class_id: Optional[int] = None
@@ -27,27 +39,89 @@ class StudentOut(BaseModel):
 @router.post("/", response_model=StudentOut)
 async def create_student(payload: StudentCreate, user=Depends(require_role("admin"))):
     st = await prisma.student.create(data=payload.dict())
+    await invalidate_scopes()
+    await totals.record("student", added=[st])
     return StudentOut(**st.dict())
 
-@router.get("/", response_model=List[StudentOut])
-async def list_students(user=Depends(get_current_user_or_dev), offset: int = Query(0, ge=0), limit: int = Query(50, le=100), with_meta: bool = Query(False)):
-    where: dict = {}
-    if user.role == 'parent' and user.parent:
-        # Return all children for this parent
-        where['parent_id'] = user.parent.id
-    elif user.role == 'teacher' and user.teacher:
-        # get classes for teacher
-        classes = await prisma.classmodel.find_many(where={'teacher_id': user.teacher.id})  # class is reserved python word in prisma client => classmodel
-        class_ids = [c.id for c in classes]
-        if class_ids:
-            where['class_id'] = {'in': class_ids}
-        else:
-            return [] if not with_meta else {"data": [], "meta": {"total": 0, "offset": offset, "limit": limit}}  # type: ignore
-    total = await prisma.student.count(where=where or None)
-    students = await prisma.student.find_many(where=where or None, skip=offset, take=limit, order={'id': 'desc'})
+@router.post("/bulk")
+async def bulk_import_students(request: Request, user=Depends(require_role("admin")), atomic: bool = Query(False)):
+    """Create many students from CSV or NDJSON (columns: name, class, class_id, roll_no, email, parent_email, parent_id, status).
+
+    Class names and parent emails are resolved with one query each and
+    duplicate roll numbers/emails are caught before anything is written;
+    valid rows are then inserted in one transaction. The response is NDJSON:
+    one line per input row (``created`` with its id, ``error`` with reasons,
+    or ``skipped`` when ``atomic=true`` and another row failed), then a
+    ``summary`` line.
+    """
+    content_type = (request.headers.get('content-type') or '').lower()
+    try:
+        text = (await request.body()).decode('utf-8-sig')
+        rows = rows_from_csv(text) if 'csv' in content_type else rows_from_ndjson(text)
+    except (UnicodeDecodeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(rows) > STUDENT_BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {STUDENT_BULK_MAX_ROWS} rows per upload")
+
+    want = lookups(rows)
+    classes = await prisma.classmodel.find_many(where={'OR': [
+        {'name': {'in': list(want["class_names"])}}, {'id': {'in': list(want["class_ids"])}}]}) \
+        if want["class_names"] or want["class_ids"] else []
+    parents = await prisma.parent.find_many(where={'OR': [
+        {'user': {'is': {'email': {'in': list(want["parent_emails"])}}}}, {'id': {'in': list(want["parent_ids"])}}]},
+        include={'user': True}) if want["parent_emails"] or want["parent_ids"] else []
+    taken = await prisma.student.find_many(where={'OR': [
+        {'roll_no': {'in': list(want["roll_nos"])}}, {'email': {'in': list(want["emails"])}}]}) \
+        if want["roll_nos"] or want["emails"] else []
+    valid, errors = validate_rows(
+        rows,
+        classes_by_name={c.name: c.id for c in classes}, class_ids={c.id for c in classes},
+        parents_by_email={p.user.email.lower(): p.id for p in parents if p.user}, parent_ids={p.id for p in parents},
+        taken_roll_nos={s.roll_no for s in taken if s.roll_no}, taken_emails={(s.email or '').lower() for s in taken if s.email},
+    )
+
+    created_ids: dict = {}
+    if valid and not (atomic and errors):
+        async with prisma.tx(timeout=timedelta(seconds=60)) as tx:
+            # a no-op write first so SQLite hands this transaction the write lock
+            # before the id high-water mark is read; the new ids are then ours alone
+            await tx.execute_raw('UPDATE Student SET id = id WHERE id < 0')
+            before = (await tx.query_raw('SELECT COALESCE(MAX(id), 0) AS id FROM Student'))[0]["id"]
+            for chunk in chunks(valid, STUDENT_BULK_CHUNK):
+                await tx.student.create_many(data=[r.as_data() for r in chunk])
+            new_ids = await tx.query_raw('SELECT id FROM Student WHERE id > ? ORDER BY id', before)
+        created_ids = {r.row: row["id"] for r, row in zip(valid, new_ids)}
+        await invalidate_scopes()
+        await totals.record("student", added=[{**r.as_data(), "id": created_ids[r.row]} for r in valid])
+
+    failed = {e["row"]: e for e in errors}
+
+    def lines():
+        for r in rows:
+            if r.row in failed:
+                yield json.dumps({"row": r.row, "status": "error", "name": r.name, "errors": failed[r.row]["errors"]}) + "\n"
+            elif r.row in created_ids:
+                yield json.dumps({"row": r.row, "status": "created", "id": created_ids[r.row]}) + "\n"
+            else:
+                yield json.dumps({"row": r.row, "status": "skipped"}) + "\n"
+        yield json.dumps({"summary": {"rows": len(rows), "created": len(created_ids), "errors": len(errors),
+                                      "skipped": len(rows) - len(created_ids) - len(errors)}}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@router.get("/", response_model=Union[List[StudentOut], dict])
+async def list_students(response: Response, user=Depends(get_current_user_or_dev), offset: int = Query(0, ge=0), limit: int = Query(50, le=100),
+                        with_meta: bool = Query(False), cursor: Optional[str] = None, approximate: bool = Query(False)):
+    """``approximate=true`` lets ``meta.total`` come from a possibly stale cached count instead of waiting for a recount."""
+    scope = await resolve_scope(user)
+    if scope.is_empty:
+        return [] if not with_meta else {"data": [], "meta": {"total": 0, "offset": offset, "limit": limit, "approximate": False}}  # type: ignore
+    where: dict = dict(scope.student_where() or {})
+    students = await paginate(prisma.student, where=where, limit=limit, offset=offset, cursor=cursor, response=response)
     data = [StudentOut(**s.dict()) for s in students]
     if with_meta:
-        return {"data": data, "meta": {"total": total, "offset": offset, "limit": limit}}  # type: ignore
+        total, exact = await totals.total("student", where, approximate)
+        return {"data": data, "meta": {"total": total, "offset": offset, "limit": limit, "approximate": not exact}}  # type: ignore
     return data
 
 @router.patch("/{student_id}", response_model=StudentOut)
@@ -57,7 +131,11 @@ async def update_student(student_id: int, payload: dict, user=Depends(get_curren
         raise HTTPException(status_code=404, detail="Student not found")
     data = {k: v for k, v in payload.items() if k in {"name","status","class_id","parent_id","email","roll_no"}}
     if data:
+        old = st
         st = await prisma.student.update(where={'id': student_id}, data=data)
+        if data.keys() & {"class_id", "parent_id"}:
+            await invalidate_scopes()
+            await totals.record("student", added=[st], removed=[old])
     return StudentOut(**st.dict())
 
 @router.delete("/{student_id}")
@@ -66,4 +144,6 @@ async def delete_student(student_id: int, user=Depends(get_current_user)):
     if not st:
         raise HTTPException(status_code=404, detail="Student not found")
     await prisma.student.delete(where={'id': student_id})
+    await invalidate_scopes()
+    await totals.record("student", removed=[st])
     return {"deleted": True}
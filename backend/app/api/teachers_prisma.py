@@ -1,8 +1,11 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
+from fastapi import APIRouter, Depends, Query, HTTPException, Response
 from typing import List, Optional
 from pydantic import BaseModel, EmailStr
-from app.api.auth import get_current_user, get_current_user_or_dev, require_role
+from app.api.auth import get_current_user, get_current_user_or_dev, require_role, forget_principal
 from app.db.prisma_client import prisma
+from app.core.scope import invalidate_scopes
+from app.core.pagination import paginate
+from app.core import totals
 
 router = APIRouter(prefix="/teachers", tags=["teachers"])
 
@@ -32,12 +35,14 @@ async def create_teacher(payload: TeacherCreate, user=Depends(require_role("admi
         "subjects": ",".join(payload.subjects) if payload.subjects else None,
         "status": payload.status or "active"
     })
+    await forget_principal(payload.user_id)
     subs = teacher.subjects.split(',') if teacher.subjects else []
     return TeacherOut(id=teacher.id, user_id=teacher.user_id, phone=teacher.phone, subjects=subs, status=teacher.status)
 
 @router.get("/", response_model=List[TeacherOut])
-async def list_teachers(user=Depends(get_current_user_or_dev), offset: int = Query(0, ge=0), limit: int = Query(50, le=100)):
-    teachers = await prisma.teacher.find_many(skip=offset, take=limit, order={"id": "desc"})
+async def list_teachers(response: Response, user=Depends(get_current_user_or_dev), offset: int = Query(0, ge=0), limit: int = Query(50, le=100),
+                        cursor: Optional[str] = None):
+    teachers = await paginate(prisma.teacher, limit=limit, offset=offset, cursor=cursor, response=response)
     out: List[TeacherOut] = []
     for t in teachers:
         subs = t.subjects.split(',') if t.subjects else []
@@ -71,6 +76,9 @@ async def delete_teacher(teacher_id: int, user=Depends(get_current_user_or_dev))
     if not t:
         raise HTTPException(status_code=404, detail="Teacher not found")
     await prisma.teacher.delete(where={"id": teacher_id})
+    await invalidate_scopes()
+    await totals.invalidate("classmodel")  # their classes' teacher_id is set to null
+    await forget_principal(t.user_id)
     return {"deleted": True}
 
 
@@ -92,6 +100,7 @@ async def ensure_teacher_profile(payload: EnsureTeacherPayload, admin=Depends(re
     if existing:
         return {"id": existing.id, "user_id": existing.user_id}
     created = await prisma.teacher.create(data={"user_id": payload.user_id, "status": "active"})
+    await forget_principal(payload.user_id)
     return {"id": created.id, "user_id": created.user_id}
 
 @router.post("/ensure-by-email", response_model=dict)
@@ -106,6 +115,7 @@ async def ensure_teacher_profile_by_email(payload: EnsureTeacherByEmailPayload,
     if existing:
         return {"id": existing.id, "user_id": existing.user_id}
     created = await prisma.teacher.create(data={"user_id": u.id, "status": "active"})
+    await forget_principal(u.id)
     return {"id": created.id, "user_id": created.user_id}
 
 # New endpoint to create teacher with user creation
@@ -141,6 +151,7 @@ async def create_teacher_with_user(payload: CreateTeacherWithUserPayload):
             else:
                 # Create teacher profile for existing user
                 teacher = await prisma.teacher.create(data={"user_id": existing_user.id, "status": "active"})
+                await forget_principal(existing_user.id)
                 subs = teacher.subjects.split(',') if teacher.subjects else []
                 return TeacherOut(id=teacher.id, user_id=teacher.user_id, phone=teacher.phone, subjects=subs, status=teacher.status)
         else:
@@ -175,7 +186,9 @@ async def create_teacher_with_user(payload: CreateTeacherWithUserPayload):
             if existing_class.teacher_id is not None:
                 raise HTTPException(status_code=400, detail="Class is already assigned to another teacher")
             # Assign class to teacher
-            await prisma.classmodel.update(where={"id": payload.classId}, data={"teacher_id": teacher.id})
+            assigned = await prisma.classmodel.update(where={"id": payload.classId}, data={"teacher_id": teacher.id})
+            await invalidate_scopes()
+            await totals.record("classmodel", added=[assigned], removed=[existing_class])
     
     subs = teacher.subjects.split(',') if teacher.subjects else []
     return TeacherOut(id=teacher.id, user_id=teacher.user_id, phone=teacher.phone, subjects=subs, status=teacher.status)
@@ -1,10 +1,12 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
 from passlib.context import CryptContext
 from app.db.prisma_client import prisma
+from app.core.pagination import paginate
+from app.core import totals
 from typing import List, Optional
 import secrets
 from pydantic import BaseModel, EmailStr
-from app.api.auth import get_current_user, get_current_user_or_dev
+from app.api.auth import get_current_user, get_current_user_or_dev, forget_principal, send_verification_email
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -48,6 +50,7 @@ async def create_user(payload: UserCreate):
         "email_verified": False,
         "email_verification_token": verification_token,
     })
+    await send_verification_email(user, verification_token)
     return UserOut(
         id=user.id,
         name=user.name,
@@ -59,12 +62,14 @@ async def create_user(payload: UserCreate):
 
 @router.get("/", response_model=List[UserOut])
 async def list_users(
+    response: Response,
     offset: int = Query(0, ge=0),
     limit: int = Query(50, le=100),
+    cursor: Optional[str] = None,
     _user=Depends(get_current_user_or_dev),
 ):
     await ensure_connected()
-    items = await prisma.user.find_many(skip=offset, take=limit, order={"id":"desc"})
+    items = await paginate(prisma.user, limit=limit, offset=offset, cursor=cursor, response=response)
     return [
         UserOut(
             id=u.id,
@@ -104,6 +109,7 @@ async def update_user(user_id: int, payload: UserUpdate, current=Depends(get_cur
             raise HTTPException(status_code=404, detail="User not found")
         return UserOut(id=u.id, name=u.name, email=u.email, role=u.role, status=u.status, email_verified=bool(u.email_verified))
     u = await prisma.user.update(where={"id": user_id}, data=data)
+    await forget_principal(user_id)
     return UserOut(id=u.id, name=u.name, email=u.email, role=u.role, status=u.status, email_verified=bool(u.email_verified))
 
 @router.delete("/{user_id}")
@@ -115,4 +121,9 @@ async def delete_user(user_id: int, current=Depends(get_current_user_or_dev)):
     if not u:
         raise HTTPException(status_code=404, detail="User not found")
     await prisma.user.delete(where={"id": user_id})
+    await forget_principal(user_id)
+    role = (u.role or '').lower()
+    if role in ("parent", "teacher"):
+        # deleting the profile unlinks their students or classes
+        await totals.invalidate("student" if role == "parent" else "classmodel")
     return {"deleted": True}
@@ -1,33 +1,286 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from typing import List, Dict
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
+from typing import Dict, Iterable, List, Optional, Set
+import asyncio
+import json
+import os
+
+from app.api.auth import AUTH_DEV_MODE, get_current_user_or_dev, load_principal, verify_token
+from app.core import realtime
+from app.core.delivery import delivery_queue
+from app.db.prisma_client import prisma
 
 router = APIRouter()
 
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+WS_REPLAY_LIMIT = int(os.getenv("WS_REPLAY_LIMIT", "200"))
+
+
+class Connection:
+    """One websocket plus its bounded outbound queue and writer task."""
+
+    __slots__ = ("websocket", "user_id", "role", "queue", "task", "closed")
+
+    def __init__(self, websocket: WebSocket, user_id: int, role: Optional[str], queue_size: int):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.role = role
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+
+    def start(self, manager: "ConnectionManager"):
+        if self.task is None:
+            self.task = asyncio.create_task(self._writer(manager))
+
+    def close(self):
+        self.closed = True
+        # Drop pending frames and wake the writer with a sentinel: cancellation
+        # alone can be swallowed by wait_for when it races a finishing send.
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    async def _writer(self, manager: "ConnectionManager"):
+        while True:
+            frame = await self.queue.get()
+            if frame is None or self.closed:
+                return
+            try:
+                await asyncio.wait_for(self.websocket.send_text(frame), manager.send_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # timed out or socket gone: this client cannot keep up
+                if not self.closed:
+                    manager.frames_dropped += 1 + self.queue.qsize()
+                manager.evict(self)
+                return
+            manager.frames_sent += 1
+
+
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, WebSocket] = {}
+    """Tracks live sockets per user and per role and fans frames out to them.
+
+    Sending only enqueues onto each connection's queue, so one stuck browser
+    never blocks delivery to anyone else; a connection whose queue overflows
+    or whose send times out is evicted.
+    """
 
-    async def connect(self, user_id: int, websocket: WebSocket):
+    def __init__(self, queue_size: int = WS_QUEUE_SIZE, send_timeout: float = WS_SEND_TIMEOUT):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.active_connections: Dict[int, Set[Connection]] = {}
+        self.role_index: Dict[str, Set[int]] = {}
+        self.frames_sent = 0
+        self.frames_dropped = 0
+        self.evictions = 0
+        self.connections_total = 0
+
+    async def connect(self, user_id: int, websocket: WebSocket, role: Optional[str] = None, start: bool = True) -> Connection:
         await websocket.accept()
-        self.active_connections[user_id] = websocket
+        conn = Connection(websocket, user_id, (role or '').lower() or None, self.queue_size)
+        self.active_connections.setdefault(user_id, set()).add(conn)
+        if conn.role:
+            self.role_index.setdefault(conn.role, set()).add(user_id)
+        self.connections_total += 1
+        if start:
+            conn.start(self)
+        return conn
 
-    def disconnect(self, user_id: int):
-        if user_id in self.active_connections:
+    def disconnect(self, user_id: int, conn: Optional[Connection] = None):
+        conns = self.active_connections.get(user_id)
+        if not conns:
+            return
+        targets = [conn] if conn is not None else list(conns)
+        for c in targets:
+            conns.discard(c)
+            c.close()
+        if not conns:
             del self.active_connections[user_id]
+            for c in targets:
+                if c.role and c.role in self.role_index:
+                    self.role_index[c.role].discard(user_id)
+                    if not self.role_index[c.role]:
+                        del self.role_index[c.role]
+
+    def evict(self, conn: Connection):
+        self.evictions += 1
+        self.disconnect(conn.user_id, conn)
+        try:
+            # 1013: try again later; the client reconnects and replays what it missed
+            asyncio.get_running_loop().create_task(self._close(conn.websocket, 1013))
+        except RuntimeError:
+            pass
+
+    @staticmethod
+    async def _close(websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    def enqueue(self, conn: Connection, message: str):
+        """Queue a frame for one connection; a full queue evicts it."""
+        try:
+            conn.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.frames_dropped += 1
+            self.evict(conn)
 
     async def send_personal_message(self, message: str, user_id: int):
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_text(message)
+        for conn in list(self.active_connections.get(user_id, ())):
+            self.enqueue(conn, message)
+
+    async def send_to_users(self, message: str, user_ids: Iterable[int]):
+        for uid in user_ids:
+            for conn in list(self.active_connections.get(uid, ())):
+                self.enqueue(conn, message)
+
+    async def broadcast_to_role(self, message: str, role: str):
+        role = (role or '').lower()
+        user_ids = list(self.active_connections) if role == 'all' else list(self.role_index.get(role, ()))
+        await self.send_to_users(message, user_ids)
+
+    def is_connected(self, user_id: int) -> bool:
+        return bool(self.active_connections.get(user_id))
+
+    def metrics(self) -> dict:
+        depths = [c.queue.qsize() for conns in self.active_connections.values() for c in conns]
+        return {
+            "users": len(self.active_connections),
+            "connections": len(depths),
+            "connections_total": self.connections_total,
+            "roles": {role: len(uids) for role, uids in self.role_index.items()},
+            "queue_depth": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped,
+            "evictions": self.evictions,
+        }
 
 manager = ConnectionManager()
 
+# Every worker receives every realtime event and serves only its own sockets
+async def _deliver_users(data: dict):
+    await manager.send_to_users(data["frame"], data["users"])
+
+async def _deliver_role(data: dict):
+    await manager.broadcast_to_role(data["frame"], data["role"])
+
+async def _deliver_frames(data: dict):
+    for user_id, frame in data["frames"]:
+        if manager.is_connected(user_id):
+            await manager.send_personal_message(frame, user_id)
+
+realtime.subscribe("ws.users", _deliver_users)
+realtime.subscribe("ws.role", _deliver_role)
+realtime.subscribe("ws.frames", _deliver_frames)
+
+@router.get("/ws/stats", response_model=dict)
+async def websocket_stats(user=Depends(get_current_user_or_dev)):
+    if (getattr(user, 'role', '') or '').lower() != 'admin':
+        raise HTTPException(status_code=403, detail="Forbidden")
+    stats = manager.metrics()
+    stats["bus"] = realtime.bus.metrics()
+    stats["delivery"] = delivery_queue.metrics()
+    return stats
+
+async def replay_frames(user, last_id: int, limit: int = WS_REPLAY_LIMIT) -> List[str]:
+    """Frames for messages the user missed after ``last_id``, oldest first.
+
+    Each branch is a range scan on its own (column, id) index; only the
+    matching rows are then loaded. When more than ``limit`` are missing the
+    last frame tells the client where to resume from.
+    """
+    role = (getattr(user, 'role', '') or '').lower()
+    rows = await prisma.query_raw(
+        "SELECT id FROM Message WHERE recipient_id = ? AND id > ? "
+        "UNION SELECT id FROM Message WHERE sender_id = ? AND id > ? "
+        "UNION SELECT id FROM Message WHERE recipient_role IN (?, 'all') AND recipient_id IS NULL AND id > ? "
+        "ORDER BY id LIMIT ?",
+        user.id, last_id, user.id, last_id, role, last_id, limit + 1,
+    )
+    ids = [int(r["id"]) for r in rows]
+    truncated = len(ids) > limit
+    ids = ids[:limit]
+    if not ids:
+        return []
+    msgs = await prisma.message.find_many(
+        where={'id': {'in': ids}},
+        include={'receipts': {'where': {'user_id': user.id}}},
+        order={'id': 'asc'},
+    )
+    frames = []
+    for m in msgs:
+        read_at = m.read_at
+        if m.recipient_id is None:
+            read_at = next((r.read_at for r in (m.receipts or []) if r.user_id == user.id), None)
+        frames.append(json.dumps({
+            "id": m.id,
+            "subject": m.subject,
+            "body": m.body,
+            "sender_id": m.sender_id,
+            "recipient_id": m.recipient_id,
+            "recipient_role": m.recipient_role,
+            "created_at": m.created_at,
+            "read_at": read_at,
+            "reply_to_id": m.reply_to_id,
+            "conversation_key": m.conversation_key,
+            "priority": m.priority,
+            "message_type": m.message_type,
+            "broadcast_id": m.broadcast_id,
+            "replayed": True,
+        }))
+    if truncated:
+        frames.append(json.dumps({"type": "replay_truncated", "last_id": ids[-1]}))
+    return frames
+
+async def _authenticate(user_id: int, token: Optional[str]):
+    if token:
+        user = await verify_token(token)
+        return user if user and user.id == user_id else None
+    # tokenless sockets only in dev mode, like the rest of the dev fallbacks
+    return await load_principal(user_id) if AUTH_DEV_MODE else None
+
+REPLAY_NEEDS_TOKEN = json.dumps({"type": "replay_unavailable", "reason": "token required"})
+
 @router.websocket("/ws/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: int):
-    await manager.connect(user_id, websocket)
+async def websocket_endpoint(websocket: WebSocket, user_id: int, token: Optional[str] = None, last_id: Optional[int] = None):
+    user = await _authenticate(user_id, token)
+    if not user:
+        await websocket.close(code=1008)
+        return
+    # A dev-mode tokenless socket only proves a user id in the URL, so it
+    # gets live frames but never the stored message history
+    can_replay = bool(token)
+    # Live frames queue up while missed ones are replayed, then the writer starts,
+    # so replayed messages always arrive first (clients dedupe by id)
+    conn = await manager.connect(user_id, websocket, role=user.role, start=False)
     try:
+        if last_id is not None:
+            for frame in await replay_frames(user, last_id) if can_replay else [REPLAY_NEEDS_TOKEN]:
+                await asyncio.wait_for(websocket.send_text(frame), manager.send_timeout)
+        conn.start(manager)
         while True:
             data = await websocket.receive_text()
-            # For now, we don't need to do anything with incoming messages from the client
-            # But this is where you would handle things like marking messages as read
-    except WebSocketDisconnect:
-        manager.disconnect(user_id)
+            try:
+                incoming = json.loads(data)
+            except ValueError:
+                continue
+            if isinstance(incoming, dict) and incoming.get("type") == "resume":
+                if not can_replay:
+                    manager.enqueue(conn, REPLAY_NEEDS_TOKEN)
+                    continue
+                try:
+                    resume_from = int(incoming.get("last_id") or 0)
+                except (TypeError, ValueError):
+                    continue
+                for frame in await replay_frames(user, resume_from):
+                    manager.enqueue(conn, frame)
+    except (WebSocketDisconnect, asyncio.TimeoutError):
+        pass
+    finally:
+        manager.disconnect(user_id, conn)
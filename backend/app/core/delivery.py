@@ -0,0 +1,157 @@
+"""Priority lanes for outbound delivery (websocket push, email, future channels).
+
+Every delivery job is submitted with a Message.priority (urgent, high,
+normal). Each priority has its own queue and dedicated workers, so an urgent
+alert never waits in line behind a bulk broadcast. Lower lanes also yield
+before each job and hold off while any higher lane has work pending; bulk
+senders submit many small chunks, so preemption happens between chunks.
+
+Latency is measured from submit to completion per priority.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+PRIORITIES = ("urgent", "high", "normal")
+DELIVERY_WORKERS = {
+    "urgent": int(os.getenv("DELIVERY_WORKERS_URGENT", "2")),
+    "high": int(os.getenv("DELIVERY_WORKERS_HIGH", "2")),
+    "normal": int(os.getenv("DELIVERY_WORKERS_NORMAL", "2")),
+}
+# recipients per job when a bulk send is split up
+DELIVERY_CHUNK = int(os.getenv("DELIVERY_CHUNK", "200"))
+
+Job = Callable[..., Awaitable[Any]]
+
+
+def normalize_priority(priority: Optional[str]) -> str:
+    priority = (priority or "normal").lower()
+    if priority not in PRIORITIES:
+        raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+    return priority
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class DeliveryQueue:
+    def __init__(self, workers: Optional[Dict[str, int]] = None, preempt: bool = True, sample_size: int = 2048):
+        self.workers = dict(workers or DELIVERY_WORKERS)
+        self.preempt = preempt
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._tasks: list = []
+        self._loop = None
+        self._pending = {p: 0 for p in PRIORITIES}
+        self._higher_idle: Dict[str, asyncio.Event] = {}
+        self._latency = {p: deque(maxlen=sample_size) for p in PRIORITIES}
+        self.submitted = {p: 0 for p in PRIORITIES}
+        self.completed = {p: 0 for p in PRIORITIES}
+        self.failed = {p: 0 for p in PRIORITIES}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._tasks and self._loop is loop:
+            return
+        # a new event loop (tests, reload) cannot reuse the old loop's workers
+        self._tasks = []
+        self._loop = loop
+        self._pending = {p: 0 for p in PRIORITIES}
+        self._queues = {p: asyncio.Queue() for p in PRIORITIES}
+        self._higher_idle = {p: asyncio.Event() for p in PRIORITIES}
+        self._refresh_idle()
+        for priority in PRIORITIES:
+            for _ in range(max(1, self.workers.get(priority, 1))):
+                self._tasks.append(asyncio.create_task(self._worker(priority)))
+
+    async def stop(self, drain_timeout: float = 5.0) -> None:
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues.values())), drain_timeout)
+        except asyncio.TimeoutError:
+            pass
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, priority: Optional[str], job: Job, *args: Any) -> None:
+        """Queue ``job(*args)``; unknown priorities are treated as normal."""
+        try:
+            priority = normalize_priority(priority)
+        except ValueError:
+            priority = "normal"
+        self.start()
+        self.submitted[priority] += 1
+        self._pending[priority] += 1
+        self._refresh_idle()
+        self._queues[priority].put_nowait((time.perf_counter(), job, args))
+
+    def _refresh_idle(self) -> None:
+        busy = False
+        for priority in PRIORITIES:
+            # event for a lane is set when every lane above it is empty
+            if busy:
+                self._higher_idle[priority].clear()
+            else:
+                self._higher_idle[priority].set()
+            busy = busy or self._pending[priority] > 0
+
+    async def _worker(self, priority: str) -> None:
+        queue = self._queues[priority]
+        while True:
+            submitted_at, job, args = await queue.get()
+            try:
+                if self.preempt and priority != PRIORITIES[0]:
+                    # let higher lanes run first; sleep(0) also yields when the
+                    # queue handed us a job without suspending
+                    await asyncio.sleep(0)
+                    await self._higher_idle[priority].wait()
+                await job(*args)
+                self.completed[priority] += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed[priority] += 1
+            finally:
+                self._latency[priority].append(time.perf_counter() - submitted_at)
+                self._pending[priority] -= 1
+                self._refresh_idle()
+                queue.task_done()
+
+    def metrics(self) -> dict:
+        out = {}
+        for priority in PRIORITIES:
+            samples = self._latency[priority]
+            out[priority] = {
+                "workers": self.workers.get(priority, 1),
+                "queued": self._pending[priority],
+                "submitted": self.submitted[priority],
+                "completed": self.completed[priority],
+                "failed": self.failed[priority],
+                "latency_ms": {
+                    "p50": round(_percentile(samples, 0.5) * 1000, 3),
+                    "p95": round(_percentile(samples, 0.95) * 1000, 3),
+                    "p99": round(_percentile(samples, 0.99) * 1000, 3),
+                    "max": round(max(samples, default=0) * 1000, 3),
+                },
+            }
+        return out
+
+
+delivery_queue = DeliveryQueue()
+
+
+def chunks(items: list, size: int = DELIVERY_CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
@@ -0,0 +1,347 @@
+"""Cross-worker pub/sub for realtime delivery.
+
+Each uvicorn worker holds its own websocket connections, so anything that has
+to reach a user is published on the bus and every worker delivers it to the
+sockets it holds. The backend is picked with REALTIME_BUS:
+
+- ``unix`` (default): whichever worker takes the lock file runs a small
+  broker on a Unix domain socket and the others connect to it. If the broker
+  worker exits, the survivors re-elect one and reconnect.
+- ``redis``: Redis (or any server speaking its pub/sub protocol) at
+  REALTIME_REDIS_URL; needs the optional ``redis`` package.
+- ``local``: in-process only, enough for a single worker.
+
+Handlers also run for events published by the same worker, so callers never
+special-case "the user might be connected here".
+"""
+import asyncio
+import contextlib
+import fcntl
+import json
+import os
+import tempfile
+import uuid
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+REALTIME_BUS = os.getenv("REALTIME_BUS", "unix").lower()
+REALTIME_SOCKET = os.getenv("REALTIME_SOCKET", os.path.join(tempfile.gettempdir(), "ptsmanager-realtime.sock"))
+REALTIME_REDIS_URL = os.getenv("REALTIME_REDIS_URL", "redis://localhost:6379/0")
+REALTIME_CHANNEL = os.getenv("REALTIME_CHANNEL", "ptsmanager:realtime")
+# A peer that falls this far behind is dropped; it reconnects and clients resume
+REALTIME_MAX_BUFFER = int(os.getenv("REALTIME_MAX_BUFFER", str(4 * 1024 * 1024)))
+_MAX_LINE = 16 * 1024 * 1024
+
+Handler = Callable[[dict], Awaitable[None]]
+_handlers: Dict[str, List[Handler]] = {}
+
+
+def subscribe(kind: str, handler: Handler) -> None:
+    """Run ``handler(data)`` in every worker for each event of ``kind``."""
+    _handlers.setdefault(kind, []).append(handler)
+
+
+class LocalBus:
+    """In-process bus; also the base for the cross-process backends."""
+
+    name = "local"
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        self.handler_errors = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, kind: str, data: dict):
+        self.published += 1
+        await self._dispatch(kind, data)
+        await self._send((json.dumps({"o": self.origin, "k": kind, "d": data}) + "\n").encode())
+
+    async def _send(self, line: bytes):
+        pass
+
+    async def _on_line(self, line: bytes):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            return
+        if event.get("o") == self.origin:
+            return
+        self.received += 1
+        await self._dispatch(event.get("k"), event.get("d") or {})
+
+    async def _dispatch(self, kind: str, data: dict):
+        for handler in _handlers.get(kind, ()):
+            try:
+                await handler(data)
+            except Exception:
+                self.handler_errors += 1
+
+    def metrics(self) -> dict:
+        return {
+            "backend": self.name,
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+            "handler_errors": self.handler_errors,
+        }
+
+
+class UnixSocketBus(LocalBus):
+    """Newline-delimited JSON over a Unix socket with a lock-elected broker.
+
+    The broker relays every line it receives to all other peers and handles it
+    locally; its own events go straight to every peer.
+    """
+
+    name = "unix"
+
+    def __init__(self, path: str = REALTIME_SOCKET, max_buffer: int = REALTIME_MAX_BUFFER):
+        super().__init__()
+        self.path = path
+        self.max_buffer = max_buffer
+        self.is_broker = False
+        self._lock_fd: Optional[int] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: Set[asyncio.StreamWriter] = set()
+        self._peer_tasks: Set[asyncio.Task] = set()
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._ready: Optional[asyncio.Event] = None
+        self._stopping = False
+
+    async def start(self, timeout: float = 2.0):
+        self._stopping = False
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._ready.wait(), timeout)
+
+    async def stop(self):
+        self._stopping = True
+        if self._server is not None:
+            self._server.close()
+        for peer in list(self._peers):
+            peer.close()
+        self._peers.clear()
+        for task in list(self._peer_tasks):
+            task.cancel()
+        if self._peer_tasks:
+            await asyncio.gather(*self._peer_tasks, return_exceptions=True)
+        if self._writer is not None:
+            self._writer.close()
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await self._task
+        if self.is_broker:
+            # unlink before releasing the lock so the next broker binds a fresh path
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.path)
+            self.is_broker = False
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def _try_lock(self) -> bool:
+        fd = os.open(self.path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        # held until this process stops or dies; the kernel releases it either way
+        self._lock_fd = fd
+        return True
+
+    async def _run(self):
+        delay = 0.05
+        while not self._stopping:
+            if self._lock_fd is not None or self._try_lock():
+                await self._serve()
+                return
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=_MAX_LINE)
+            except OSError:
+                # the broker is still binding or has just died; the lock decides who takes over
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 1.0)
+                continue
+            delay = 0.05
+            self._writer = writer
+            self._ready.set()
+            try:
+                await self._read_loop(reader)
+            finally:
+                self._writer = None
+                self._ready.clear()
+                writer.close()
+
+    async def _serve(self):
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.path)  # stale socket from a broker that died
+        self._server = await asyncio.start_unix_server(self._handle_peer, path=self.path, limit=_MAX_LINE)
+        self.is_broker = True
+        self._ready.set()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _read_loop(self, reader: asyncio.StreamReader):
+        with contextlib.suppress(ConnectionError, ValueError):
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                await self._on_line(line)
+
+    async def _handle_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._peers.add(writer)
+        task = asyncio.current_task()
+        self._peer_tasks.add(task)
+        try:
+            with contextlib.suppress(ConnectionError, ValueError, asyncio.CancelledError):
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self._relay(line, exclude=writer)
+                    await self._on_line(line)
+        finally:
+            self._peers.discard(writer)
+            self._peer_tasks.discard(task)
+            writer.close()
+
+    def _relay(self, line: bytes, exclude: Optional[asyncio.StreamWriter] = None):
+        for peer in list(self._peers):
+            if peer is exclude:
+                continue
+            if peer.is_closing() or peer.transport.get_write_buffer_size() > self.max_buffer:
+                self.dropped += 1
+                self._peers.discard(peer)
+                peer.close()
+                continue
+            peer.write(line)
+
+    async def _send(self, line: bytes):
+        if self.is_broker:
+            self._relay(line)
+            return
+        writer = self._writer
+        if writer is None or writer.is_closing():
+            # between brokers: this worker's own users were already served locally
+            self.dropped += 1
+            return
+        writer.write(line)
+        if writer.transport.get_write_buffer_size() > self.max_buffer:
+            with contextlib.suppress(ConnectionError):
+                await writer.drain()
+
+    def metrics(self) -> dict:
+        data = super().metrics()
+        data.update({"path": self.path, "is_broker": self.is_broker, "peers": len(self._peers),
+                     "connected": self.is_broker or self._writer is not None})
+        return data
+
+
+class RedisBus(LocalBus):
+    name = "redis"
+
+    def __init__(self, url: str = REALTIME_REDIS_URL, channel: str = REALTIME_CHANNEL):
+        super().__init__()
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("REALTIME_BUS=redis requires the 'redis' package") from e
+        self._aioredis = aioredis
+        self.url = url
+        self.channel = channel
+        self._client = None
+        self._pubsub = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._client = self._aioredis.from_url(self.url)
+        self._pubsub = self._client.pubsub()
+        await self._pubsub.subscribe(self.channel)
+        self._task = asyncio.create_task(self._listen())
+
+    async def _listen(self):
+        async for message in self._pubsub.listen():
+            if message.get("type") == "message":
+                await self._on_line(message["data"])
+
+    async def _send(self, line: bytes):
+        try:
+            await self._client.publish(self.channel, line)
+        except Exception:
+            self.dropped += 1
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError, Exception):
+                await self._task
+        with contextlib.suppress(Exception):
+            await self._pubsub.unsubscribe(self.channel)
+            await self._client.close()
+
+    def metrics(self) -> dict:
+        data = super().metrics()
+        data.update({"channel": self.channel})
+        return data
+
+
+def make_bus(kind: str = REALTIME_BUS) -> LocalBus:
+    if kind == "unix":
+        return UnixSocketBus()
+    if kind == "redis":
+        return RedisBus()
+    if kind == "local":
+        return LocalBus()
+    raise ValueError(f"Unknown REALTIME_BUS {kind!r} (expected unix, redis or local)")
+
+
+# Until start_bus() runs (e.g. under the test client) events are handled in-process
+bus: LocalBus = LocalBus()
+
+
+async def start_bus(kind: Optional[str] = None) -> LocalBus:
+    global bus
+    new_bus = make_bus(kind or REALTIME_BUS)
+    await new_bus.start()
+    bus = new_bus
+    return bus
+
+
+async def stop_bus():
+    global bus
+    await bus.stop()
+    bus = LocalBus()
+
+
+async def publish(kind: str, data: dict):
+    await bus.publish(kind, data)
+
+
+# Websocket delivery; the handlers live next to the ConnectionManager
+async def send_to_users(frame: str, user_ids: Iterable[int]):
+    ids = [uid for uid in dict.fromkeys(user_ids) if uid is not None]
+    if ids:
+        await publish("ws.users", {"users": ids, "frame": frame})
+
+
+async def send_to_role(frame: str, role: str):
+    await publish("ws.role", {"role": role, "frame": frame})
+
+
+async def send_frames(frames: Iterable[tuple]):
+    """Publish distinct ``(user_id, frame)`` pairs as one event."""
+    pairs = [[uid, frame] for uid, frame in frames]
+    if pairs:
+        await publish("ws.frames", {"frames": pairs})
@@ -0,0 +1,276 @@
+"""In-process job scheduler with persisted state and a single leader.
+
+Jobs are registered with ``scheduler.add`` and run either every N seconds or
+daily at a local hour. Every worker runs the scheduler loop, but only the
+worker holding the SchedulerLease row runs jobs; the others retry the lease
+every SCHEDULER_LEASE_SECONDS / 2 and take over when it expires (a stopping
+leader releases it straight away).
+
+The leader keeps due times in a heap and sleeps until the earliest one. Each
+job's next run time and last run are stored in ScheduledJob:
+
+- a run is claimed by moving ``next_run_at`` forward with a compare-and-set,
+  so two leaders (e.g. around a lease handover) cannot both run it
+- runs missed while the app was down happen once on start-up, not once per
+  missed interval
+- a run left ``running`` by a leader that died is run again by the next one,
+  so jobs should be idempotent
+
+``lag_ms`` is how late a run started against its scheduled time.
+"""
+import asyncio
+import heapq
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.db.prisma_client import prisma
+
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() in ("1", "true", "yes")
+SCHEDULER_LEASE_SECONDS = float(os.getenv("SCHEDULER_LEASE_SECONDS", "30"))
+SCHEDULER_JOB_TIMEOUT = float(os.getenv("SCHEDULER_JOB_TIMEOUT", "1800"))
+_LEASE_NAME = "scheduler"
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _iso(value: datetime) -> str:
+    # fixed width so stored times compare correctly as strings
+    return value.astimezone(timezone.utc).replace(tzinfo=None).isoformat(timespec="microseconds")
+
+
+def _parse(value: str) -> datetime:
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+
+
+class Job:
+    __slots__ = ("name", "func", "every", "daily_at", "timeout")
+
+    def __init__(self, name: str, func: Callable[[], Awaitable], every: Optional[float] = None,
+                 daily_at: Optional[Tuple[int, int]] = None, timeout: Optional[float] = None):
+        if (every is None) == (daily_at is None):
+            raise ValueError("give exactly one of every or daily_at")
+        self.name = name
+        self.func = func
+        self.every = every
+        self.daily_at = daily_at  # (local hour, minute)
+        self.timeout = timeout or SCHEDULER_JOB_TIMEOUT
+
+    @property
+    def schedule(self) -> str:
+        if self.every is not None:
+            return f"every {self.every:g}s"
+        return "daily at {:02d}:{:02d}".format(*self.daily_at)
+
+    def following(self, scheduled: datetime, now: datetime) -> datetime:
+        """The run after one scheduled at ``scheduled`` that started at ``now``."""
+        if self.every is not None:
+            nxt = scheduled + timedelta(seconds=self.every)
+            return nxt if nxt > now else now + timedelta(seconds=self.every)
+        local = now.astimezone()
+        target = local.replace(hour=self.daily_at[0], minute=self.daily_at[1], second=0, microsecond=0)
+        if target <= local:
+            target += timedelta(days=1)
+        return target.astimezone(timezone.utc)
+
+    def first_run(self, now: datetime) -> datetime:
+        return now if self.every is not None else self.following(now, now)
+
+
+class Scheduler:
+    def __init__(self, lease_seconds: float = SCHEDULER_LEASE_SECONDS):
+        self.lease_seconds = lease_seconds
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.jobs: Dict[str, Job] = {}
+        self.is_leader = False
+        self._loaded = False
+        self._heap: List[Tuple[datetime, str]] = []
+        self._next: Dict[str, str] = {}  # job -> next_run_at as stored, for the claim
+        self._running: Dict[str, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    def add(self, name: str, func: Callable[[], Awaitable], every: Optional[float] = None,
+            daily_at: Optional[Tuple[int, int]] = None, timeout: Optional[float] = None) -> Job:
+        job = Job(name, func, every, daily_at, timeout)
+        self.jobs[name] = job
+        if self._wake is not None:
+            self._loaded = False  # picked up on the next pass
+            self._wake.set()
+        return job
+
+    # -- leadership -------------------------------------------------------
+
+    async def _acquire(self) -> bool:
+        now = _utcnow()
+        changed = await prisma.execute_raw(
+            "INSERT INTO SchedulerLease (name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+            "WHERE SchedulerLease.holder = excluded.holder OR SchedulerLease.expires_at < ?",
+            _LEASE_NAME, self.holder, _iso(now + timedelta(seconds=self.lease_seconds)), _iso(now),
+        )
+        return bool(changed)
+
+    async def _release(self) -> None:
+        await prisma.execute_raw("DELETE FROM SchedulerLease WHERE name = ? AND holder = ?", _LEASE_NAME, self.holder)
+
+    # -- job state --------------------------------------------------------
+
+    async def _load(self) -> None:
+        """Rebuild the heap from ScheduledJob after becoming leader."""
+        now = _utcnow()
+        rows = {r["name"]: r for r in await prisma.query_raw("SELECT name, next_run_at, last_status FROM ScheduledJob")}
+        self._heap, self._next = [], {}
+        for name, job in self.jobs.items():
+            row = rows.get(name)
+            if row is None:
+                next_run = _iso(job.first_run(now))
+                await prisma.execute_raw(
+                    "INSERT OR IGNORE INTO ScheduledJob (name, schedule, next_run_at, runs, failures) VALUES (?, ?, ?, 0, 0)",
+                    name, job.schedule, next_run,
+                )
+            elif row["last_status"] == "running" and name not in self._running:
+                # the previous leader died mid-run: run it again now
+                await prisma.execute_raw(
+                    "UPDATE ScheduledJob SET next_run_at = ?, last_status = 'interrupted' WHERE name = ?",
+                    _iso(now), name,
+                )
+                next_run = _iso(now)
+            else:
+                next_run = row["next_run_at"]
+                await prisma.execute_raw("UPDATE ScheduledJob SET schedule = ? WHERE name = ?", job.schedule, name)
+            self._next[name] = next_run
+            heapq.heappush(self._heap, (_parse(next_run), name))
+
+    async def _execute(self, job: Job, scheduled: datetime) -> None:
+        started = _utcnow()
+        following = job.following(scheduled, started)
+        claimed = await prisma.execute_raw(
+            "UPDATE ScheduledJob SET next_run_at = ?, last_started_at = ?, last_status = 'running', last_lag_ms = ?, "
+            "claimed_by = ? WHERE name = ? AND next_run_at = ?",
+            _iso(following), _iso(started), int((started - scheduled).total_seconds() * 1000), self.holder,
+            job.name, self._next[job.name],
+        )
+        if not claimed:
+            # someone else ran it; pick up their schedule
+            self._loaded = False
+            return
+        self._next[job.name] = _iso(following)
+        heapq.heappush(self._heap, (following, job.name))
+        clock = time.perf_counter()
+        status, error = "ok", None
+        try:
+            await asyncio.wait_for(job.func(), timeout=job.timeout)
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            status, error = "error", f"timed out after {job.timeout:g}s"
+        except Exception as e:
+            status, error = "error", f"{type(e).__name__}: {e}"[:500]
+        await prisma.execute_raw(
+            "UPDATE ScheduledJob SET last_finished_at = ?, last_status = ?, last_error = ?, last_duration_ms = ?, "
+            "runs = runs + 1, failures = failures + ?, claimed_by = NULL WHERE name = ?",
+            _iso(_utcnow()), status, error, int((time.perf_counter() - clock) * 1000), int(status != "ok"), job.name,
+        )
+
+    def _spawn(self, job: Job, scheduled: datetime) -> None:
+        if job.name in self._running:
+            # still running: this run is skipped and the next one is scheduled as usual
+            heapq.heappush(self._heap, (job.following(scheduled, _utcnow()), job.name))
+            return
+        task = asyncio.create_task(self._execute(job, scheduled))
+        self._running[job.name] = task
+        task.add_done_callback(lambda _t, name=job.name: self._running.pop(name, None))
+
+    async def run_pending(self) -> int:
+        """Start every due job; returns how many were started."""
+        now, started = _utcnow(), 0
+        while self._heap and self._heap[0][0] <= now:
+            scheduled, name = heapq.heappop(self._heap)
+            if name in self.jobs:
+                self._spawn(self.jobs[name], scheduled)
+                started += 1
+        return started
+
+    async def _loop(self) -> None:
+        while True:
+            timeout = self.lease_seconds / 2
+            try:
+                if await self._acquire():
+                    self.is_leader = True
+                    if not self._loaded:
+                        await self._load()
+                        self._loaded = True
+                    await self.run_pending()
+                    timeout = self.lease_seconds / 3
+                    if self._heap:
+                        timeout = min(timeout, max(0.0, (self._heap[0][0] - _utcnow()).total_seconds()))
+                else:
+                    self.is_leader = self._loaded = False
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.is_leader = self._loaded = False
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        if self._task is None and SCHEDULER_ENABLED:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        running = list(self._running.values())
+        for task in running:
+            task.cancel()
+        await asyncio.gather(self._task, *running, return_exceptions=True)
+        self._task = self._wake = None
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                await self._release()
+            except Exception:
+                pass
+
+    async def status(self) -> dict:
+        """Stored job state and lease holder; any worker can answer."""
+        now = _utcnow()
+        lease = await prisma.query_raw("SELECT holder, expires_at FROM SchedulerLease WHERE name = ?", _LEASE_NAME)
+        rows = await prisma.query_raw("SELECT * FROM ScheduledJob ORDER BY name")
+        jobs = []
+        for r in rows:
+            overdue = (now - _parse(r["next_run_at"])).total_seconds()
+            jobs.append({
+                "name": r["name"],
+                "schedule": r["schedule"],
+                "next_run_at": r["next_run_at"],
+                "last_started_at": r["last_started_at"],
+                "last_finished_at": r["last_finished_at"],
+                "last_status": r["last_status"],
+                "last_error": r["last_error"],
+                "lag_ms": r["last_lag_ms"],
+                "duration_ms": r["last_duration_ms"],
+                "overdue_ms": int(overdue * 1000) if overdue > 0 else 0,
+                "runs": int(r["runs"] or 0),
+                "failures": int(r["failures"] or 0),
+            })
+        return {
+            "leader": lease[0]["holder"] if lease and lease[0]["expires_at"] > _iso(now) else None,
+            "this_worker": self.holder,
+            "is_leader": self.is_leader,
+            "jobs": jobs,
+        }
+
+
+scheduler = Scheduler()
@@ -0,0 +1,122 @@
+"""Per-user access scope (visible classes and students), resolved once and cached.
+
+Teachers see the classes they are assigned to and the students in them;
+parents see their children and those children's classes; admins see
+everything. Routers use the ``*_where`` helpers instead of re-querying
+class/student links on every request.
+"""
+from typing import Any, Dict, FrozenSet, Optional
+
+from app.core import realtime
+from app.core.cache import KeyedCache
+from app.db.prisma_client import prisma
+
+# ('teacher', teacher_id) | ('parent', parent_id) -> AccessScope. Link changes
+# made through the API clear it in every worker; the TTL only bounds staleness
+# for changes made outside it.
+_scope_cache = KeyedCache(maxsize=4096, ttl=60)
+
+
+class AccessScope:
+    __slots__ = ("role", "owner_id", "class_ids", "student_classes", "unrestricted")
+
+    def __init__(self, role: str, owner_id: Optional[int] = None,
+                 student_classes: Optional[Dict[int, Optional[int]]] = None,
+                 class_ids: FrozenSet[int] = frozenset(), unrestricted: bool = False):
+        self.role = role
+        self.owner_id = owner_id
+        self.student_classes = student_classes or {}
+        self.class_ids = class_ids
+        self.unrestricted = unrestricted
+
+    @property
+    def student_ids(self) -> FrozenSet[int]:
+        return frozenset(self.student_classes)
+
+    @property
+    def is_empty(self) -> bool:
+        if self.unrestricted:
+            return False
+        if self.role == 'teacher':
+            return not self.class_ids
+        return not self.student_classes
+
+    def can_access_student(self, student_id: int) -> bool:
+        return self.unrestricted or student_id in self.student_classes
+
+    def can_access_class(self, class_id: Optional[int]) -> bool:
+        return self.unrestricted or (class_id is not None and class_id in self.class_ids)
+
+    # Ready-made where clauses; None means "no restriction"
+    def student_where(self) -> Optional[dict]:
+        if self.unrestricted:
+            return None
+        if self.role == 'parent':
+            return {'parent_id': self.owner_id}
+        return {'class_id': {'in': sorted(self.class_ids)}}
+
+    def class_where(self) -> Optional[dict]:
+        if self.unrestricted:
+            return None
+        if self.role == 'teacher':
+            return {'teacher_id': self.owner_id}
+        return {'id': {'in': sorted(self.class_ids)}}
+
+    def result_where(self) -> Optional[dict]:
+        if self.unrestricted:
+            return None
+        if self.role == 'teacher':
+            return {'class_id': {'in': sorted(self.class_ids)}}
+        return {'student_id': {'in': sorted(self.student_classes)}}
+
+    # attendance rows carry the same class/student links as results
+    attendance_where = result_where
+
+
+ADMIN_SCOPE = AccessScope('admin', unrestricted=True)
+
+
+async def resolve_scope(user: Any) -> AccessScope:
+    role = (getattr(user, 'role', '') or '').lower()
+    if role == 'admin':
+        return ADMIN_SCOPE
+    teacher = getattr(user, 'teacher', None)
+    parent = getattr(user, 'parent', None)
+    if role == 'teacher' and teacher:
+        key = ('teacher', teacher.id)
+        scope = _scope_cache.get(key)
+        if scope is None:
+            classes = await prisma.classmodel.find_many(where={'teacher_id': teacher.id}, include={'students': True})
+            scope = AccessScope(
+                'teacher', teacher.id,
+                student_classes={s.id: c.id for c in classes for s in (c.students or [])},
+                class_ids=frozenset(c.id for c in classes),
+            )
+            _scope_cache.set(key, scope)
+        return scope
+    if role == 'parent' and parent:
+        key = ('parent', parent.id)
+        scope = _scope_cache.get(key)
+        if scope is None:
+            children = await prisma.student.find_many(where={'parent_id': parent.id})
+            scope = AccessScope(
+                'parent', parent.id,
+                student_classes={c.id: c.class_id for c in children},
+                class_ids=frozenset(c.class_id for c in children if c.class_id),
+            )
+            _scope_cache.set(key, scope)
+        return scope
+    # role without a linked profile sees nothing
+    return AccessScope(role)
+
+
+async def invalidate_scopes() -> None:
+    """Drop cached scopes in every worker after class assignments or student parent/class links change."""
+    await realtime.publish("scope.changed", {})
+
+
+async def _on_scopes_changed(data: dict) -> None:
+    _scope_cache.clear()
+
+
+realtime.subscribe("scope.changed", _on_scopes_changed)
@@ -0,0 +1,136 @@
+"""Cached row totals for paginated list responses (``with_meta=true``).
+
+Totals are cached per (model, where clause) so a page turn does not re-run
+``COUNT(*)``. Writers report what they changed with ``record`` (rows added
+or removed, each with its column values) and every worker adjusts its
+cached totals in place over the realtime bus: a total whose where clause
+the row matches moves by one, others stay. A where clause this module cannot
+evaluate (anything beyond equality and ``in``), ``invalidate``, or an entry
+older than TOTALS_TTL marks the total stale, and the next exact read counts
+again.
+
+``approximate=True`` never waits for a count when any total is cached: a
+stale total is returned as is (flagged as not exact) and recounted in the
+background for the next read.
+"""
+import json
+import os
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from app.core import realtime
+from app.core.cache import KeyedCache
+from app.core.delivery import delivery_queue
+from app.db.prisma_client import prisma
+
+TOTALS_CACHE_SIZE = int(os.getenv("TOTALS_CACHE_SIZE", "2048"))
+# safety net for changes made outside the API (scripts, other services)
+TOTALS_TTL = float(os.getenv("TOTALS_TTL", "600"))
+
+stats = {"counts": 0, "cached": 0, "approximate": 0, "adjusted": 0}
+
+
+class _Total:
+    __slots__ = ("where", "count", "exact", "counted_at")
+
+    def __init__(self, where: dict, count: int, exact: bool):
+        self.where = where
+        self.count = count
+        self.exact = exact
+        self.counted_at = time.monotonic()
+
+
+_totals = KeyedCache(maxsize=TOTALS_CACHE_SIZE)
+_generation: Dict[str, int] = {}
+_refreshing: set = set()
+
+
+def _key(model: str, where: Optional[dict]) -> Tuple[str, str]:
+    return model, json.dumps(where or {}, sort_keys=True, default=str)
+
+
+def _matches(where: dict, row: dict) -> Optional[bool]:
+    """Whether ``row`` satisfies ``where``; None when that cannot be told from the row."""
+    for field, cond in where.items():
+        if field not in row:
+            return None
+        if isinstance(cond, dict):
+            if set(cond) != {"in"}:
+                return None
+            if row[field] not in cond["in"]:
+                return False
+        elif row[field] != cond:
+            return False
+    return True
+
+
+async def _recount(model: str, where: Optional[dict]) -> int:
+    generation = _generation.get(model, 0)
+    count = await getattr(prisma, model).count(where=where or None)
+    stats["counts"] += 1
+    # a change landing mid-count may or may not be included; keep it, but not as exact
+    _totals.set(_key(model, where), _Total(where or {}, count, _generation.get(model, 0) == generation))
+    return count
+
+
+async def _refresh(model: str, where: Optional[dict], key: tuple) -> None:
+    try:
+        await _recount(model, where)
+    finally:
+        _refreshing.discard(key)
+
+
+async def total(model: str, where: Optional[dict] = None, approximate: bool = False) -> Tuple[int, bool]:
+    """(total, exact) for ``prisma.<model>.count(where=where)``."""
+    key = _key(model, where)
+    entry = _totals.get(key)
+    if entry is not None and entry.exact and time.monotonic() - entry.counted_at < TOTALS_TTL:
+        stats["cached"] += 1
+        return entry.count, True
+    if entry is not None and approximate:
+        stats["approximate"] += 1
+        if key not in _refreshing:
+            _refreshing.add(key)
+            delivery_queue.submit("normal", _refresh, model, where, key)
+        return entry.count, False
+    return await _recount(model, where), True
+
+
+def row_values(row: Any) -> dict:
+    """JSON-safe scalar columns of a Prisma model (or dict), for ``record``."""
+    data = row if isinstance(row, dict) else row.dict()
+    return {k: v for k, v in data.items() if v is None or isinstance(v, (int, str, bool, float))}
+
+
+async def record(model: str, added: Iterable[Any] = (), removed: Iterable[Any] = ()) -> None:
+    """Adjust cached totals in every worker; an update is the old row removed and the new one added."""
+    added, removed = [row_values(r) for r in added], [row_values(r) for r in removed]
+    if added or removed:
+        await realtime.publish("totals.changed", {"model": model, "added": added, "removed": removed})
+
+
+async def invalidate(model: str) -> None:
+    """Mark every total for ``model`` stale, e.g. after a cascading delete."""
+    await realtime.publish("totals.changed", {"model": model, "invalidate": True})
+
+
+async def _on_changed(data: dict) -> None:
+    model = data["model"]
+    _generation[model] = _generation.get(model, 0) + 1
+    changes = [(1, row) for row in data.get("added", ())] + [(-1, row) for row in data.get("removed", ())]
+    for (entry_model, _), entry in _totals.items():
+        if entry_model != model:
+            continue
+        if data.get("invalidate"):
+            entry.exact = False
+            continue
+        for delta, row in changes:
+            matched = _matches(entry.where, row)
+            if matched is None:
+                entry.exact = False
+            elif matched:
+                entry.count = max(0, entry.count + delta)
+                stats["adjusted"] += 1
+
+
+realtime.subscribe("totals.changed", _on_changed)
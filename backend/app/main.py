@@ -13,7 +13,21 @@ from app.api import teachers_prisma as teachers
 from app.api import students_prisma as students
 from app.api import results_prisma as results
 from app.api import webhook
+from app.api import report_cards
+from app.api import notifications
+from app.api import calendar_feeds
+from app.api import scheduler as scheduler_api
 from app.db.prisma_client import init_prisma, close_prisma
+from app.core.delivery import delivery_queue
+from app.core.realtime import start_bus as start_realtime_bus, stop_bus as stop_realtime_bus
+from app.services.report_cards import shutdown_pool as shutdown_report_card_pool
+from app.services.unread import backfill_counters as backfill_unread_counters
+from app.services.message_search import ensure_search_index
+from app.services.conversations import backfill_conversations
+from app.services.email import start_email_worker, stop_email_worker
+from app.core.scheduler import scheduler
+from app.services.maintenance import register_jobs
+from app.services.calendar import backfill_event_times
 from prisma import Prisma
 import pathlib, time
 from urllib.parse import urlparse
@@ -36,7 +50,21 @@ def _ensure_sqlite_parent_dir():
 async def lifespan(app: FastAPI):
     _ensure_sqlite_parent_dir()
     await init_prisma()
+    await backfill_unread_counters()
+    await ensure_search_index()
+    await backfill_conversations()
+    await backfill_event_times()
+    await start_realtime_bus()
+    delivery_queue.start()
+    start_email_worker()
+    register_jobs(scheduler)
+    scheduler.start()
     yield
+    await scheduler.stop()
+    await stop_email_worker()
+    await delivery_queue.stop()
+    await stop_realtime_bus()
+    shutdown_report_card_pool()
     await close_prisma()
 
 app = FastAPI(title="PTS Manager API", version="0.1.0", lifespan=lifespan)
@@ -94,9 +122,13 @@ app.include_router(classes.router, prefix="/api")
 app.include_router(events.router, prefix="/api")
 app.include_router(messages.router, prefix="/api")
 app.include_router(results.router, prefix="/api")
+app.include_router(report_cards.router, prefix="/api")
 app.include_router(attendance.router, prefix="/api")
 app.include_router(websockets.router, prefix="/api")
 app.include_router(webhook.router, prefix="/api")
+app.include_router(notifications.router, prefix="/api")
+app.include_router(calendar_feeds.router, prefix="/api")
+app.include_router(scheduler_api.router, prefix="/api")
 
 @app.get("/api/_debug/routes")
 async def list_routes():
@@ -0,0 +1,272 @@
+"""Typed event times, the calendar range query and its response cache.
+
+``Event.date``/``Event.time`` stay as the free-form strings the UI sends;
+``starts_at``/``ends_at`` are derived from them on every write (or given
+explicitly) and are what range queries use. An event without a parsable
+time is all-day; one with a time lasts EVENT_DEFAULT_MINUTES.
+
+Recurring events are one row each; range queries expand them into
+occurrences for the requested window (see app/services/recurrence.py).
+
+Range responses are cached per query under the events collection version.
+The version is derived from the Event table itself (row count and the latest
+``updated_at``), so every worker and every restart agrees on it and ETags stay
+valid behind a load balancer. Event writes publish the new version on the
+realtime bus so every worker drops its cache at once; edits made outside the
+API are picked up when the version is re-read after CALENDAR_VERSION_TTL.
+"""
+import hashlib
+import json
+import os
+import time as _time
+from datetime import datetime, time, timedelta, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from app.core import realtime
+from app.core.cache import KeyedCache
+from app.db.prisma_client import prisma
+from app.services import recurrence
+
+EVENT_DEFAULT_MINUTES = int(os.getenv("EVENT_DEFAULT_MINUTES", "60"))
+CALENDAR_MAX_RANGE_DAYS = int(os.getenv("CALENDAR_MAX_RANGE_DAYS", "400"))
+CALENDAR_VERSION_TTL = float(os.getenv("CALENDAR_VERSION_TTL", "60"))
+CALENDAR_CACHE_TTL = float(os.getenv("CALENDAR_CACHE_TTL", "600"))
+
+_TIME_FORMATS = ("%H:%M", "%H:%M:%S", "%I:%M %p", "%I:%M%p", "%I %p", "%I%p")
+
+_range_cache = KeyedCache(maxsize=512, ttl=CALENDAR_CACHE_TTL)
+# checked_at is monotonic; 0 means the version has not been read from the table yet
+_version = {"value": "", "changed_at": datetime(1970, 1, 1, tzinfo=timezone.utc), "checked_at": 0.0}
+
+
+def parse_time(value: Optional[str]) -> Optional[time]:
+    value = (value or "").strip().upper()
+    for fmt in _TIME_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).time()
+        except ValueError:
+            continue
+    return None
+
+
+def as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Aware UTC datetime; naive values are taken to be UTC already."""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def parse_instant(value: str) -> datetime:
+    """ISO date or datetime as an aware UTC datetime; raises ValueError."""
+    value = value.strip()
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00")) if "T" in value or " " in value \
+        else datetime.combine(datetime.fromisoformat(value).date(), time.min)
+    return as_utc(parsed)
+
+
+def event_window(date: Optional[str], time_value: Optional[str]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """(starts_at, ends_at) for the free-form date/time fields, or (None, None)."""
+    try:
+        day = datetime.fromisoformat((date or "").strip()[:10]).date()
+    except ValueError:
+        return None, None
+    at = parse_time(time_value)
+    if at is None:
+        start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+        return start, start + timedelta(days=1)
+    start = datetime.combine(day, at, tzinfo=timezone.utc)
+    return start, start + timedelta(minutes=EVENT_DEFAULT_MINUTES)
+
+
+def is_all_day(starts_at: Optional[datetime], ends_at: Optional[datetime], time_value: Optional[str]) -> bool:
+    """Whole-day events: midnight to midnight with no parsable time of day."""
+    if not starts_at or not ends_at:
+        return False
+    start, end = as_utc(starts_at), as_utc(ends_at)
+    return start.time() == time.min and end.time() == time.min and end > start and parse_time(time_value) is None
+
+
+def with_window(data: dict, current=None) -> dict:
+    """Add starts_at/ends_at to a create/update payload when date or time change."""
+    if data.get("starts_at") or data.get("ends_at"):
+        return data
+    if "date" not in data and "time" not in data:
+        return data
+    date = data.get("date", getattr(current, "date", None))
+    time_value = data.get("time", getattr(current, "time", None))
+    starts_at, ends_at = event_window(date, time_value)
+    return {**data, "starts_at": starts_at, "ends_at": ends_at}
+
+
+async def backfill_event_times() -> int:
+    """Derive starts_at/ends_at for events written before the columns existed."""
+    events = await prisma.event.find_many(where={'starts_at': None, 'date': {'not': None}})
+    updated = 0
+    for ev in events:
+        starts_at, ends_at = event_window(ev.date, ev.time)
+        if starts_at:
+            await prisma.event.update(where={'id': ev.id}, data={'starts_at': starts_at, 'ends_at': ends_at})
+            updated += 1
+    return updated
+
+
+async def _data_version() -> Tuple[str, datetime]:
+    """(version, last change) as the Event table has them now."""
+    count = await prisma.event.count()
+    latest = await prisma.event.find_first(order=[{'updated_at': 'desc'}, {'id': 'desc'}])
+    updated_at = as_utc(latest.updated_at).replace(microsecond=0) if latest else datetime(1970, 1, 1, tzinfo=timezone.utc)
+    marker = f"{count}|{latest.id if latest else 0}|{updated_at.isoformat()}"
+    return hashlib.sha1(marker.encode()).hexdigest()[:12], updated_at
+
+
+def _set_version(value: str, changed_at: datetime) -> None:
+    previous = _version["value"]
+    _version["checked_at"] = _time.monotonic()
+    if value == previous:
+        return
+    # a delete leaves updated_at alone, so a change seen here must still move Last-Modified
+    if previous:
+        changed_at = max(changed_at, datetime.now(timezone.utc).replace(microsecond=0))
+    _version["value"], _version["changed_at"] = value, max(changed_at, _version["changed_at"])
+    _range_cache.clear()
+    if previous:
+        for listener in _change_listeners:
+            listener()
+
+
+async def collection_version() -> str:
+    """Current events version, re-read from the table at most every CALENDAR_VERSION_TTL seconds."""
+    if not _version["value"] or _time.monotonic() - _version["checked_at"] >= CALENDAR_VERSION_TTL:
+        # claim the check first so concurrent requests do not all re-read
+        _version["checked_at"] = _time.monotonic()
+        _set_version(*await _data_version())
+    return _version["value"]
+
+
+async def collection_changed_at() -> datetime:
+    """When events last changed (whole seconds, for Last-Modified)."""
+    await collection_version()
+    return _version["changed_at"]
+
+
+_change_listeners: list = []
+
+
+def on_events_changed(listener) -> None:
+    """Register a callable run (with no arguments) whenever the version changes."""
+    _change_listeners.append(listener)
+
+
+async def _on_events_changed(data: dict) -> None:
+    try:
+        changed_at = datetime.fromisoformat(data["changed_at"])
+    except (KeyError, TypeError, ValueError):
+        changed_at = datetime.now(timezone.utc).replace(microsecond=0)
+    _set_version(data["version"], changed_at)
+
+
+realtime.subscribe("events.changed", _on_events_changed)
+
+
+async def events_changed() -> None:
+    """Call after any event write."""
+    version, _ = await _data_version()
+    await realtime.publish("events.changed", {
+        "version": version,
+        "changed_at": datetime.now(timezone.utc).replace(microsecond=0).isoformat(),
+    })
+
+
+def iso(value: Optional[datetime]) -> Optional[str]:
+    if value is None:
+        return None
+    return as_utc(value).replace(tzinfo=None).isoformat() + "Z"
+
+
+def exdate_list(ev) -> List[str]:
+    return [d for d in (getattr(ev, "exdates", None) or "").split(",") if d]
+
+
+def event_dict(ev, starts_at: Optional[datetime] = None, ends_at: Optional[datetime] = None) -> dict:
+    """API shape of an event; pass starts_at/ends_at to describe one occurrence of a series."""
+    return {
+        "id": ev.id,
+        "title": ev.title,
+        "description": ev.description,
+        "date": ev.date,
+        "time": ev.time,
+        "type": ev.type,
+        "status": ev.status,
+        "audience": getattr(ev, "audience", None) or "all",
+        "class_id": getattr(ev, "class_id", None),
+        "starts_at": iso(starts_at or ev.starts_at),
+        "ends_at": iso(ends_at or ev.ends_at),
+        "rrule": getattr(ev, "rrule", None),
+        "exdates": exdate_list(ev),
+        "occurrence": starts_at is not None,
+    }
+
+
+def with_recurrence(data: dict, current=None) -> dict:
+    """Validate and normalize rrule/exdates and derive recur_until; raises ValueError."""
+    if not {"rrule", "exdates", "starts_at", "ends_at"} & set(data):
+        return data
+    rrule = data.get("rrule", getattr(current, "rrule", None))
+    if "exdates" in data:
+        data = {**data, "exdates": ",".join(recurrence.parse_exdates(data["exdates"] or ())) or None}
+    if not rrule:
+        return {**data, "rrule": None, "recur_until": None} if "rrule" in data else data
+    starts_at = as_utc(data.get("starts_at", getattr(current, "starts_at", None)))
+    ends_at = as_utc(data.get("ends_at", getattr(current, "ends_at", None)))
+    if not starts_at or not ends_at:
+        raise ValueError("Recurring events need a date or starts_at")
+    rule = recurrence.parse_rrule(rrule)
+    return {**data, "rrule": rule.to_rrule(), "recur_until": recurrence.series_end(rule, starts_at, ends_at - starts_at)}
+
+
+def visible_where(role: str, class_ids: Iterable[int] = (), unrestricted: bool = False) -> Optional[dict]:
+    """Events a user may see: everything for admins, otherwise school-wide or
+    their classes' events addressed to everyone or to their role."""
+    if unrestricted:
+        return None
+    return {'audience': {'in': ['all', role]},
+            'OR': [{'class_id': None}, {'class_id': {'in': sorted(class_ids)}}]}
+
+
+async def events_between(start: datetime, end: datetime, type_: Optional[str] = None,
+                         visible: Optional[dict] = None) -> List[dict]:
+    """Events and occurrences of recurring events overlapping [start, end), earliest first."""
+    single: dict = {'rrule': None, 'starts_at': {'lt': end}, 'ends_at': {'gt': start}}
+    series: dict = {'rrule': {'not': None}, 'starts_at': {'lt': end},
+                    'OR': [{'recur_until': None}, {'recur_until': {'gt': start}}]}
+    if type_:
+        single['type'] = series['type'] = type_
+    if visible:
+        single['AND'] = series['AND'] = [visible]
+    out = [(as_utc(ev.starts_at), ev.id, event_dict(ev))
+           for ev in await prisma.event.find_many(where=single, order=[{'starts_at': 'asc'}, {'id': 'asc'}])]
+    for ev in await prisma.event.find_many(where=series):
+        dtstart, duration = as_utc(ev.starts_at), as_utc(ev.ends_at) - as_utc(ev.starts_at)
+        for occ_start, occ_end in recurrence.occurrences(ev.rrule, dtstart, duration, start, end, tuple(exdate_list(ev))):
+            out.append((occ_start, ev.id, event_dict(ev, occ_start, occ_end)))
+    out.sort(key=lambda item: (item[0], item[1]))
+    return [item[2] for item in out]
+
+
+async def cached_range(start: datetime, end: datetime, type_: Optional[str] = None,
+                       visible: Optional[dict] = None) -> Tuple[str, bytes]:
+    """(etag, JSON body) for a range query as seen through ``visible``, rebuilt only after event writes."""
+    version = await collection_version()
+    audience = json.dumps(visible, sort_keys=True)
+    key = (version, start, end, type_, audience)
+    hit = _range_cache.get(key)
+    if hit is None:
+        body = json.dumps(await events_between(start, end, type_, visible), separators=(",", ":")).encode()
+        digest = hashlib.sha1(f"{version}|{start.isoformat()}|{end.isoformat()}|{type_}|{audience}".encode()).hexdigest()[:16]
+        hit = (f'W/"{digest}"', body)
+        # a write may have landed while querying; only cache under the version we read with
+        if _version["value"] == version:
+            _range_cache.set(key, hit)
+    return hit
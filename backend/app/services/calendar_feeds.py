@@ -0,0 +1,229 @@
+"""Subscribable ICS calendar feeds.
+
+Each user can hold one feed token (only its SHA-256 is stored in
+CalendarFeedToken); the token in the URL is the credential, because calendar
+apps cannot send an Authorization header. Feeds are:
+
+- ``role:<role>``           school-wide events for the user's role
+- ``class:<id>:<role>``     events of one class the user can see
+
+Rendered feeds are cached per feed key under the events collection version
+(see app/services/calendar.py), so the ICS is built once per event change no
+matter how many subscribers poll it; concurrent polls after a change share
+one build. The ETag and Last-Modified come from that version, which lets
+most polls end in a 304 without touching the database.
+
+Recurring events are published as one VEVENT with RRULE/EXDATE for the
+subscriber's calendar app to expand. Events that ended more than
+CALENDAR_FEED_PAST_DAYS ago are left out.
+"""
+import asyncio
+import hashlib
+import os
+import secrets
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.core import realtime
+from app.core.cache import KeyedCache
+from app.db.prisma_client import prisma
+from app.services import calendar
+
+CALENDAR_FEED_PAST_DAYS = int(os.getenv("CALENDAR_FEED_PAST_DAYS", "90"))
+CALENDAR_FEED_REFRESH_MINUTES = int(os.getenv("CALENDAR_FEED_REFRESH_MINUTES", "30"))
+CALENDAR_NAME = os.getenv("CALENDAR_NAME", "School events")
+ROLES = ("admin", "teacher", "parent")
+
+_feed_cache = KeyedCache(maxsize=1024)
+_building: Dict[tuple, asyncio.Future] = {}
+# token hash -> user id; the TTL only bounds staleness for rotations in another worker
+_token_cache = KeyedCache(maxsize=4096, ttl=60)
+stats = {"builds": 0, "served": 0, "not_modified": 0}
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+async def issue_token(user_id: int) -> str:
+    """Create or rotate the user's feed token; the previous URLs stop working."""
+    token = secrets.token_urlsafe(32)
+    await revoke_token(user_id)
+    await prisma.execute_raw(
+        "INSERT INTO CalendarFeedToken (user_id, token_hash, created_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET token_hash = excluded.token_hash, created_at = excluded.created_at",
+        user_id, hash_token(token), datetime.utcnow().isoformat(),
+    )
+    return token
+
+
+async def revoke_token(user_id: int) -> bool:
+    rows = await prisma.query_raw("SELECT token_hash FROM CalendarFeedToken WHERE user_id = ?", user_id)
+    if not rows:
+        return False
+    await prisma.execute_raw("DELETE FROM CalendarFeedToken WHERE user_id = ?", user_id)
+    await realtime.publish("calendar.feed_token", {"token_hash": rows[0]["token_hash"]})
+    return True
+
+
+async def _on_token_revoked(data: dict) -> None:
+    _token_cache.pop(data.get("token_hash"))
+
+
+realtime.subscribe("calendar.feed_token", _on_token_revoked)
+
+
+async def token_user_id(token: str) -> Optional[int]:
+    token_hash = hash_token(token)
+    user_id = _token_cache.get(token_hash)
+    if user_id is None:
+        rows = await prisma.query_raw("SELECT user_id FROM CalendarFeedToken WHERE token_hash = ?", token_hash)
+        if not rows:
+            return None
+        user_id = int(rows[0]["user_id"])
+        _token_cache.set(token_hash, user_id)
+    return user_id
+
+
+def _escape(text: str) -> str:
+    return (text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def _fold(line: str) -> str:
+    """Fold a content line at 75 octets without splitting UTF-8 sequences (RFC 5545 3.1)."""
+    if len(line.encode()) <= 75:
+        return line
+    parts, current, size = [], "", 0
+    for ch in line:
+        n = len(ch.encode())
+        if size + n > (75 if not parts else 74):
+            parts.append(current)
+            current, size = "", 0
+        current += ch
+        size += n
+    parts.append(current)
+    return "\r\n ".join(parts)
+
+
+def _utc(value: datetime) -> str:
+    return calendar.as_utc(value).strftime("%Y%m%dT%H%M%SZ")
+
+
+def vevent_lines(ev) -> List[str]:
+    all_day = calendar.is_all_day(ev.starts_at, ev.ends_at, ev.time)
+    lines = ["BEGIN:VEVENT", f"UID:event-{ev.id}@ptsmanager",
+             f"DTSTAMP:{_utc(ev.updated_at or ev.created_at)}"]
+    if all_day:
+        lines += [f"DTSTART;VALUE=DATE:{calendar.as_utc(ev.starts_at):%Y%m%d}",
+                  f"DTEND;VALUE=DATE:{calendar.as_utc(ev.ends_at):%Y%m%d}"]
+    else:
+        lines += [f"DTSTART:{_utc(ev.starts_at)}", f"DTEND:{_utc(ev.ends_at)}"]
+    lines.append(f"SUMMARY:{_escape(ev.title)}")
+    if ev.description:
+        lines.append(f"DESCRIPTION:{_escape(ev.description)}")
+    if ev.type:
+        lines.append(f"CATEGORIES:{_escape(ev.type)}")
+    lines.append("STATUS:CANCELLED" if (ev.status or "").lower() == "cancelled" else "STATUS:CONFIRMED")
+    if getattr(ev, "rrule", None):
+        lines.append(f"RRULE:{ev.rrule}")
+        for day in calendar.exdate_list(ev):
+            if all_day:
+                lines.append(f"EXDATE;VALUE=DATE:{day.replace('-', '')}")
+            else:
+                at = calendar.as_utc(ev.starts_at).time()
+                lines.append(f"EXDATE:{datetime.combine(datetime.fromisoformat(day).date(), at):%Y%m%dT%H%M%SZ}")
+    lines.append("END:VEVENT")
+    return lines
+
+
+def render_ics(events, name: str) -> bytes:
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//ptsmanager//School calendar//EN",
+             "CALSCALE:GREGORIAN", "METHOD:PUBLISH", f"X-WR-CALNAME:{_escape(name)}",
+             f"REFRESH-INTERVAL;VALUE=DURATION:PT{CALENDAR_FEED_REFRESH_MINUTES}M",
+             f"X-PUBLISHED-TTL:PT{CALENDAR_FEED_REFRESH_MINUTES}M"]
+    for ev in events:
+        lines += vevent_lines(ev)
+    lines.append("END:VCALENDAR")
+    return ("\r\n".join(_fold(line) for line in lines) + "\r\n").encode()
+
+
+def _audiences(role: str) -> Optional[List[str]]:
+    return None if role == "admin" else ["all", role]
+
+
+async def feed_events(role: str, class_id: Optional[int] = None) -> list:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=CALENDAR_FEED_PAST_DAYS)
+    where: dict = {
+        'class_id': class_id,
+        'starts_at': {'not': None},
+        'OR': [{'rrule': None, 'ends_at': {'gt': cutoff}},
+               {'rrule': {'not': None}, 'recur_until': None},
+               {'rrule': {'not': None}, 'recur_until': {'gt': cutoff}}],
+    }
+    audiences = _audiences(role)
+    if audiences:
+        where['audience'] = {'in': audiences}
+    return await prisma.event.find_many(where=where, order=[{'starts_at': 'asc'}, {'id': 'asc'}])
+
+
+async def _build(version: str, role: str, class_id: Optional[int], name: Optional[str]) -> Tuple[str, datetime, bytes]:
+    if name is None:
+        name = CALENDAR_NAME
+        if class_id is not None:
+            klass = await prisma.classmodel.find_unique(where={'id': class_id})
+            if not klass:
+                raise LookupError(f"Class {class_id} not found")
+            name = f"{CALENDAR_NAME}: {klass.name}"
+    body = render_ics(await feed_events(role, class_id), name)
+    stats["builds"] += 1
+    etag = '"' + hashlib.sha1(f"{version}|{role}|{class_id}".encode()).hexdigest()[:16] + '"'
+    return etag, await calendar.collection_changed_at(), body
+
+
+async def cached_feed(role: str, class_id: Optional[int] = None, name: Optional[str] = None) -> Tuple[str, datetime, bytes]:
+    """(etag, last_modified, ICS bytes) for a feed, built once per events version.
+
+    The calendar name defaults to CALENDAR_NAME plus the class name for class
+    feeds; the class is only looked up when the feed is (re)built, so a
+    cached poll stays off the database. Raises LookupError for an unknown class.
+    """
+    version = await calendar.collection_version()
+    key = (version, role, class_id)
+    hit = _feed_cache.get(key)
+    if hit is not None:
+        return hit
+    pending = _building.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+    future = asyncio.get_running_loop().create_future()
+    _building[key] = future
+    try:
+        hit = await _build(version, role, class_id, name)
+        # a write may have landed while querying; only cache under the version we read with
+        if await calendar.collection_version() == version:
+            _feed_cache.set(key, hit)
+        future.set_result(hit)
+        return hit
+    except BaseException as e:
+        future.set_exception(e)
+        future.exception()  # mark retrieved when no one else was waiting
+        raise
+    finally:
+        _building.pop(key, None)
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(calendar.as_utc(value), usegmt=True)
+
+
+def _clear_feeds() -> None:
+    _feed_cache.clear()
+
+
+calendar.on_events_changed(_clear_feeds)
+
+
+def feed_stats() -> dict:
+    return {**stats, "cached_feeds": len(_feed_cache), "hits": _feed_cache.hits, "misses": _feed_cache.misses}
@@ -0,0 +1,109 @@
+"""Per-user conversation index for the inbox.
+
+Direct messages carry a ``conversation_key``: the participant pair
+(``p:{low id}:{high id}``) unless the message replies to one that already
+has a key, in which case it joins that thread. Each participant gets a
+Conversation row with the thread's last message, last activity and unread
+count, upserted in the same request that writes the messages, so the inbox
+is one range scan on (user_id, last_activity, key).
+"""
+from typing import List, Optional, Tuple
+
+from app.core import pagination
+from app.db.prisma_client import prisma
+
+_UPSERT = (
+    "INSERT INTO Conversation (user_id, key, peer_id, last_message_id, last_activity, unread_count) "
+    "SELECT * FROM ("
+    " SELECT recipient_id, conversation_key, sender_id, id, COALESCE(created_at, ''), 1 "
+    "FROM Message WHERE {where}"
+    " UNION ALL"
+    " SELECT sender_id, conversation_key, recipient_id, id, COALESCE(created_at, ''), 0 FROM Message WHERE {where} AND sender_id <> recipient_id"
+    ") WHERE true "
+    "ON CONFLICT(user_id, key) DO UPDATE SET "
+    "peer_id = excluded.peer_id, "
+    "unread_count = Conversation.unread_count + excluded.unread_count, "
+    "last_activity = CASE WHEN excluded.last_message_id > Conversation.last_message_id "
+    "THEN excluded.last_activity ELSE Conversation.last_activity END, "
+    "last_message_id = MAX(Conversation.last_message_id, excluded.last_message_id)"
+)
+_THREADED = "conversation_key IS NOT NULL AND sender_id IS NOT NULL AND recipient_id IS NOT NULL"
+
+
+def pair_key(a: int, b: int) -> str:
+    low, high = sorted((a, b))
+    return f"p:{low}:{high}"
+
+
+async def record_message(message_id: int) -> None:
+    await prisma.execute_raw(_UPSERT.format(where=f"id = ? AND {_THREADED}"), message_id, message_id)
+
+
+async def record_broadcast(broadcast_id: str) -> None:
+    await prisma.execute_raw(_UPSERT.format(where=f"broadcast_id = ? AND {_THREADED}"), broadcast_id, broadcast_id)
+
+
+async def refresh_unread(*user_ids: int) -> None:
+    """Recount unread messages for the users' threads that still show any."""
+    if not user_ids:
+        return
+    await prisma.execute_raw(
+        "UPDATE Conversation SET unread_count = ("
+        "SELECT COUNT(*) FROM Message m WHERE m.conversation_key = Conversation.key "
+        "AND m.recipient_id = Conversation.user_id AND m.read_at IS NULL) "
+        f"WHERE user_id IN ({', '.join('?' for _ in user_ids)}) AND unread_count > 0",
+        *user_ids,
+    )
+
+
+def encode_cursor(last_activity: str, key: str) -> str:
+    return pagination.encode_cursor([last_activity, key])
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[str, str]]:
+    values = pagination.decode_cursor(cursor)
+    if not values or len(values) != 2:
+        return None
+    return str(values[0]), str(values[1])
+
+
+async def inbox(user_id: int, limit: int = 20, after: Optional[Tuple[str, str]] = None) -> List[dict]:
+    """Threads by most recent activity; ``after`` is the (last_activity, key) of the previous page's last row."""
+    sql = (
+        "SELECT c.key, c.peer_id, c.last_message_id, c.last_activity, c.unread_count, "
+        "u.name AS peer_name, m.subject, m.body, m.sender_id "
+        "FROM Conversation c "
+        "LEFT JOIN Message m ON m.id = c.last_message_id "
+        "LEFT JOIN User u ON u.id = c.peer_id "
+        "WHERE c.user_id = ?"
+    )
+    params: list = [user_id]
+    if after is not None:
+        sql += " AND (c.last_activity < ? OR (c.last_activity = ? AND c.key < ?))"
+        params += [after[0], after[0], after[1]]
+    sql += " ORDER BY c.last_activity DESC, c.key DESC LIMIT ?"
+    params.append(limit)
+    return await prisma.query_raw(sql, *params)
+
+
+async def backfill_conversations() -> None:
+    """Thread existing direct messages and build the index the first time it is empty."""
+    rows = await prisma.query_raw("SELECT COUNT(*) AS n FROM Conversation")
+    if rows and int(rows[0]["n"]):
+        return
+    await prisma.execute_raw(
+        "UPDATE Message SET conversation_key = 'p:' || MIN(sender_id, recipient_id) || ':' || MAX(sender_id, recipient_id) "
+        "WHERE conversation_key IS NULL AND sender_id IS NOT NULL AND recipient_id IS NOT NULL"
+    )
+    await prisma.execute_raw(
+        "INSERT OR IGNORE INTO Conversation (user_id, key, peer_id, last_message_id, last_activity, unread_count) "
+        "SELECT p.user_id, p.key, p.peer_id, p.last_id, COALESCE(m.created_at, ''), p.unread FROM ("
+        " SELECT user_id, key, MAX(peer_id) AS peer_id, MAX(last_id) AS last_id, SUM(unread) AS unread FROM ("
+        "  SELECT recipient_id AS user_id, conversation_key AS key, sender_id AS peer_id, MAX(id) AS last_id, "
+        "   SUM(read_at IS NULL) AS unread FROM Message WHERE " + _THREADED + " GROUP BY recipient_id, conversation_key"
+        "  UNION ALL"
+        "  SELECT sender_id, conversation_key, recipient_id, MAX(id), 0 FROM Message WHERE " + _THREADED +
+        "   GROUP BY sender_id, conversation_key"
+        " ) GROUP BY user_id, key"
+        ") p JOIN Message m ON m.id = p.last_id"
+    )
@@ -0,0 +1,181 @@
+"""Parent notifications for attendance, results and events, with a daily digest.
+
+Each user's NotificationPreference picks a mode:
+
+- ``realtime`` every notification is pushed to their websocket and emailed
+- ``digest``   notifications are buffered in DigestItem and sent as one
+  email per user when the daily digest job runs
+- ``off``      notifications are dropped
+
+Users without a row get NOTIFY_DEFAULT_MODE, which is ``off`` so parents only
+receive notifications once they (or a deployment setting) opt in. Digested items are kept for
+DIGEST_RETENTION_DAYS after sending, which is what ``digest_metrics`` uses to
+report how many deliveries the digest saved.
+"""
+import json
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.core import realtime
+from app.db.prisma_client import prisma
+from app.services import email as email_service
+
+NOTIFICATION_MODES = ("realtime", "digest", "off")
+NOTIFY_DEFAULT_MODE = os.getenv("NOTIFY_DEFAULT_MODE", "off")
+DIGEST_HOUR = int(os.getenv("DIGEST_HOUR", "18"))  # local hour the scheduler sends the daily digest
+DIGEST_RETENTION_DAYS = int(os.getenv("DIGEST_RETENTION_DAYS", "30"))
+
+KIND_HEADINGS = {"attendance": "Attendance", "result": "Results", "event": "Events"}
+
+# since process start; digest savings are reported from the table instead
+stats = {"realtime": 0, "buffered": 0, "dropped": 0}
+last_run: dict = {}
+
+
+async def preference_modes(user_ids: Iterable[int]) -> Dict[int, str]:
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return {}
+    rows = await prisma.query_raw(
+        f"SELECT user_id, mode FROM NotificationPreference WHERE user_id IN ({', '.join('?' for _ in user_ids)})",
+        *user_ids,
+    )
+    modes = {int(r["user_id"]): r["mode"] for r in rows}
+    return {uid: modes.get(uid, NOTIFY_DEFAULT_MODE) for uid in user_ids}
+
+
+async def set_preference(user_id: int, mode: str) -> str:
+    if mode not in NOTIFICATION_MODES:
+        raise ValueError(f"mode must be one of {', '.join(NOTIFICATION_MODES)}")
+    await prisma.execute_raw(
+        "INSERT INTO NotificationPreference (user_id, mode, updated_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET mode = excluded.mode, updated_at = excluded.updated_at",
+        user_id, mode, datetime.utcnow().isoformat(),
+    )
+    return mode
+
+
+async def notify(notifications: List[Tuple[int, str, str]]) -> dict:
+    """Route (user_id, kind, text) notifications by each user's preference."""
+    if not notifications:
+        return {}
+    modes = await preference_modes(uid for uid, _, _ in notifications)
+    now = datetime.utcnow().isoformat()
+    buffered, pushed = [], []
+    for uid, kind, text in notifications:
+        mode = modes[uid]
+        if mode == "digest":
+            buffered.append({'user_id': uid, 'kind': kind, 'text': text, 'created_at': now})
+        elif mode == "realtime":
+            pushed.append((uid, kind, text))
+        else:
+            stats["dropped"] += 1
+    if buffered:
+        await prisma.digestitem.create_many(data=buffered)
+        stats["buffered"] += len(buffered)
+    if pushed:
+        await realtime.send_frames(
+            (uid, json.dumps({"type": "notification", "kind": kind, "text": text, "created_at": now}))
+            for uid, kind, text in pushed
+        )
+        users = {u.id: u for u in await prisma.user.find_many(where={'id': {'in': list({p[0] for p in pushed})}})}
+        await email_service.enqueue("notification", (
+            (users[uid].email, {"name": users[uid].name, "subject": KIND_HEADINGS.get(kind, "Update"), "text": text})
+            for uid, kind, text in pushed if uid in users
+        ))
+        stats["realtime"] += len(pushed)
+    return {"realtime": len(pushed), "buffered": len(buffered)}
+
+
+async def notify_parents(items: List[Tuple[int, str, str]]) -> dict:
+    """Notify the parents of the students in (student_id, kind, text) items.
+
+    ``{student}`` in the text is replaced with the student's name.
+    """
+    student_ids = list({sid for sid, _, _ in items})
+    if not student_ids:
+        return {}
+    students = await prisma.student.find_many(where={'id': {'in': student_ids}}, include={'parent': True})
+    by_id = {s.id: s for s in students if s.parent}
+    return await notify([
+        (by_id[sid].parent.user_id, kind, text.replace("{student}", by_id[sid].name))
+        for sid, kind, text in items if sid in by_id
+    ])
+
+
+async def notify_class_parents(class_ids: Iterable[Optional[int]], kind: str, text: str) -> dict:
+    """Notify every parent with a child in one of the classes (or all parents for None)."""
+    class_ids = set(class_ids)
+    where = None if None in class_ids else {'students': {'some': {'class_id': {'in': list(class_ids)}}}}
+    parents = await prisma.parent.find_many(where=where)
+    return await notify([(p.user_id, kind, text) for p in parents])
+
+
+def render_digest(items: List[dict]) -> str:
+    sections = []
+    for kind in sorted({i["kind"] for i in items}, key=lambda k: list(KIND_HEADINGS).index(k) if k in KIND_HEADINGS else 99):
+        lines = "\n".join(f"  - {i['text']}" for i in items if i["kind"] == kind)
+        sections.append(f"{KIND_HEADINGS.get(kind, kind.title())}\n{lines}")
+    return "\n\n".join(sections)
+
+
+async def send_digests() -> dict:
+    """Send one digest email per user for everything buffered so far."""
+    digest_id = uuid.uuid4().hex
+    now = datetime.utcnow()
+    # claiming with the run id keeps overlapping runs from sending an item twice
+    claimed = await prisma.execute_raw(
+        "UPDATE DigestItem SET digest_id = ?, sent_at = ? WHERE sent_at IS NULL", digest_id, now.isoformat()
+    )
+    users = 0
+    if claimed:
+        rows = await prisma.query_raw(
+            "SELECT user_id, kind, text FROM DigestItem WHERE digest_id = ? ORDER BY user_id, id", digest_id
+        )
+        per_user: Dict[int, List[dict]] = {}
+        for row in rows:
+            per_user.setdefault(int(row["user_id"]), []).append(row)
+        modes = await preference_modes(per_user)
+        recipients = [uid for uid in per_user if modes[uid] != "off"]
+        muted = [uid for uid in per_user if modes[uid] == "off"]
+        if muted:
+            # switched to "off" since buffering: drop rather than count as delivered
+            await prisma.execute_raw(
+                f"DELETE FROM DigestItem WHERE digest_id = ? AND user_id IN ({', '.join('?' for _ in muted)})",
+                digest_id, *muted,
+            )
+        accounts = {u.id: u for u in await prisma.user.find_many(where={'id': {'in': recipients}})}
+        day = now.strftime("%d %b %Y")
+        users = await email_service.enqueue("digest", (
+            (accounts[uid].email, {"name": accounts[uid].name, "date": day, "count": len(per_user[uid]),
+                                   "items": render_digest(per_user[uid])})
+            for uid in recipients if uid in accounts
+        ))
+    cutoff = (now - timedelta(days=DIGEST_RETENTION_DAYS)).isoformat()
+    purged = await prisma.execute_raw("DELETE FROM DigestItem WHERE sent_at IS NOT NULL AND sent_at < ?", cutoff)
+    last_run.clear()
+    last_run.update({"finished_at": now.isoformat(), "items": claimed, "digests": users, "purged": purged})
+    return dict(last_run)
+
+
+async def digest_metrics(days: int = DIGEST_RETENTION_DAYS) -> dict:
+    since = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    rows = await prisma.query_raw(
+        "SELECT COUNT(*) AS items, COUNT(DISTINCT digest_id || ':' || user_id) AS digests "
+        "FROM DigestItem WHERE sent_at >= ?", since
+    )
+    items, digests = (int(rows[0]["items"]), int(rows[0]["digests"])) if rows else (0, 0)
+    pending = await prisma.query_raw("SELECT COUNT(*) AS n FROM DigestItem WHERE sent_at IS NULL")
+    return {
+        "days": days,
+        "notifications_digested": items,
+        "digests_sent": digests,
+        "deliveries_saved": items - digests,
+        "reduction": round(1 - digests / items, 4) if items else None,
+        "pending": int(pending[0]["n"]) if pending else 0,
+        "since_start": dict(stats),
+        "last_run": dict(last_run) or None,
+    }
+
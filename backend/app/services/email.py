@@ -0,0 +1,406 @@
+"""Outbound email: a persistent outbox drained by pooled SMTP connections.
+
+Callers only insert EmailOutbox rows (``enqueue``) and return; sending runs
+on the delivery lane for the email's priority. A flush claims up to
+EMAIL_BATCH due rows, renders them from cached templates and splits the
+batch across at most EMAIL_WORKERS SMTP connections, each sending its share
+in a thread. Connections stay open between batches and are recycled after
+SMTP_MAX_PER_CONNECTION messages.
+
+Temporary failures (connection errors, 4xx replies) are retried with
+exponential backoff up to EMAIL_MAX_ATTEMPTS; rejected recipients fail
+immediately. A claimed row's ``next_attempt_at`` doubles as its lease, so
+rows left behind by a crashed worker are picked up again once it expires.
+
+EMAIL_BACKEND is ``smtp`` when SMTP_HOST is set and ``none`` otherwise: with
+no backend configured, rows fail with a logged warning instead of being
+delivered anywhere. ``console`` must be chosen explicitly (local
+development); it logs only the recipient and subject, never the body, which
+can carry reset and verification tokens.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import smtplib
+import time
+import uuid
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from email.utils import make_msgid
+from functools import lru_cache
+from string import Template
+from typing import Iterable, List, Optional, Tuple
+
+from app.core.delivery import delivery_queue
+from app.db.prisma_client import prisma
+
+logger = logging.getLogger(__name__)
+
+SMTP_HOST = os.getenv("SMTP_HOST", "")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USERNAME = os.getenv("SMTP_USERNAME", "")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+SMTP_SSL = os.getenv("SMTP_SSL", "false").lower() in ("1", "true", "yes")
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "15"))
+SMTP_MAX_PER_CONNECTION = int(os.getenv("SMTP_MAX_PER_CONNECTION", "500"))
+EMAIL_BACKEND = os.getenv("EMAIL_BACKEND", "smtp" if SMTP_HOST else "none").lower()
+EMAIL_FROM = os.getenv("EMAIL_FROM", "PTS Manager <no-reply@ptsmanager.local>")
+EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", "4"))
+EMAIL_BATCH = int(os.getenv("EMAIL_BATCH", "200"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "6"))
+EMAIL_RETRY_BASE = float(os.getenv("EMAIL_RETRY_BASE", "30"))
+EMAIL_RETRY_MAX = float(os.getenv("EMAIL_RETRY_MAX", "3600"))
+EMAIL_LEASE_SECONDS = int(os.getenv("EMAIL_LEASE_SECONDS", "300"))
+EMAIL_POLL_INTERVAL = float(os.getenv("EMAIL_POLL_INTERVAL", "10"))
+EMAIL_TEMPLATE_DIR = os.getenv("EMAIL_TEMPLATE_DIR", "")
+APP_BASE_URL = os.getenv("APP_BASE_URL", "http://localhost:5173").rstrip("/")
+
+# name -> (subject, body); EMAIL_TEMPLATE_DIR/<name>.txt overrides, with the
+# subject on a first "Subject:" line
+TEMPLATES = {
+    "verify_email": (
+        "Verify your PTS Manager email",
+        "Hello $name,\n\nConfirm your email address by opening:\n$link\n\n"
+        "Verification code: $token\n\nIf you did not ask for this, you can ignore this email.\n",
+    ),
+    "password_reset": (
+        "Reset your PTS Manager password",
+        "Hello $name,\n\nReset your password within the next hour:\n$link\n\n"
+        "Reset token: $token\n\nIf you did not ask for a reset, you can ignore this email.\n",
+    ),
+    "broadcast": (
+        "$subject",
+        "Hello $name,\n\n$body\n\n- $sender, via PTS Manager\n",
+    ),
+    "notification": (
+        "$subject update",
+        "Hello $name,\n\n$text\n\nYou can switch to a daily digest in your notification settings.\n",
+    ),
+    "digest": (
+        "Your PTS Manager summary for $date",
+        "Hello $name,\n\nHere are today's $count updates:\n\n$items\n\n"
+        "You can change how often you hear from us in your notification settings.\n",
+    ),
+}
+
+_PRIORITY_ORDER = "CASE priority WHEN 'urgent' THEN 0 WHEN 'high' THEN 1 ELSE 2 END"
+
+stats = {"sent": 0, "retried": 0, "failed": 0, "batches": 0, "seconds": 0.0}
+
+
+@lru_cache(maxsize=None)
+def _compiled(name: str) -> Tuple[Template, Template]:
+    subject, body = TEMPLATES[name]
+    path = os.path.join(EMAIL_TEMPLATE_DIR, f"{name}.txt") if EMAIL_TEMPLATE_DIR else ""
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as fh:
+            text = fh.read()
+        first, _, rest = text.partition("\n")
+        if first.lower().startswith("subject:"):
+            subject, body = first.split(":", 1)[1].strip(), rest.lstrip("\n")
+        else:
+            body = text
+    return Template(subject), Template(body)
+
+
+def render(name: str, context: dict) -> Tuple[str, str]:
+    subject, body = _compiled(name)
+    return subject.safe_substitute(context), body.safe_substitute(context)
+
+
+def build_message(to_address: str, subject: str, body: str) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = EMAIL_FROM
+    msg["To"] = to_address
+    # headers cannot carry newlines from user-provided subjects
+    msg["Subject"] = " ".join(subject.split())
+    msg["Message-ID"] = make_msgid(domain="ptsmanager")
+    msg.set_content(body)
+    return msg
+
+
+class _Connection:
+    def __init__(self):
+        self.smtp: Optional[smtplib.SMTP] = None
+        self.sent = 0
+
+    def close(self) -> None:
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                try:
+                    self.smtp.close()
+                except Exception:
+                    pass
+        self.smtp = None
+        self.sent = 0
+
+
+class SmtpPool:
+    """Up to ``size`` persistent SMTP sessions; each batch share runs in a thread."""
+
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT, username: str = SMTP_USERNAME,
+                 password: str = SMTP_PASSWORD, starttls: bool = SMTP_STARTTLS, use_ssl: bool = SMTP_SSL,
+                 timeout: float = SMTP_TIMEOUT, size: int = EMAIL_WORKERS,
+                 max_per_connection: int = SMTP_MAX_PER_CONNECTION):
+        self.host, self.port = host, port
+        self.username, self.password = username, password
+        self.starttls, self.use_ssl = starttls, use_ssl
+        self.timeout = timeout
+        self.size = max(1, size)
+        self.max_per_connection = max_per_connection
+        self._connections = [_Connection() for _ in range(self.size)]
+        self._idle: Optional[asyncio.Queue] = None
+        self.connects = 0
+
+    def _open(self, conn: _Connection) -> None:
+        conn.close()
+        cls = smtplib.SMTP_SSL if self.use_ssl else smtplib.SMTP
+        smtp = cls(self.host, self.port, timeout=self.timeout)
+        if self.starttls and not self.use_ssl:
+            smtp.ehlo()
+            if smtp.has_extn("starttls"):
+                smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        conn.smtp = smtp
+        self.connects += 1
+
+    def _send_share(self, conn: _Connection, messages: List[EmailMessage]) -> List[Optional[Tuple[str, str]]]:
+        """Send on one session; per message ``None`` or ("retry"|"failed", error)."""
+        results: List[Optional[Tuple[str, str]]] = []
+        for i, msg in enumerate(messages):
+            for reconnect in (False, True):
+                try:
+                    if conn.smtp is None or reconnect or conn.sent >= self.max_per_connection:
+                        self._open(conn)
+                    conn.smtp.send_message(msg)
+                    conn.sent += 1
+                    results.append(None)
+                    break
+                except smtplib.SMTPRecipientsRefused as exc:
+                    results.append(("failed", str(exc.recipients)))
+                    break
+                except smtplib.SMTPResponseException as exc:
+                    if exc.smtp_code >= 500:
+                        results.append(("failed", f"{exc.smtp_code} {exc.smtp_error!r}"))
+                        break
+                    if reconnect:
+                        results.append(("retry", f"{exc.smtp_code} {exc.smtp_error!r}"))
+                except (smtplib.SMTPException, OSError) as exc:
+                    conn.close()
+                    if reconnect:
+                        # the server is unreachable; leave the rest for the retry pass
+                        results.extend([("retry", repr(exc))] * (len(messages) - i))
+                        return results
+        return results
+
+    async def send(self, messages: List[EmailMessage]) -> List[Optional[Tuple[str, str]]]:
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+            for conn in self._connections:
+                self._idle.put_nowait(conn)
+        shares = min(self.size, len(messages))
+        step = -(-len(messages) // shares) if shares else 0
+
+        async def run(part: List[EmailMessage]):
+            conn = await self._idle.get()
+            try:
+                return await asyncio.to_thread(self._send_share, conn, part)
+            finally:
+                self._idle.put_nowait(conn)
+
+        parts = [messages[i:i + step] for i in range(0, len(messages), step)] if step else []
+        results = await asyncio.gather(*(run(p) for p in parts))
+        return [r for part in results for r in part]
+
+    def close(self) -> None:
+        for conn in self._connections:
+            conn.close()
+        self._idle = None
+
+
+class ConsoleTransport:
+    """EMAIL_BACKEND=console: log who would get what, then mark sent."""
+
+    async def send(self, messages: List[EmailMessage]) -> List[Optional[Tuple[str, str]]]:
+        for msg in messages:
+            logger.info("email to=%s subject=%r", msg['To'], msg['Subject'])
+        return [None] * len(messages)
+
+    def close(self) -> None:
+        pass
+
+
+class DisabledTransport:
+    """No backend configured: every message fails so nothing is silently lost."""
+
+    async def send(self, messages: List[EmailMessage]) -> List[Optional[Tuple[str, str]]]:
+        if messages:
+            logger.warning("dropping %d email(s): no email backend configured (set SMTP_HOST or EMAIL_BACKEND)", len(messages))
+        return [("failed", "no email backend configured")] * len(messages)
+
+    def close(self) -> None:
+        pass
+
+
+def _transport():
+    if EMAIL_BACKEND == "smtp":
+        return SmtpPool()
+    if EMAIL_BACKEND == "console":
+        return ConsoleTransport()
+    if EMAIL_BACKEND != "none":
+        logger.warning("unknown EMAIL_BACKEND %r; emails will not be sent", EMAIL_BACKEND)
+    return DisabledTransport()
+
+
+transport = _transport()
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+async def enqueue(template: str, recipients: Iterable[Tuple[str, dict]], priority: str = "normal") -> int:
+    """Store one outbox row per (address, context) and schedule a flush; never sends inline."""
+    if template not in TEMPLATES:
+        raise ValueError(f"unknown email template {template!r}")
+    now = _now()
+    rows = [{
+        'to_address': address,
+        'template': template,
+        'context': json.dumps(context, separators=(",", ":")),
+        'priority': priority,
+        'status': 'pending',
+        'next_attempt_at': now,
+        'created_at': now,
+    } for address, context in recipients if address]
+    if not rows:
+        return 0
+    count = await prisma.emailoutbox.create_many(data=rows)
+    delivery_queue.submit(priority, flush, priority)
+    return count
+
+
+async def _claim(priority: Optional[str], limit: int) -> List[dict]:
+    claim = uuid.uuid4().hex
+    now = datetime.utcnow()
+    sql = (
+        "UPDATE EmailOutbox SET status = 'sending', claim = ?, next_attempt_at = ? WHERE id IN ("
+        "SELECT id FROM EmailOutbox WHERE status IN ('pending', 'sending') AND next_attempt_at <= ?"
+    )
+    params: list = [claim, (now + timedelta(seconds=EMAIL_LEASE_SECONDS)).isoformat(), now.isoformat()]
+    if priority:
+        sql += " AND priority = ?"
+        params.append(priority)
+    sql += f" ORDER BY {_PRIORITY_ORDER}, id LIMIT ?)"
+    params.append(limit)
+    if not await prisma.execute_raw(sql, *params):
+        return []
+    return await prisma.query_raw(
+        "SELECT id, to_address, template, context, attempts FROM EmailOutbox WHERE claim = ? ORDER BY id", claim
+    )
+
+
+def _retry_at(attempts: int) -> str:
+    delay = min(EMAIL_RETRY_BASE * (2 ** max(attempts - 1, 0)), EMAIL_RETRY_MAX)
+    return (datetime.utcnow() + timedelta(seconds=delay * random.uniform(0.9, 1.1))).isoformat()
+
+
+async def _send_batch(rows: List[dict]) -> None:
+    messages, results = [], {}
+    for row in rows:
+        try:
+            subject, body = render(row["template"], json.loads(row["context"] or "{}"))
+            messages.append((row, build_message(row["to_address"], subject, body)))
+        except Exception as exc:
+            results[row["id"]] = ("failed", f"render: {exc!r}")
+    outcomes = await transport.send([m for _, m in messages]) if messages else []
+    for (row, _), outcome in zip(messages, outcomes):
+        results[row["id"]] = outcome
+
+    now = _now()
+    sent = [row["id"] for row in rows if results.get(row["id"]) is None]
+    if sent:
+        await prisma.execute_raw(
+            "UPDATE EmailOutbox SET status = 'sent', sent_at = ?, claim = NULL, last_error = NULL "
+            f"WHERE id IN ({', '.join('?' for _ in sent)})", now, *sent,
+        )
+    for row in rows:
+        outcome = results.get(row["id"])
+        if outcome is None:
+            continue
+        kind, error = outcome
+        attempts = int(row["attempts"] or 0) + 1
+        if kind == "retry" and attempts < EMAIL_MAX_ATTEMPTS:
+            status, next_at = "pending", _retry_at(attempts)
+            stats["retried"] += 1
+        else:
+            status, next_at = "failed", now
+            stats["failed"] += 1
+        await prisma.execute_raw(
+            "UPDATE EmailOutbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, claim = NULL WHERE id = ?",
+            status, attempts, next_at, error[:500], row["id"],
+        )
+    stats["sent"] += len(sent)
+
+
+async def flush(priority: Optional[str] = None, batch_size: int = EMAIL_BATCH) -> int:
+    """Send due outbox rows (optionally one priority) until none are left; returns rows handled."""
+    handled = 0
+    while True:
+        rows = await _claim(priority, batch_size)
+        if not rows:
+            return handled
+        started = time.perf_counter()
+        await _send_batch(rows)
+        stats["batches"] += 1
+        stats["seconds"] += time.perf_counter() - started
+        handled += len(rows)
+
+
+_worker_task: Optional[asyncio.Task] = None
+
+
+async def _retry_loop() -> None:
+    while True:
+        try:
+            await flush()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass
+        await asyncio.sleep(EMAIL_POLL_INTERVAL)
+
+
+def start_email_worker() -> None:
+    """Pick up retries and rows left from before a restart."""
+    global _worker_task
+    if _worker_task is None:
+        _worker_task = asyncio.create_task(_retry_loop())
+
+
+async def stop_email_worker() -> None:
+    global _worker_task
+    if _worker_task is not None:
+        _worker_task.cancel()
+        try:
+            await _worker_task
+        except asyncio.CancelledError:
+            pass
+        _worker_task = None
+    await asyncio.to_thread(transport.close)
+
+
+async def email_status() -> dict:
+    rows = await prisma.query_raw("SELECT status, COUNT(*) AS n FROM EmailOutbox GROUP BY status")
+    out = {"backend": EMAIL_BACKEND, "outbox": {r["status"]: int(r["n"]) for r in rows}, **stats}
+    out["seconds"] = round(stats["seconds"], 3)
+    out["per_second"] = round(stats["sent"] / stats["seconds"], 1) if stats["seconds"] else None
+    if isinstance(transport, SmtpPool):
+        out["connections_opened"] = transport.connects
+    return out
@@ -0,0 +1,160 @@
+"""Parsing and validation for bulk student imports (CSV or NDJSON)."""
+import csv
+import io
+import json
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+_ALIASES = {"class_name": "class", "student_email": "email"}
+
+
+class StudentRow:
+    __slots__ = ("row", "name", "class_name", "class_id", "roll_no", "email", "parent_email", "parent_id", "status")
+
+    def __init__(self, row: int, data: Dict[str, Any]):
+        self.row = row
+        self.name = _text(data.get("name"))
+        self.class_name = _text(data.get("class"))
+        self.class_id = data.get("class_id")
+        self.roll_no = _text(data.get("roll_no"))
+        self.email = (_text(data.get("email")) or "").lower() or None
+        self.parent_email = (_text(data.get("parent_email")) or "").lower() or None
+        self.parent_id = data.get("parent_id")
+        self.status = (_text(data.get("status")) or "active").lower()
+
+    def as_data(self) -> dict:
+        return {"name": self.name, "class_id": self.class_id, "roll_no": self.roll_no, "email": self.email,
+                "parent_id": self.parent_id, "status": self.status}
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _int_or_none(value: Any) -> Tuple[Optional[int], bool]:
+    """(value, ok) for an optional integer column."""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None, True
+    try:
+        return int(value), True
+    except (TypeError, ValueError):
+        return None, False
+
+
+def rows_from_csv(text: str) -> List[StudentRow]:
+    """Header row naming the columns (``name`` required); blank lines are skipped."""
+    reader = csv.DictReader(io.StringIO(text))
+    header = [(_ALIASES.get(h.strip().lower(), h.strip().lower())) for h in (reader.fieldnames or [])]
+    if "name" not in header:
+        raise ValueError("CSV header must include a name column")
+    reader.fieldnames = header
+    rows: List[StudentRow] = []
+    # row numbers are 1-based data rows, matching the NDJSON form
+    for i, record in enumerate(reader, start=1):
+        if not any((v or "").strip() for v in record.values() if isinstance(v, str)):
+            continue
+        rows.append(StudentRow(i, record))
+    return rows
+
+
+def rows_from_ndjson(text: str) -> List[StudentRow]:
+    """One JSON object per line with the same keys as the CSV columns."""
+    rows: List[StudentRow] = []
+    for i, line in enumerate(text.splitlines(), start=1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError:
+            raise ValueError(f"Line {i} is not valid JSON")
+        if not isinstance(data, dict):
+            raise ValueError(f"Line {i} must be a JSON object")
+        rows.append(StudentRow(i, {_ALIASES.get(k, k): v for k, v in data.items()}))
+    return rows
+
+
+def lookups(rows: Iterable[StudentRow]) -> Dict[str, Set]:
+    """Values to prefetch: class names/ids, parent emails/ids, roll numbers and emails."""
+    out: Dict[str, Set] = {"class_names": set(), "class_ids": set(), "parent_emails": set(), "parent_ids": set(),
+                           "roll_nos": set(), "emails": set()}
+    for r in rows:
+        if r.class_name:
+            out["class_names"].add(r.class_name)
+        class_id, ok = _int_or_none(r.class_id)
+        if ok and class_id is not None:
+            out["class_ids"].add(class_id)
+        if r.parent_email:
+            out["parent_emails"].add(r.parent_email)
+        parent_id, ok = _int_or_none(r.parent_id)
+        if ok and parent_id is not None:
+            out["parent_ids"].add(parent_id)
+        if r.roll_no:
+            out["roll_nos"].add(r.roll_no)
+        if r.email:
+            out["emails"].add(r.email)
+    return out
+
+
+def validate_rows(rows: List[StudentRow], classes_by_name: Dict[str, int], class_ids: Set[int],
+                  parents_by_email: Dict[str, int], parent_ids: Set[int],
+                  taken_roll_nos: Set[str], taken_emails: Set[str]) -> Tuple[List[StudentRow], List[dict]]:
+    """Split rows into valid ones (with ids resolved) and per-row errors, without touching the DB.
+
+    ``taken_*`` are values already in use by existing students; a value
+    repeated within the upload is an error on every row after the first
+    valid row that uses it.
+    """
+    valid: List[StudentRow] = []
+    errors: List[dict] = []
+    first_roll: Dict[str, int] = {}
+    first_email: Dict[str, int] = {}
+    for r in rows:
+        problems = []
+        if not r.name:
+            problems.append("Missing name")
+        class_id, ok = _int_or_none(r.class_id)
+        if not ok:
+            problems.append("class_id must be an integer")
+        elif r.class_name:
+            by_name = classes_by_name.get(r.class_name)
+            if by_name is None:
+                problems.append(f"Unknown class {r.class_name!r}")
+            elif class_id is not None and class_id != by_name:
+                problems.append("class and class_id disagree")
+            class_id = by_name
+        elif class_id is not None and class_id not in class_ids:
+            problems.append(f"Unknown class_id {class_id}")
+        parent_id, ok = _int_or_none(r.parent_id)
+        if not ok:
+            problems.append("parent_id must be an integer")
+        elif r.parent_email:
+            by_email = parents_by_email.get(r.parent_email)
+            if by_email is None:
+                problems.append(f"No parent with email {r.parent_email}")
+            elif parent_id is not None and parent_id != by_email:
+                problems.append("parent_email and parent_id disagree")
+            parent_id = by_email
+        elif parent_id is not None and parent_id not in parent_ids:
+            problems.append(f"Unknown parent_id {parent_id}")
+        if r.email and "@" not in r.email:
+            problems.append("Invalid email")
+        for value, first, taken, label in ((r.roll_no, first_roll, taken_roll_nos, "roll_no"),
+                                           (r.email, first_email, taken_emails, "email")):
+            if not value:
+                continue
+            if value in taken:
+                problems.append(f"{label} {value} already exists")
+            elif value in first:
+                problems.append(f"{label} {value} repeats row {first[value]}")
+        if problems:
+            errors.append({"row": r.row, "name": r.name, "errors": problems})
+            continue
+        if r.roll_no:
+            first_roll[r.roll_no] = r.row
+        if r.email:
+            first_email[r.email] = r.row
+        r.class_id, r.parent_id = class_id, parent_id
+        valid.append(r)
+    return valid, errors
@@ -0,0 +1,102 @@
+"""Parsing and validation for bulk gradebook uploads (student x subject matrices)."""
+import csv
+import io
+from typing import Any, Iterable, List, Optional, Set, Tuple
+
+from app.services.result_stats import grade_for_score
+
+MAX_SCORE = 100
+
+
+class GradebookCell:
+    __slots__ = ("row", "student_id", "subject", "score", "grade", "comments")
+
+    def __init__(self, row: int, student_id: Any, subject: str, score: Any,
+                 grade: Optional[str] = None, comments: Optional[str] = None):
+        self.row = row
+        self.student_id = student_id
+        self.subject = subject
+        self.score = score
+        self.grade = grade
+        self.comments = comments
+
+
+def _error(cell: GradebookCell, detail: str) -> dict:
+    return {"row": cell.row, "student_id": cell.student_id, "subject": cell.subject, "detail": detail}
+
+
+def cells_from_json(rows: Iterable[dict]) -> Tuple[List[GradebookCell], List[dict]]:
+    """``[{"student_id": 1, "scores": {"Maths": 80, "English": {"score": 65, "comments": "..."}}}]``
+
+    Rows whose ``scores`` is not a subject mapping are returned as errors.
+    """
+    cells: List[GradebookCell] = []
+    errors: List[dict] = []
+    for i, row in enumerate(rows, start=1):
+        student_id = row.get("student_id")
+        scores = row.get("scores") or {}
+        if not isinstance(scores, dict):
+            errors.append({"row": i, "student_id": student_id, "subject": None,
+                           "detail": "scores must map subjects to scores"})
+            continue
+        for subject, value in scores.items():
+            if isinstance(value, dict):
+                cells.append(GradebookCell(i, student_id, subject, value.get("score"), value.get("grade"), value.get("comments")))
+            else:
+                cells.append(GradebookCell(i, student_id, subject, value))
+    return cells, errors
+
+
+def cells_from_csv(text: str) -> List[GradebookCell]:
+    """Header ``student_id,<subject>,<subject>,...``; blank cells are skipped."""
+    reader = csv.reader(io.StringIO(text))
+    header = next(reader, None)
+    if not header or header[0].strip().lower() != "student_id":
+        raise ValueError("CSV header must start with student_id followed by subject columns")
+    subjects = [h.strip() for h in header[1:]]
+    cells: List[GradebookCell] = []
+    # row numbers are 1-based data rows, matching the JSON form
+    for i, record in enumerate(reader, start=1):
+        if not record or not any(v.strip() for v in record):
+            continue
+        student_id = record[0].strip()
+        for subject, value in zip(subjects, record[1:]):
+            if value.strip():
+                cells.append(GradebookCell(i, student_id, subject, value.strip()))
+    return cells
+
+
+def validate_cells(cells: List[GradebookCell], roster: Set[int]) -> Tuple[List[GradebookCell], List[dict]]:
+    """Split cells into valid ones and per-cell errors, without touching the DB."""
+    valid: List[GradebookCell] = []
+    errors: List[dict] = []
+    seen: Set[Tuple[int, str]] = set()
+    for cell in cells:
+        try:
+            cell.student_id = int(cell.student_id)
+        except (TypeError, ValueError):
+            errors.append(_error(cell, "Invalid student_id"))
+            continue
+        cell.subject = (cell.subject or "").strip()
+        if not cell.subject:
+            errors.append(_error(cell, "Missing subject"))
+            continue
+        if cell.student_id not in roster:
+            errors.append(_error(cell, "Student is not in this class"))
+            continue
+        try:
+            cell.score = int(cell.score)
+        except (TypeError, ValueError):
+            errors.append(_error(cell, "Score must be an integer"))
+            continue
+        if not 0 <= cell.score <= MAX_SCORE:
+            errors.append(_error(cell, f"Score must be between 0 and {MAX_SCORE}"))
+            continue
+        key = (cell.student_id, cell.subject)
+        if key in seen:
+            errors.append(_error(cell, "Duplicate score for student and subject"))
+            continue
+        seen.add(key)
+        cell.grade = (cell.grade or "").strip() or grade_for_score(cell.score)
+        valid.append(cell)
+    return valid, errors
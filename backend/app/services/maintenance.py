@@ -0,0 +1,39 @@
+"""Scheduled maintenance and the registration of every scheduled job.
+
+Times are local server hours, like DIGEST_HOUR. Archival runs hourly and
+only does work inside its own off-peak window (see message_archive).
+"""
+import os
+import time
+from datetime import datetime
+
+from app.core.scheduler import Scheduler
+from app.db.prisma_client import prisma
+from app.services import digest, message_archive, rankings, reminders
+
+TOKEN_CLEANUP_SECONDS = float(os.getenv("TOKEN_CLEANUP_SECONDS", "3600"))
+RANKINGS_REBUILD_HOUR = int(os.getenv("RANKINGS_REBUILD_HOUR", "2"))
+ARCHIVE_CHECK_SECONDS = float(os.getenv("ARCHIVE_CHECK_SECONDS", "3600"))
+
+
+async def cleanup_expired_tokens() -> dict:
+    """Clear password reset and refresh tokens that can no longer be used."""
+    resets = await prisma.execute_raw(
+        "UPDATE User SET password_reset_token = NULL, password_reset_expires_at = NULL "
+        "WHERE password_reset_expires_at IS NOT NULL AND password_reset_expires_at < ?",
+        datetime.utcnow().isoformat(),
+    )
+    refreshes = await prisma.execute_raw(
+        "UPDATE User SET refresh_token_hash = NULL, refresh_token_expires_at = NULL "
+        "WHERE refresh_token_expires_at IS NOT NULL AND CAST(refresh_token_expires_at AS INTEGER) < ?",
+        int(time.time()),
+    )
+    return {"password_resets": resets, "refresh_tokens": refreshes}
+
+
+def register_jobs(scheduler: Scheduler) -> None:
+    scheduler.add("event_reminders", reminders.send_due_reminders, every=reminders.REMINDER_INTERVAL_SECONDS)
+    scheduler.add("token_cleanup", cleanup_expired_tokens, every=TOKEN_CLEANUP_SECONDS)
+    scheduler.add("rankings_rebuild", rankings.rebuild_all_rankings, daily_at=(RANKINGS_REBUILD_HOUR, 0))
+    scheduler.add("message_archival", message_archive.run_archival, every=ARCHIVE_CHECK_SECONDS)
+    scheduler.add("digest", digest.send_digests, daily_at=(digest.DIGEST_HOUR, 0))
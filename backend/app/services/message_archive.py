@@ -0,0 +1,256 @@
+"""Retention for Message: old rows move to gzip-compressed NDJSON segments.
+
+Messages created more than MESSAGE_RETENTION_TERMS terms ago (a term is
+TERM_LENGTH_DAYS days) are archived oldest-first in batches of
+MESSAGE_ARCHIVE_BATCH. Each batch becomes one segment file plus a
+MessageArchiveSegment row that records its id range and who can see it, so
+readers only open the segments that can contain their messages. Batches only
+run inside the off-peak MESSAGE_ARCHIVE_WINDOW (local hours, "start-end")
+unless forced, and pause between batches to keep the write lock short.
+
+Archived messages are only read when a caller asks for them
+(``include_archived``); the hot table and its indexes stay small.
+"""
+import asyncio
+import gzip
+import html
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional
+
+from app.core.cache import KeyedCache
+from app.db.prisma_client import prisma
+from app.services import conversations, unread
+
+MESSAGE_ARCHIVE_DIR = os.getenv("MESSAGE_ARCHIVE_DIR", "./message_archive")
+MESSAGE_RETENTION_TERMS = int(os.getenv("MESSAGE_RETENTION_TERMS", "3"))
+TERM_LENGTH_DAYS = int(os.getenv("TERM_LENGTH_DAYS", "122"))
+MESSAGE_ARCHIVE_BATCH = int(os.getenv("MESSAGE_ARCHIVE_BATCH", "1000"))
+MESSAGE_ARCHIVE_PAUSE = float(os.getenv("MESSAGE_ARCHIVE_PAUSE", "0.5"))
+MESSAGE_ARCHIVE_WINDOW = os.getenv("MESSAGE_ARCHIVE_WINDOW", "1-5")
+
+_FIELDS = ("id", "subject", "body", "sender_id", "recipient_id", "recipient_role", "created_at", "read_at",
+           "priority", "message_type", "broadcast_id", "reply_to_id", "conversation_key")
+
+# segment path -> records, newest first
+_segment_cache = KeyedCache(maxsize=16)
+_run_lock = asyncio.Lock()
+last_run: dict = {}
+
+
+def retention_cutoff(now: Optional[datetime] = None) -> str:
+    now = now or datetime.utcnow()
+    return (now - timedelta(days=MESSAGE_RETENTION_TERMS * TERM_LENGTH_DAYS)).isoformat()
+
+
+def in_offpeak_window(now: Optional[datetime] = None) -> bool:
+    try:
+        start, end = (int(h) for h in MESSAGE_ARCHIVE_WINDOW.split("-", 1))
+    except ValueError:
+        return True
+    hour = (now or datetime.now()).hour
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+def _segment_path(min_id: int, max_id: int) -> str:
+    return os.path.join(MESSAGE_ARCHIVE_DIR, f"messages-{min_id:012d}-{max_id:012d}.ndjson.gz")
+
+
+def _write_segment(path: str, records: List[dict]) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8", compresslevel=6) as fh:
+        for record in records:
+            fh.write(json.dumps(record, separators=(",", ":")))
+            fh.write("\n")
+    os.replace(tmp, path)
+
+
+def _read_segment(path: str) -> List[dict]:
+    with gzip.open(path, "rt", encoding="utf-8") as fh:
+        records = [json.loads(line) for line in fh if line.strip()]
+    records.reverse()
+    return records
+
+
+def _marks(values: Iterable) -> str:
+    return "," + ",".join(sorted({str(v) for v in values if v is not None})) + ","
+
+
+async def archive_batch(cutoff: str, batch_size: int = MESSAGE_ARCHIVE_BATCH) -> int:
+    """Move up to ``batch_size`` of the oldest messages before ``cutoff``; returns how many moved."""
+    msgs = await prisma.message.find_many(
+        where={'created_at': {'lt': cutoff}},
+        include={'receipts': True},
+        order={'id': 'asc'},
+        take=batch_size,
+    )
+    if not msgs:
+        return 0
+    records = []
+    for m in msgs:
+        record = {f: getattr(m, f, None) for f in _FIELDS}
+        record["receipts"] = [{"user_id": r.user_id, "read_at": r.read_at} for r in (m.receipts or [])]
+        records.append(record)
+    ids = [m.id for m in msgs]
+    path = _segment_path(ids[0], ids[-1])
+    await asyncio.to_thread(_write_segment, path, records)
+
+    created = [r["created_at"] for r in records if r["created_at"]]
+    try:
+        async with prisma.tx() as tx:
+            # the unique path makes a concurrent run of the same batch roll back here
+            await tx.messagearchivesegment.create(data={
+                'path': path,
+                'min_id': ids[0],
+                'max_id': ids[-1],
+                'min_created_at': min(created) if created else None,
+                'max_created_at': max(created) if created else None,
+                'count': len(records),
+                'participants': _marks(x for r in records for x in (r["sender_id"], r["recipient_id"])),
+                'roles': _marks(r["recipient_role"].lower() for r in records if r["recipient_id"] is None and r["recipient_role"]),
+                'created_at': datetime.utcnow().isoformat(),
+            })
+            deleted = await tx.message.delete_many(where={'id': {'in': ids}})
+            if deleted != len(ids):
+                raise RuntimeError("messages changed while archiving")
+    except Exception:
+        if not await prisma.messagearchivesegment.find_unique(where={'path': path}):
+            os.remove(path)
+        raise
+
+    # Archived rows no longer count as unread anywhere
+    deltas: dict = {}
+    recipients = set()
+    for r in records:
+        if r["recipient_id"] is not None:
+            if r["read_at"] is None:
+                deltas[f"user:{r['recipient_id']}"] = deltas.get(f"user:{r['recipient_id']}", 0) - 1
+                recipients.add(r["recipient_id"])
+        elif r["recipient_role"]:
+            key = f"role:{r['recipient_role'].lower()}"
+            deltas[key] = deltas.get(key, 0) - 1
+            for receipt in r["receipts"]:
+                deltas[f"read:{receipt['user_id']}"] = deltas.get(f"read:{receipt['user_id']}", 0) - 1
+    await unread.bump(deltas)
+    if recipients:
+        await conversations.refresh_unread(*recipients)
+    return len(records)
+
+
+async def run_archival(force: bool = False, max_batches: Optional[int] = None) -> dict:
+    """Archive in batches until nothing is past retention, the window closes or ``max_batches`` is hit."""
+    if _run_lock.locked():
+        return {"skipped": "already running"}
+    async with _run_lock:
+        cutoff = retention_cutoff()
+        started = time.perf_counter()
+        moved = batches = 0
+        while max_batches is None or batches < max_batches:
+            if not force and not in_offpeak_window():
+                break
+            n = await archive_batch(cutoff)
+            if not n:
+                break
+            moved += n
+            batches += 1
+            await asyncio.sleep(MESSAGE_ARCHIVE_PAUSE)
+        last_run.clear()
+        last_run.update({"cutoff": cutoff, "archived": moved, "batches": batches,
+                         "seconds": round(time.perf_counter() - started, 3), "finished_at": datetime.utcnow().isoformat()})
+        return dict(last_run)
+
+
+def _visible(record: dict, user) -> bool:
+    role = (getattr(user, 'role', '') or '').lower()
+    if role == 'admin':
+        return True
+    if user.id in (record["sender_id"], record["recipient_id"]):
+        return True
+    return record["recipient_id"] is None and (record["recipient_role"] or '').lower() in (role, 'all')
+
+
+async def _segments_for(user) -> list:
+    role = (getattr(user, 'role', '') or '').lower()
+    where = None
+    if role != 'admin':
+        where = {'OR': [
+            {'participants': {'contains': f",{user.id},"}},
+            {'roles': {'contains': f",{role},"}},
+            {'roles': {'contains': ",all,"}},
+        ]}
+    return await prisma.messagearchivesegment.find_many(where=where, order={'max_id': 'desc'})
+
+
+async def _load(path: str) -> List[dict]:
+    records = _segment_cache.get(path)
+    if records is None:
+        records = await asyncio.to_thread(_read_segment, path)
+        _segment_cache.set(path, records)
+    return records
+
+
+def as_message(record: dict, user_id: Optional[int]) -> dict:
+    out = {f: record.get(f) for f in _FIELDS}
+    out["body"] = out["body"] or ""
+    if record["recipient_id"] is None and record["recipient_role"]:
+        out["read_at"] = next((r["read_at"] for r in record["receipts"] if r["user_id"] == user_id), None)
+    out["archived"] = True
+    return out
+
+
+async def archived_messages(user, offset: int = 0, limit: int = 50, predicate=None) -> List[dict]:
+    """Visible archived messages, newest first, optionally filtered by ``predicate(record)``."""
+    out: List[dict] = []
+    skip = offset
+    for segment in await _segments_for(user):
+        for record in await _load(segment.path):
+            if not _visible(record, user) or (predicate and not predicate(record)):
+                continue
+            if skip:
+                skip -= 1
+                continue
+            out.append(as_message(record, user.id))
+            if len(out) >= limit:
+                return out
+    return out
+
+
+def text_predicate(q: str, prefix: bool = False):
+    """Match every word of ``q`` in subject or body (whole words, or prefixes)."""
+    patterns = []
+    for token in re.findall(r"\w+\*?", q or "", re.UNICODE):
+        tail = r"\w*" if prefix or token.endswith("*") else ""
+        patterns.append(re.compile(r"\b" + re.escape(token.rstrip("*")) + tail + r"\b", re.IGNORECASE | re.UNICODE))
+
+    def predicate(record: dict) -> bool:
+        text = f"{record.get('subject') or ''}\n{record.get('body') or ''}"
+        return bool(patterns) and all(p.search(text) for p in patterns)
+    return predicate
+
+
+def highlight(message: dict, q: str, prefix: bool = False) -> dict:
+    """Search-hit fields for an archived message, marked up like FTS snippets."""
+    alternatives = [re.escape(t.rstrip("*")) + (r"\w*" if prefix or t.endswith("*") else "")
+                    for t in re.findall(r"\w+\*?", q or "", re.UNICODE)]
+    pattern = re.compile(r"\b(?:" + "|".join(alternatives) + r")\b", re.IGNORECASE | re.UNICODE) if alternatives else None
+
+    def mark(text: str) -> str:
+        escaped = html.escape(text or "")
+        return pattern.sub(lambda m: f"<mark>{m.group(0)}</mark>", escaped) if pattern else escaped
+
+    body = message.get("body") or ""
+    return {"subject_highlight": mark(message.get("subject") or ""), "snippet": mark(body[:200]) + ("…" if len(body) > 200 else "")}
+
+
+async def archive_status() -> dict:
+    rows = await prisma.query_raw(
+        "SELECT COUNT(*) AS segments, COALESCE(SUM(count), 0) AS messages, MIN(min_created_at) AS oldest, "
+        "MAX(max_created_at) AS newest FROM MessageArchiveSegment"
+    )
+    status = dict(rows[0]) if rows else {}
+    status.update({"cutoff": retention_cutoff(), "window": MESSAGE_ARCHIVE_WINDOW, "last_run": dict(last_run) or None})
+    return status
@@ -0,0 +1,116 @@
+"""Full-text search over message subjects and bodies (SQLite FTS5).
+
+``message_fts`` is an external-content FTS5 table over Message, so the text
+is not stored twice; triggers keep it in sync on insert, update and delete.
+Prisma does not model virtual tables, so ``ensure_search_index`` creates the
+table and triggers at startup if they are missing (e.g. after ``db push``)
+and rebuilds the index from existing rows when it had to create it.
+"""
+import html
+import re
+from typing import List, Optional
+
+from app.db.prisma_client import prisma
+
+_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5("
+    "subject, body, content='Message', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_ai AFTER INSERT ON Message BEGIN "
+    "INSERT INTO message_fts(rowid, subject, body) VALUES (new.id, new.subject, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS message_fts_ad AFTER DELETE ON Message BEGIN "
+    "INSERT INTO message_fts(message_fts, rowid, subject, body) VALUES ('delete', old.id, old.subject, old.body); END",
+    # only re-index when the searchable text changed, not on read_at updates
+    "CREATE TRIGGER IF NOT EXISTS message_fts_au AFTER UPDATE OF subject, body ON Message BEGIN "
+    "INSERT INTO message_fts(message_fts, rowid, subject, body) VALUES ('delete', old.id, old.subject, old.body); "
+    "INSERT INTO message_fts(rowid, subject, body) VALUES (new.id, new.subject, new.body); END",
+]
+
+# Snippet markers are control characters so message text is escaped before
+# the <mark> tags are added; clients can render the snippet as HTML safely.
+_OPEN, _CLOSE = "\x02", "\x03"
+_TOKEN = re.compile(r"\w+\*?", re.UNICODE)
+SUBJECT_WEIGHT = 4.0
+
+
+async def ensure_search_index() -> None:
+    rows = await prisma.query_raw("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'message_fts'")
+    for statement in _DDL:
+        await prisma.execute_raw(statement)
+    if not rows:
+        await prisma.execute_raw("INSERT INTO message_fts(message_fts) VALUES ('rebuild')")
+
+
+def build_match(q: str, prefix: bool = False) -> Optional[str]:
+    """Turn free text into an FTS5 query: every word must match.
+
+    Words are quoted so user input can never inject FTS syntax; a trailing
+    ``*`` on a word (or ``prefix=True`` for all words) makes it a prefix match.
+    """
+    terms = []
+    for token in _TOKEN.findall(q or ""):
+        word = token.rstrip("*")
+        if not word:
+            continue
+        star = "*" if prefix or token.endswith("*") else ""
+        terms.append(f'"{word}"{star}')
+    return " ".join(terms) or None
+
+
+def _marked(text: Optional[str]) -> str:
+    return html.escape(text or "").replace(_OPEN, "<mark>").replace(_CLOSE, "</mark>")
+
+
+def _visibility(user) -> tuple:
+    role = (getattr(user, 'role', '') or '').lower()
+    if role == 'admin':
+        return "", []
+    # same visibility as list_messages: own, addressed to me, or announced to my role
+    return (" AND (m.sender_id = ? OR m.recipient_id = ? "
+            "OR (m.recipient_id IS NULL AND m.recipient_role IN (?, 'all')))"), [user.id, user.id, role]
+
+
+async def count_matches(user, q: str, prefix: bool = False) -> int:
+    match = build_match(q, prefix)
+    if match is None:
+        return 0
+    clause, params = _visibility(user)
+    rows = await prisma.query_raw(
+        "SELECT COUNT(*) AS n FROM message_fts JOIN Message m ON m.id = message_fts.rowid "
+        "WHERE message_fts MATCH ?" + clause, match, *params,
+    )
+    return int(rows[0]["n"]) if rows else 0
+
+
+async def search_messages(user, q: str, prefix: bool = False, sort: str = "rank", offset: int = 0, limit: int = 20) -> List[dict]:
+    """Visible messages matching ``q``, best match first or (``sort="recent"``) newest first.
+
+    Ranking scores every match, so its cost grows with how common the terms
+    are; newest-first walks the index in rowid order and stops at ``limit``.
+    """
+    match = build_match(q, prefix)
+    if match is None:
+        return []
+    sql = (
+        "SELECT m.id, m.subject, m.body, m.sender_id, m.recipient_id, m.recipient_role, m.created_at, "
+        "m.message_type, CASE WHEN m.recipient_id IS NULL THEN r.read_at ELSE m.read_at END AS read_at, "
+        f"highlight(message_fts, 0, '{_OPEN}', '{_CLOSE}') AS subject_highlight, "
+        f"snippet(message_fts, 1, '{_OPEN}', '{_CLOSE}', '…', 16) AS snippet, "
+        f"bm25(message_fts, {SUBJECT_WEIGHT}, 1.0) AS score "
+        "FROM message_fts JOIN Message m ON m.id = message_fts.rowid "
+        "LEFT JOIN MessageReceipt r ON r.message_id = m.id AND r.user_id = ? "
+        "WHERE message_fts MATCH ?"
+    )
+    clause, visibility_params = _visibility(user)
+    sql += clause
+    params: list = [user.id, match, *visibility_params]
+    sql += " ORDER BY " + ("message_fts.rowid DESC" if sort == "recent" else "score") + " LIMIT ? OFFSET ?"
+    params += [limit, offset]
+    rows = await prisma.query_raw(sql, *params)
+    for row in rows:
+        row["body"] = row.get("body") or ""
+        row["subject_highlight"] = _marked(row["subject_highlight"])
+        row["snippet"] = _marked(row["snippet"])
+        # bm25 is lower-is-better; expose a higher-is-better relevance
+        row["score"] = round(-float(row["score"]), 4)
+    return rows
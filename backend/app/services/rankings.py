@@ -0,0 +1,86 @@
+"""Class positions per term, materialized in the ClassRanking table."""
+import time
+from typing import Dict, Iterable, List, Optional
+
+from app.db.prisma_client import prisma
+
+
+def _now_iso() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def dense_rank(totals: Iterable[dict]) -> List[dict]:
+    """Rank ``{student_id, total, subject_count}`` rows by total, highest first.
+
+    Equal totals share a position and the next distinct total takes the next
+    position (1, 2, 2, 3). Within a tie rows are ordered by student_id so the
+    listing is stable between rebuilds.
+    """
+    ordered = sorted(totals, key=lambda r: (-r["total"], r["student_id"]))
+    out: List[dict] = []
+    position = 0
+    previous = None
+    for row in ordered:
+        if row["total"] != previous:
+            position += 1
+            previous = row["total"]
+        count = row["subject_count"]
+        out.append({
+            "student_id": row["student_id"],
+            "total": row["total"],
+            "subject_count": count,
+            "average": round(row["total"] / count, 2) if count else 0.0,
+            "position": position,
+            "class_size": len(ordered),
+        })
+    return out
+
+
+async def recompute_class_rankings(class_id: int, term: str) -> List[dict]:
+    rows = await prisma.query_raw(
+        "SELECT student_id, SUM(score) AS total, COUNT(*) AS subject_count "
+        "FROM Result WHERE class_id = ? AND term = ? GROUP BY student_id",
+        class_id, term,
+    )
+    ranked = dense_rank({
+        "student_id": int(r["student_id"]),
+        "total": int(r["total"]),
+        "subject_count": int(r["subject_count"]),
+    } for r in rows)
+    computed_at = _now_iso()
+    async with prisma.tx() as tx:
+        await tx.classranking.delete_many(where={'class_id': class_id, 'term': term})
+        if ranked:
+            await tx.classranking.create_many(data=[
+                {**r, 'class_id': class_id, 'term': term, 'computed_at': computed_at} for r in ranked
+            ])
+    return ranked
+
+
+async def get_class_rankings(class_id: int, term: str, student_ids: Optional[List[int]] = None) -> List[dict]:
+    where: Dict = {'class_id': class_id, 'term': term}
+    rows = await prisma.classranking.find_many(where=where, order=[{'position': 'asc'}, {'student_id': 'asc'}])
+    if rows:
+        ranked = [{
+            "student_id": r.student_id,
+            "total": r.total,
+            "subject_count": r.subject_count,
+            "average": r.average,
+            "position": r.position,
+            "class_size": r.class_size,
+        } for r in rows]
+    else:
+        # Not materialized yet (e.g. results entered before rankings existed)
+        ranked = await recompute_class_rankings(class_id, term)
+    if student_ids is not None:
+        allowed = set(student_ids)
+        ranked = [r for r in ranked if r["student_id"] in allowed]
+    return ranked
+
+
+async def rebuild_all_rankings() -> int:
+    """Recompute every materialized (class, term) ranking; returns how many were rebuilt."""
+    pairs = await prisma.query_raw("SELECT DISTINCT class_id, term FROM Result WHERE class_id IS NOT NULL")
+    for row in pairs:
+        await recompute_class_rankings(int(row["class_id"]), row["term"])
+    return len(pairs)
@@ -0,0 +1,265 @@
+"""Recurring events: an RRULE subset, lazy expansion and a per-rule window cache.
+
+Supported rule parts (RFC 5545 names): FREQ=DAILY|WEEKLY|MONTHLY|YEARLY,
+INTERVAL, COUNT, UNTIL, BYDAY (``TU``, ``MO,WE``; ordinals such as ``1TU``
+or ``-1FR`` with MONTHLY) and BYMONTHDAY (MONTHLY). Exception dates remove
+single occurrences by their UTC date; as in RFC 5545, COUNT includes them.
+
+A series is stored as one Event row. Occurrences are generated on demand
+for the window being read and never stored. Expanded occurrence starts are
+cached per series in calendar-month buckets (an LRU of RECURRENCE_CACHE_MONTHS
+buckets per series, RECURRENCE_CACHE_SERIES series), so paging a calendar
+month by month only expands each month once. The cache key includes the
+rule, start and exception dates, so edits never hit stale buckets.
+"""
+import os
+from calendar import monthrange
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from app.core.cache import KeyedCache
+
+RECURRENCE_MAX_COUNT = int(os.getenv("RECURRENCE_MAX_COUNT", "1000"))
+RECURRENCE_CACHE_SERIES = int(os.getenv("RECURRENCE_CACHE_SERIES", "512"))
+RECURRENCE_CACHE_MONTHS = int(os.getenv("RECURRENCE_CACHE_MONTHS", "24"))
+
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+# periods in a row without a candidate before giving up (e.g. BYMONTHDAY=31 every other Feb)
+_MAX_EMPTY_PERIODS = 1000
+
+_series_cache = KeyedCache(maxsize=RECURRENCE_CACHE_SERIES)
+
+
+class Rule:
+    __slots__ = ("freq", "interval", "count", "until", "byday", "bymonthday")
+
+    def __init__(self, freq: str, interval: int = 1, count: Optional[int] = None, until: Optional[datetime] = None,
+                 byday: Tuple[Tuple[int, int], ...] = (), bymonthday: Tuple[int, ...] = ()):
+        self.freq = freq
+        self.interval = interval
+        self.count = count
+        self.until = until
+        self.byday = byday  # (ordinal or 0, weekday 0=Monday)
+        self.bymonthday = bymonthday
+
+    def to_rrule(self) -> str:
+        parts = [f"FREQ={self.freq}"]
+        if self.interval != 1:
+            parts.append(f"INTERVAL={self.interval}")
+        if self.count:
+            parts.append(f"COUNT={self.count}")
+        if self.until:
+            parts.append("UNTIL=" + self.until.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ"))
+        if self.byday:
+            parts.append("BYDAY=" + ",".join(f"{n or ''}{WEEKDAYS[wd]}" for n, wd in self.byday))
+        if self.bymonthday:
+            parts.append("BYMONTHDAY=" + ",".join(str(d) for d in self.bymonthday))
+        return ";".join(parts)
+
+
+def _parse_until(value: str) -> datetime:
+    value = value.strip()
+    for fmt in ("%Y%m%dT%H%M%SZ", "%Y%m%dT%H%M%S", "%Y%m%d"):
+        try:
+            parsed = datetime.strptime(value, fmt)
+            break
+        except ValueError:
+            continue
+    else:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if len(value) == 8:
+        # a date UNTIL includes the whole day
+        parsed = datetime.combine(parsed.date(), time.max)
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed.astimezone(timezone.utc)
+
+
+def parse_rrule(text: str) -> Rule:
+    """Parse the supported RRULE subset; raises ValueError with a readable reason."""
+    text = (text or "").strip()
+    if text.upper().startswith("RRULE:"):
+        text = text[6:]
+    parts = {}
+    for part in filter(None, text.split(";")):
+        key, sep, value = part.partition("=")
+        if not sep:
+            raise ValueError(f"invalid rule part {part!r}")
+        parts[key.strip().upper()] = value.strip().upper()
+    unknown = set(parts) - {"FREQ", "INTERVAL", "COUNT", "UNTIL", "BYDAY", "BYMONTHDAY", "WKST"}
+    if unknown:
+        raise ValueError(f"unsupported rule parts: {', '.join(sorted(unknown))}")
+    freq = parts.get("FREQ")
+    if freq not in FREQUENCIES:
+        raise ValueError(f"FREQ must be one of {', '.join(FREQUENCIES)}")
+    try:
+        interval = int(parts.get("INTERVAL", "1"))
+        count = int(parts["COUNT"]) if "COUNT" in parts else None
+    except ValueError:
+        raise ValueError("INTERVAL and COUNT must be integers")
+    if interval < 1 or (count is not None and not 1 <= count <= RECURRENCE_MAX_COUNT):
+        raise ValueError(f"INTERVAL must be positive and COUNT between 1 and {RECURRENCE_MAX_COUNT}")
+    if count and "UNTIL" in parts:
+        raise ValueError("COUNT and UNTIL cannot both be set")
+    until = _parse_until(parts["UNTIL"]) if "UNTIL" in parts else None
+    byday = []
+    for item in filter(None, parts.get("BYDAY", "").split(",")):
+        day, ordinal = item[-2:], item[:-2]
+        if day not in WEEKDAYS or (ordinal and not ordinal.lstrip("+-").isdigit()):
+            raise ValueError(f"invalid BYDAY value {item!r}")
+        n = int(ordinal) if ordinal else 0
+        if n and freq != "MONTHLY":
+            raise ValueError("BYDAY ordinals are only supported with FREQ=MONTHLY")
+        byday.append((n, WEEKDAYS.index(day)))
+    try:
+        bymonthday = tuple(int(d) for d in filter(None, parts.get("BYMONTHDAY", "").split(",")))
+    except ValueError:
+        raise ValueError("BYMONTHDAY must be a list of integers")
+    if bymonthday and (freq != "MONTHLY" or any(not 1 <= abs(d) <= 31 for d in bymonthday)):
+        raise ValueError("BYMONTHDAY needs FREQ=MONTHLY and days between 1 and 31")
+    if byday and freq == "YEARLY":
+        raise ValueError("BYDAY is not supported with FREQ=YEARLY")
+    return Rule(freq, interval, count, until, tuple(byday), bymonthday)
+
+
+def parse_exdates(values: Optional[Iterable[str]]) -> Tuple[str, ...]:
+    """Normalize exception dates to sorted unique ``YYYY-MM-DD`` strings."""
+    out = set()
+    for value in values or ():
+        value = (value or "").strip()
+        if value:
+            out.add(date.fromisoformat(value[:10]).isoformat())
+    return tuple(sorted(out))
+
+
+def _month_days(rule: Rule, year: int, month: int, default_day: int) -> List[int]:
+    last = monthrange(year, month)[1]
+    if rule.bymonthday:
+        days = {d if d > 0 else last + d + 1 for d in rule.bymonthday}
+    elif rule.byday:
+        days = set()
+        for n, wd in rule.byday:
+            first = (wd - date(year, month, 1).weekday()) % 7 + 1
+            matches = list(range(first, last + 1, 7))
+            if not n:
+                days.update(matches)
+            elif -len(matches) <= (n - 1 if n > 0 else n) < len(matches):
+                days.add(matches[n - 1 if n > 0 else n])
+    else:
+        days = {default_day}
+    return sorted(d for d in days if 1 <= d <= last)
+
+
+def _period(rule: Rule, dtstart: datetime, k: int) -> List[datetime]:
+    """Candidate starts in the k-th period after dtstart's, ascending."""
+    ds = dtstart.date()
+    if rule.freq == "DAILY":
+        day = ds + timedelta(days=k * rule.interval)
+        days = [day] if not rule.byday or day.weekday() in {wd for _, wd in rule.byday} else []
+    elif rule.freq == "WEEKLY":
+        week = ds - timedelta(days=ds.weekday()) + timedelta(weeks=k * rule.interval)
+        weekdays = sorted({wd for _, wd in rule.byday}) or [ds.weekday()]
+        days = [week + timedelta(days=wd) for wd in weekdays]
+    elif rule.freq == "MONTHLY":
+        m = ds.month - 1 + k * rule.interval
+        year, month = ds.year + m // 12, m % 12 + 1
+        days = [date(year, month, d) for d in _month_days(rule, year, month, ds.day)]
+    else:
+        year = ds.year + k * rule.interval
+        days = [date(year, ds.month, ds.day)] if ds.day <= monthrange(year, ds.month)[1] else []
+    at = dtstart.timetz()
+    return [datetime.combine(d, at) for d in days]
+
+
+def _first_period(rule: Rule, dtstart: datetime, not_before: datetime) -> int:
+    ds, nb = dtstart.date(), not_before.date()
+    if rule.freq == "DAILY":
+        k = (nb - ds).days // rule.interval
+    elif rule.freq == "WEEKLY":
+        k = (nb - (ds - timedelta(days=ds.weekday()))).days // 7 // rule.interval
+    elif rule.freq == "MONTHLY":
+        k = ((nb.year - ds.year) * 12 + nb.month - ds.month) // rule.interval
+    else:
+        k = (nb.year - ds.year) // rule.interval
+    return max(0, k - 1)
+
+
+def iter_starts(rule: Rule, dtstart: datetime, not_before: Optional[datetime] = None) -> Iterator[datetime]:
+    """Occurrence starts in order (exception dates not applied).
+
+    Without COUNT the generator jumps straight to the period containing
+    ``not_before``; with COUNT it has to start from the first occurrence.
+    """
+    k = _first_period(rule, dtstart, not_before) if not_before and not rule.count else 0
+    emitted = empty = 0
+    while empty < _MAX_EMPTY_PERIODS:
+        candidates = _period(rule, dtstart, k)
+        empty = 0 if candidates else empty + 1
+        for start in candidates:
+            if start < dtstart:
+                continue
+            if rule.until and start > rule.until:
+                return
+            yield start
+            emitted += 1
+            if rule.count and emitted >= rule.count:
+                return
+        k += 1
+
+
+def series_end(rule: Rule, dtstart: datetime, duration: timedelta) -> Optional[datetime]:
+    """When the last occurrence ends, or None for an endless series."""
+    if rule.until:
+        return rule.until + duration
+    if rule.count:
+        last = dtstart
+        for last in iter_starts(rule, dtstart):
+            pass
+        return last + duration
+    return None
+
+
+def _bucket_bounds(year: int, month: int) -> Tuple[datetime, datetime]:
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+    return start, end
+
+
+def _expand_bucket(rule: Rule, dtstart: datetime, exdates: Tuple[str, ...], year: int, month: int) -> Tuple[datetime, ...]:
+    start, end = _bucket_bounds(year, month)
+    skip = set(exdates)
+    out = []
+    for occurrence in iter_starts(rule, dtstart, not_before=start):
+        if occurrence >= end:
+            break
+        if occurrence >= start and occurrence.astimezone(timezone.utc).date().isoformat() not in skip:
+            out.append(occurrence)
+    return tuple(out)
+
+
+def occurrences(rrule: str, dtstart: datetime, duration: timedelta, window_start: datetime, window_end: datetime,
+                exdates: Tuple[str, ...] = ()) -> List[Tuple[datetime, datetime]]:
+    """(start, end) of every occurrence overlapping [window_start, window_end)."""
+    rule = parse_rrule(rrule)
+    key = (rrule, dtstart, exdates)
+    buckets = _series_cache.get(key)
+    if buckets is None:
+        buckets = KeyedCache(maxsize=RECURRENCE_CACHE_MONTHS)
+        _series_cache.set(key, buckets)
+    # occurrences that started before the window can still overlap it
+    first = max(window_start - duration, dtstart)
+    year, month = first.year, first.month
+    out = []
+    while _bucket_bounds(year, month)[0] < window_end:
+        starts = buckets.get((year, month))
+        if starts is None:
+            starts = _expand_bucket(rule, dtstart, exdates, year, month)
+            buckets.set((year, month), starts)
+        out.extend((s, s + duration) for s in starts if s < window_end and s + duration > window_start)
+        if rule.until and _bucket_bounds(year, month)[1] > rule.until:
+            break
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return out
+
+
+def cache_stats() -> dict:
+    return {"series": len(_series_cache), "hits": _series_cache.hits, "misses": _series_cache.misses}
@@ -0,0 +1,95 @@
+"""Event reminders ("PTA meeting in 1 hour") pushed over the websocket manager.
+
+The scheduler runs ``send_due_reminders`` every REMINDER_INTERVAL_SECONDS.
+Each run reminds about every event occurrence starting within the next
+REMINDER_LEAD_MINUTES that has not been reminded yet, so an event created at
+short notice still gets one. EventReminder records what was sent per
+occurrence, which keeps reruns (a restart, a new leader) from repeating a
+reminder. All-day and cancelled events are skipped.
+
+School-wide events go to every connected user of the event's audience;
+class events go to the class teacher and the parents of its students.
+"""
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Set, Tuple
+
+from app.core import realtime
+from app.db.prisma_client import prisma
+from app.services import calendar
+
+REMINDER_LEAD_MINUTES = int(os.getenv("REMINDER_LEAD_MINUTES", "60"))
+REMINDER_INTERVAL_SECONDS = float(os.getenv("REMINDER_INTERVAL_SECONDS", "60"))
+REMINDER_RETENTION_DAYS = int(os.getenv("REMINDER_RETENTION_DAYS", "7"))
+
+ROLES = ("admin", "teacher", "parent")
+
+
+def reminder_text(title: str, minutes: int) -> str:
+    if minutes < 1:
+        return f"{title} is starting now"
+    if minutes % 60 == 0:
+        hours = minutes // 60
+        return f"{title} in {hours} hour{'s' if hours != 1 else ''}"
+    return f"{title} in {minutes} minute{'s' if minutes != 1 else ''}"
+
+
+async def _class_users(class_id: int, audience: str) -> List[int]:
+    users: Set[int] = set()
+    if audience in ("all", "teacher"):
+        klass = await prisma.classmodel.find_unique(where={'id': class_id}, include={'teacher': True})
+        if klass and klass.teacher:
+            users.add(klass.teacher.user_id)
+    if audience in ("all", "parent"):
+        students = await prisma.student.find_many(where={'class_id': class_id}, include={'parent': True})
+        users.update(s.parent.user_id for s in students if s.parent)
+    return sorted(users)
+
+
+async def _push(event: dict, frame: str) -> None:
+    audience = event.get("audience") or "all"
+    if event.get("class_id") is not None and audience != "admin":
+        await realtime.send_to_users(frame, await _class_users(event["class_id"], audience))
+        return
+    for role in (ROLES if audience == "all" else (audience,)):
+        await realtime.send_to_role(frame, role)
+
+
+async def due_occurrences(now: datetime) -> List[Tuple[dict, datetime]]:
+    """(event, start) for occurrences starting in [now, now + lead), earliest first."""
+    out = []
+    for event in await calendar.events_between(now, now + timedelta(minutes=REMINDER_LEAD_MINUTES)):
+        start, end = calendar.parse_instant(event["starts_at"]), calendar.parse_instant(event["ends_at"])
+        if start < now or (event.get("status") or "").lower() == "cancelled":
+            continue
+        if calendar.is_all_day(start, end, event.get("time")):
+            continue
+        out.append((event, start))
+    return out
+
+
+async def send_due_reminders(now: Optional[datetime] = None) -> dict:
+    now = now or datetime.now(timezone.utc)
+    sent_at = now.replace(tzinfo=None).isoformat()
+    sent = 0
+    for event, start in await due_occurrences(now):
+        claimed = await prisma.execute_raw(
+            "INSERT OR IGNORE INTO EventReminder (event_id, starts_at, sent_at) VALUES (?, ?, ?)",
+            event["id"], calendar.iso(start), sent_at,
+        )
+        if not claimed:
+            continue
+        minutes = int((start - now).total_seconds() // 60)
+        await _push(event, json.dumps({
+            "type": "reminder",
+            "event_id": event["id"],
+            "title": event["title"],
+            "starts_at": calendar.iso(start),
+            "minutes": minutes,
+            "text": reminder_text(event["title"], minutes),
+        }))
+        sent += 1
+    cutoff = (now - timedelta(days=REMINDER_RETENTION_DAYS)).replace(tzinfo=None).isoformat()
+    await prisma.execute_raw("DELETE FROM EventReminder WHERE sent_at < ?", cutoff)
+    return {"sent": sent}
@@ -0,0 +1,56 @@
+"""Pure rendering for report cards.
+
+Kept free of DB/app imports so process-pool workers start cheaply.
+"""
+import hashlib
+import json
+import os
+from html import escape
+from typing import Any, Dict
+
+# Bump when the template changes so every card is re-rendered once
+TEMPLATE_VERSION = "1"
+
+
+def content_digest(card: Dict[str, Any]) -> str:
+    raw = json.dumps(card, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{TEMPLATE_VERSION}:{raw}".encode()).hexdigest()
+
+
+def render_html(card: Dict[str, Any]) -> str:
+    student = card["student"]
+    rows = "".join(
+        f"<tr><td>{escape(r['subject'])}</td><td>{r['score']}</td><td>{escape(r['grade'])}</td>"
+        f"<td>{escape(r.get('comments') or '')}</td></tr>"
+        for r in card["results"]
+    )
+    att = card.get("attendance") or {}
+    rank = card.get("ranking")
+    position = f"{rank['position']} of {rank['class_size']}" if rank else "-"
+    return (
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\">"
+        f"<title>Report card - {escape(student['name'])} - {escape(card['term'])}</title>"
+        "<style>body{font-family:sans-serif;margin:2em}table{border-collapse:collapse;width:100%}"
+        "td,th{border:1px solid #999;padding:4px 8px;text-align:left}</style></head><body>"
+        f"<h1>{escape(card.get('school') or 'PTS Manager')}</h1>"
+        f"<h2>{escape(student['name'])}</h2>"
+        f"<p>Class: {escape(card.get('class_name') or '-')} &middot; Term: {escape(card['term'])}"
+        f" &middot; Roll no: {escape(student.get('roll_no') or '-')}</p>"
+        f"<p>Class teacher: {escape(card.get('teacher_name') or '-')}</p>"
+        "<table><thead><tr><th>Subject</th><th>Score</th><th>Grade</th><th>Comments</th></tr></thead>"
+        f"<tbody>{rows}</tbody></table>"
+        f"<p>Total: {card.get('total', 0)} &middot; Average: {card.get('average', 0)} &middot; Position: {position}</p>"
+        f"<p>Attendance: {att.get('attended', 0)} of {att.get('total', 0)} days"
+        f" ({att.get('percentage', 0)}%)</p>"
+        "</body></html>"
+    )
+
+
+def render_to_file(path: str, card: Dict[str, Any]) -> str:
+    """Render ``card`` to ``path`` atomically; runs inside a pool worker."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render_html(card))
+    os.replace(tmp, path)
+    return path
@@ -0,0 +1,136 @@
+"""Batch report-card generation with a content-addressed output cache.
+
+Everything a class needs is prefetched in a handful of bulk queries, each
+card's input is hashed, and only cards whose digest has no file on disk are
+rendered (in a process pool). ReportCard rows map (student, term) to the
+current digest for downloads.
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from typing import Dict, List, Optional
+
+from app.db.prisma_client import prisma
+from app.services.rankings import get_class_rankings
+from app.services.report_card_render import content_digest, render_to_file
+
+REPORT_CARD_DIR = os.getenv("REPORT_CARD_DIR", "./report_cards")
+REPORT_CARD_WORKERS = int(os.getenv("REPORT_CARD_WORKERS", str(min(4, os.cpu_count() or 1))))
+SCHOOL_NAME = os.getenv("SCHOOL_NAME", "PTS Manager")
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _now_iso() -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn: forking a process that runs an event loop and DB engine is unsafe
+        _pool = ProcessPoolExecutor(max_workers=REPORT_CARD_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def card_path(digest: str) -> str:
+    return os.path.join(REPORT_CARD_DIR, digest[:2], f"{digest}.html")
+
+
+async def prefetch_class(class_id: int, term: str, date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[dict]:
+    """Build the render input for every student in a class with four queries."""
+    cls = await prisma.classmodel.find_unique(
+        where={'id': class_id},
+        include={'students': True, 'teacher': {'include': {'user': True}}},
+    )
+    if not cls:
+        return []
+    results = await prisma.result.find_many(where={'class_id': class_id, 'term': term}, order={'subject': 'asc'})
+    att_sql = "SELECT student_id, status, COUNT(*) AS n FROM Attendance WHERE class_id = ?"
+    att_params: list = [class_id]
+    if date_from:
+        att_sql += " AND date >= ?"
+        att_params.append(date_from)
+    if date_to:
+        att_sql += " AND date <= ?"
+        att_params.append(date_to)
+    attendance_rows = await prisma.query_raw(att_sql + " GROUP BY student_id, status", *att_params)
+    rankings = {r["student_id"]: r for r in await get_class_rankings(class_id, term)}
+
+    by_student: Dict[int, list] = {}
+    for r in results:
+        by_student.setdefault(r.student_id, []).append({
+            "subject": r.subject, "score": r.score, "grade": r.grade, "comments": r.comments,
+        })
+    attendance: Dict[int, Dict[str, int]] = {}
+    for row in attendance_rows:
+        attendance.setdefault(int(row["student_id"]), {})[row["status"]] = int(row["n"])
+
+    teacher_name = cls.teacher.user.name if cls.teacher and cls.teacher.user else None
+    cards = []
+    for st in sorted(cls.students or [], key=lambda s: s.id):
+        subject_rows = by_student.get(st.id, [])
+        counts = attendance.get(st.id, {})
+        total_days = sum(counts.values())
+        attended = counts.get("present", 0) + counts.get("late", 0)
+        total = sum(r["score"] for r in subject_rows)
+        rank = rankings.get(st.id)
+        cards.append({
+            "school": SCHOOL_NAME,
+            "term": term,
+            "class_id": class_id,
+            "class_name": cls.name,
+            "teacher_name": teacher_name,
+            "student": {"id": st.id, "name": st.name, "roll_no": st.roll_no},
+            "results": subject_rows,
+            "total": total,
+            "average": round(total / len(subject_rows), 2) if subject_rows else 0,
+            "ranking": {"position": rank["position"], "class_size": rank["class_size"]} if rank else None,
+            "attendance": {
+                "total": total_days,
+                "attended": attended,
+                "percentage": round(attended / total_days * 100, 2) if total_days else 0,
+            },
+        })
+    return cards
+
+
+async def generate_class_report_cards(class_id: int, term: str, date_from: Optional[str] = None, date_to: Optional[str] = None) -> List[dict]:
+    cards = await prefetch_class(class_id, term, date_from, date_to)
+    if not cards:
+        return []
+    loop = asyncio.get_running_loop()
+    pending = []
+    summary = []
+    for card in cards:
+        digest = content_digest(card)
+        path = card_path(digest)
+        cached = os.path.exists(path)
+        if not cached:
+            pending.append(loop.run_in_executor(_get_pool(), render_to_file, path, card))
+        summary.append({"student_id": card["student"]["id"], "digest": digest, "cached": cached})
+    if pending:
+        await asyncio.gather(*pending)
+
+    generated_at = _now_iso()
+    student_ids = [s["student_id"] for s in summary]
+    async with prisma.tx(timeout=timedelta(seconds=30)) as tx:
+        await tx.reportcard.delete_many(where={'student_id': {'in': student_ids}, 'term': term})
+        await tx.reportcard.create_many(data=[{
+            'student_id': s["student_id"],
+            'class_id': class_id,
+            'term': term,
+            'digest': s["digest"],
+            'generated_at': generated_at,
+        } for s in summary])
+    return summary
@@ -0,0 +1,117 @@
+"""Class/term score statistics computed over compact integer columns."""
+from array import array
+from bisect import bisect_left
+from operator import mul
+from typing import Dict, List, Optional, Tuple
+
+from app.core import realtime
+from app.core.cache import KeyedCache
+from app.db.prisma_client import prisma
+
+# Lower bound (inclusive) of each grade band, highest first
+GRADE_BANDS: List[Tuple[str, int]] = [("A", 70), ("B", 60), ("C", 50), ("D", 45), ("E", 40), ("F", 0)]
+PERCENTILES = (10, 25, 50, 75, 90)
+
+# (class_id, term) -> computed payload; None means "all classes" / "all terms"
+stats_cache = KeyedCache(maxsize=512, ttl=300)
+
+
+def grade_for_score(score: int) -> str:
+    for grade, floor in GRADE_BANDS:
+        if score >= floor:
+            return grade
+    return GRADE_BANDS[-1][0]
+
+
+def _percentile(ordered: array, pct: float) -> float:
+    # Linear interpolation between closest ranks (same as numpy's default)
+    if len(ordered) == 1:
+        return float(ordered[0])
+    pos = (len(ordered) - 1) * pct / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def _histogram(ordered: array) -> Dict[str, int]:
+    # Bands are contiguous ranges over a sorted column, so each count is a bisect
+    out: Dict[str, int] = {}
+    upper = len(ordered)
+    for grade, floor in GRADE_BANDS:
+        lower = bisect_left(ordered, floor) if floor > 0 else 0
+        out[grade] = upper - lower
+        upper = lower
+    return out
+
+
+def summarize(scores: array) -> dict:
+    n = len(scores)
+    if not n:
+        return {"count": 0, "mean": None, "median": None, "stddev": None, "min": None, "max": None,
+                "percentiles": {}, "histogram": {g: 0 for g, _ in GRADE_BANDS}}
+    ordered = array('i', sorted(scores))
+    total = sum(ordered)
+    mean = total / n
+    # population variance via E[x^2] - E[x]^2; map(mul) keeps the pass in C
+    variance = max(sum(map(mul, ordered, ordered)) / n - mean * mean, 0.0)
+    return {
+        "count": n,
+        "mean": round(mean, 2),
+        "median": round(_percentile(ordered, 50), 2),
+        "stddev": round(variance ** 0.5, 2),
+        "min": ordered[0],
+        "max": ordered[-1],
+        "percentiles": {f"p{p}": round(_percentile(ordered, p), 2) for p in PERCENTILES},
+        "histogram": _histogram(ordered),
+    }
+
+
+async def _load_columns(class_id: Optional[int], term: Optional[str]) -> Dict[str, array]:
+    clauses, params = [], []
+    if class_id is not None:
+        clauses.append("class_id = ?")
+        params.append(class_id)
+    if term is not None:
+        clauses.append("term = ?")
+        params.append(term)
+    sql = "SELECT subject, score FROM Result"
+    if clauses:
+        sql += " WHERE " + " AND ".join(clauses)
+    rows = await prisma.query_raw(sql, *params)
+    columns: Dict[str, array] = {}
+    for row in rows:
+        col = columns.get(row["subject"])
+        if col is None:
+            col = columns[row["subject"]] = array('i')
+        col.append(int(row["score"]))
+    return columns
+
+
+async def class_term_stats(class_id: Optional[int], term: Optional[str]) -> dict:
+    key = (class_id, term)
+    cached = stats_cache.get(key)
+    if cached is not None:
+        return cached
+    columns = await _load_columns(class_id, term)
+    overall = array('i')
+    for col in columns.values():
+        overall.extend(col)
+    payload = {
+        "overall": summarize(overall),
+        "subjects": {subject: summarize(col) for subject, col in sorted(columns.items())},
+    }
+    stats_cache.set(key, payload)
+    return payload
+
+
+def invalidate_stats(class_id: Optional[int], term: Optional[str]) -> None:
+    for key in ((class_id, term), (class_id, None), (None, term), (None, None)):
+        stats_cache.pop(key)
+
+
+async def _on_results_changed(data: dict) -> None:
+    invalidate_stats(data.get("class_id"), data.get("term"))
+
+
+# published by the results API after every write, so all workers drop their copies
+realtime.subscribe("results.changed", _on_results_changed)
@@ -0,0 +1,66 @@
+"""Per-student, per-subject score series across terms."""
+from typing import Dict, List, Optional
+
+from app.core import realtime
+from app.core.cache import KeyedCache
+from app.db.prisma_client import prisma
+
+# student_id -> (payload, class_ids the class averages were taken from)
+trends_cache = KeyedCache(maxsize=2048, ttl=600)
+
+
+async def student_trends(student_id: int) -> dict:
+    cached = trends_cache.get(student_id)
+    if cached is not None:
+        return cached[0]
+    rows = await prisma.query_raw(
+        "SELECT r.subject, r.term, r.score, r.class_id, "
+        "(SELECT AVG(c.score) FROM Result c WHERE c.class_id = r.class_id AND c.term = r.term AND c.subject = r.subject) AS class_avg "
+        "FROM Result r WHERE r.student_id = ? ORDER BY r.id",
+        student_id,
+    )
+    terms: List[str] = []
+    term_index: Dict[str, int] = {}
+    points: Dict[str, Dict[int, tuple]] = {}
+    class_ids = set()
+    for row in rows:
+        term = row["term"]
+        if term not in term_index:
+            # terms are ordered by when their first result was recorded
+            term_index[term] = len(terms)
+            terms.append(term)
+        avg = row["class_avg"]
+        # later rows win if a subject was recorded twice in a term
+        points.setdefault(row["subject"], {})[term_index[term]] = (
+            int(row["score"]), round(float(avg), 2) if avg is not None else None,
+        )
+        if row["class_id"] is not None:
+            class_ids.add(int(row["class_id"]))
+    subjects = {}
+    for subject in sorted(points):
+        by_term = points[subject]
+        subjects[subject] = {
+            "score": [by_term[i][0] if i in by_term else None for i in range(len(terms))],
+            "class_avg": [by_term[i][1] if i in by_term else None for i in range(len(terms))],
+        }
+    payload = {"student_id": student_id, "terms": terms, "subjects": subjects}
+    trends_cache.set(student_id, (payload, frozenset(class_ids)))
+    return payload
+
+
+def invalidate_trends(student_id: Optional[int], class_id: Optional[int]) -> None:
+    if student_id is not None:
+        trends_cache.pop(student_id)
+    if class_id is not None:
+        # classmates' series carry this class's averages
+        trends_cache.invalidate_where(lambda _key, value: class_id in value[1])
+
+
+async def _on_results_changed(data: dict) -> None:
+    invalidate_trends(None, data.get("class_id"))
+    for student_id in data.get("student_ids") or ():
+        invalidate_trends(student_id, None)
+
+
+# published by the results API after every write, so all workers drop their copies
+realtime.subscribe("results.changed", _on_results_changed)
@@ -0,0 +1,128 @@
+"""Maintained unread-message counters.
+
+Counters live in UnreadCounter rows keyed by:
+
+- ``user:{id}``  unread direct messages addressed to the user
+- ``role:{role}`` announcements ever sent to a role (``role:all`` for everyone)
+- ``read:{id}``  announcements the user has marked read (MessageReceipt rows)
+
+so a user's unread count is ``user + role:<role> + role:all - read`` and is
+served from a single primary-key lookup.
+"""
+import json
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.core import realtime
+from app.db.prisma_client import prisma
+
+
+def _keys(user_id: int, role: str) -> List[str]:
+    return [f"user:{user_id}", f"role:{role}", "role:all", f"read:{user_id}"]
+
+
+async def bump(deltas: Dict[str, int]) -> None:
+    """Apply counter deltas in one upsert statement."""
+    items = [(k, d) for k, d in deltas.items() if d]
+    if not items:
+        return
+    values = ", ".join("(?, ?)" for _ in items)
+    params = [x for item in items for x in item]
+    await prisma.execute_raw(
+        f"INSERT INTO UnreadCounter (key, count) VALUES {values} "
+        "ON CONFLICT(key) DO UPDATE SET count = count + excluded.count",
+        *params,
+    )
+
+
+async def unread_counts(users: Iterable[Tuple[int, str]]) -> Dict[int, dict]:
+    """``{user_id: {direct, announcements, total}}`` for (user_id, role) pairs."""
+    users = [(uid, (role or '').lower()) for uid, role in users]
+    if not users:
+        return {}
+    keys = sorted({k for uid, role in users for k in _keys(uid, role)})
+    rows = await prisma.query_raw(
+        f"SELECT key, count FROM UnreadCounter WHERE key IN ({', '.join('?' for _ in keys)})", *keys
+    )
+    counts = {r["key"]: int(r["count"]) for r in rows}
+    out = {}
+    for uid, role in users:
+        direct = max(counts.get(f"user:{uid}", 0), 0)
+        sent_to_role = counts.get(f"role:{role}", 0) + (counts.get("role:all", 0) if role != 'all' else 0)
+        announcements = max(sent_to_role - counts.get(f"read:{uid}", 0), 0)
+        out[uid] = {"direct": direct, "announcements": announcements, "total": direct + announcements}
+    return out
+
+
+async def push_unread(users: Iterable[Tuple[int, str]]) -> None:
+    """Send each user's current counts to their websocket(s)."""
+    counts = await unread_counts(users)
+    await realtime.send_frames(
+        (uid, json.dumps({"type": "unread", "count": c["total"], **c})) for uid, c in counts.items()
+    )
+
+
+async def on_direct_messages(recipient_ids: Iterable[int]) -> None:
+    per_user: Dict[str, int] = {}
+    for uid in recipient_ids:
+        if uid is not None:
+            per_user[f"user:{uid}"] = per_user.get(f"user:{uid}", 0) + 1
+    await bump(per_user)
+
+
+async def on_announcement(role: str) -> None:
+    await bump({f"role:{(role or '').lower()}": 1})
+    # per-user totals differ by read state; connected clients just add one
+    await realtime.send_to_role(json.dumps({"type": "unread", "delta": 1, "scope": "announcements"}), role)
+
+
+async def mark_read(user, ids: Optional[List[int]] = None, up_to_id: Optional[int] = None,
+                    conversation_key: Optional[str] = None) -> dict:
+    """Mark direct messages and announcements read by id list, up to an id, or by thread."""
+    role = (getattr(user, 'role', '') or '').lower()
+    if conversation_key:
+        # threads only hold direct messages, so the receipt insert below matches nothing
+        match, match_params = "conversation_key = ?", [conversation_key]
+    elif ids:
+        ids = sorted(set(int(i) for i in ids))
+        match, match_params = f"id IN ({', '.join('?' for _ in ids)})", ids
+    elif up_to_id is not None:
+        match, match_params = "id <= ?", [up_to_id]
+    else:
+        return {"direct": 0, "announcements": 0}
+    now = datetime.utcnow().isoformat()
+    direct = await prisma.execute_raw(
+        f"UPDATE Message SET read_at = ? WHERE recipient_id = ? AND read_at IS NULL AND {match}",
+        now, user.id, *match_params,
+    )
+    announcements = await prisma.execute_raw(
+        "INSERT OR IGNORE INTO MessageReceipt (message_id, user_id, read_at) "
+        f"SELECT id, ?, ? FROM Message WHERE recipient_id IS NULL AND recipient_role IN (?, 'all') AND {match}",
+        user.id, now, role, *match_params,
+    )
+    if direct or announcements:
+        await bump({f"user:{user.id}": -direct, f"read:{user.id}": announcements})
+        await push_unread([(user.id, role)])
+    return {"direct": direct, "announcements": announcements}
+
+
+async def backfill_counters() -> None:
+    """Build counters from existing messages the first time the table is empty."""
+    rows = await prisma.query_raw("SELECT COUNT(*) AS n FROM UnreadCounter")
+    if rows and int(rows[0]["n"]):
+        return
+    await prisma.execute_raw(
+        "INSERT OR IGNORE INTO UnreadCounter (key, count) "
+        "SELECT 'user:' || recipient_id, COUNT(*) FROM Message "
+        "WHERE recipient_id IS NOT NULL AND read_at IS NULL GROUP BY recipient_id"
+    )
+    await prisma.execute_raw(
+        "INSERT OR IGNORE INTO UnreadCounter (key, count) "
+        "SELECT 'role:' || LOWER(recipient_role), COUNT(*) FROM Message "
+        "WHERE recipient_id IS NULL AND recipient_role IS NOT NULL GROUP BY LOWER(recipient_role)"
+    )
+    await prisma.execute_raw(
+        "INSERT OR IGNORE INTO UnreadCounter (key, count) "
+        "SELECT 'read:' || r.user_id, COUNT(*) FROM MessageReceipt r "
+        "JOIN Message m ON m.id = r.message_id WHERE m.recipient_id IS NULL GROUP BY r.user_id"
+    )
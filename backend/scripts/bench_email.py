@@ -0,0 +1,84 @@
+"""Benchmark SMTP throughput of the email pool against a local aiosmtpd server.
+
+Compares one connection per message (how a naive sender works) with the
+pooled, persistent connections used by app/services/email.py. --latency adds
+a delay to every DATA reply to model a remote relay.
+
+    python -m scripts.bench_email --messages 2000 --workers 4
+    python -m scripts.bench_email --messages 1000 --workers 8 --latency 0.005
+"""
+import argparse
+import asyncio
+import os
+import smtplib
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+class _Sink:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.count = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.count += 1
+        return "250 OK"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4, help="pooled SMTP connections")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds the server waits before accepting DATA")
+    parser.add_argument("--skip-baseline", action="store_true")
+    args = parser.parse_args()
+
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        sys.exit("aiosmtpd is required: pip install aiosmtpd")
+    os.environ.setdefault("EMAIL_BACKEND", "console")
+    from app.services import email
+
+    port = _free_port()
+    sink = _Sink(args.latency)
+    controller = Controller(sink, hostname="127.0.0.1", port=port)
+    controller.start()
+    try:
+        messages = [email.build_message(f"parent{i}@bench.local", *email.render("broadcast", {
+            "name": f"Parent {i}", "subject": "Sports day", "body": "Kits by Friday. " * 20, "sender": "Bench",
+        })) for i in range(args.messages)]
+
+        if not args.skip_baseline:
+            started = time.perf_counter()
+            for msg in messages:
+                with smtplib.SMTP("127.0.0.1", port) as smtp:
+                    smtp.send_message(msg)
+            elapsed = time.perf_counter() - started
+            print(f"connection per message: {args.messages} in {elapsed:.2f}s = {args.messages / elapsed:,.0f} msg/s")
+
+        pool = email.SmtpPool(host="127.0.0.1", port=port, starttls=False, size=args.workers)
+        started = time.perf_counter()
+        results = asyncio.run(pool.send(messages))
+        elapsed = time.perf_counter() - started
+        pool.close()
+        failed = sum(1 for r in results if r is not None)
+        print(f"pool of {args.workers}: {args.messages} in {elapsed:.2f}s = {args.messages / elapsed:,.0f} msg/s "
+              f"({pool.connects} connections, {failed} failed)")
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Benchmark offset against cursor pagination on a large SQLite table.
+
+Builds a Student-shaped table with --rows rows in a temporary database and
+times the queries the list endpoints run for a page: ``ORDER BY id DESC
+LIMIT ? OFFSET ?`` (offset mode) against ``WHERE id < ? ORDER BY id DESC
+LIMIT ?`` (cursor mode, see app/core/pagination.py), unfiltered and with
+the class filter a teacher's scope adds.
+
+    python -m scripts.bench_pagination
+    python -m scripts.bench_pagination --rows 200000 --pages 1 100 1000
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+
+def build(path: str, rows: int, classes: int) -> sqlite3.Connection:
+    db = sqlite3.connect(path)
+    db.executescript(
+        "CREATE TABLE Student (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, class_id INTEGER, "
+        "roll_no TEXT, parent_id INTEGER, email TEXT, status TEXT NOT NULL DEFAULT 'active');"
+        "CREATE INDEX Student_class_id_idx ON Student(class_id);"
+    )
+    batch = 50_000
+    for start in range(0, rows, batch):
+        db.executemany(
+            "INSERT INTO Student (name, class_id, roll_no, email) VALUES (?, ?, ?, ?)",
+            ((f"Student {i}", i % classes + 1, f"R{i:07d}", f"s{i}@school.test") for i in range(start, min(rows, start + batch))),
+        )
+    db.commit()
+    db.execute("ANALYZE")
+    return db
+
+
+def _time(db: sqlite3.Connection, sql: str, params: tuple, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        db.execute(sql, params).fetchall()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def boundary(db: sqlite3.Connection, where: str, params: tuple, page: int, limit: int):
+    """Id of the last row before ``page`` (what the previous page's cursor holds)."""
+    if page == 1:
+        return None
+    row = db.execute(f"SELECT id FROM Student {where} ORDER BY id DESC LIMIT 1 OFFSET ?",
+                     params + ((page - 1) * limit - 1,)).fetchone()
+    return row[0] if row else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--classes", type=int, default=40)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 500, 5000])
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        started = time.perf_counter()
+        db = build(os.path.join(tmp, "bench.db"), args.rows, args.classes)
+        print(f"{args.rows} rows built in {time.perf_counter() - started:.1f}s; limit {args.limit}, median of {args.repeat}")
+        print(f"{'filter':<10} {'page':>6} {'offset ms':>10} {'cursor ms':>10}")
+        for label, where, params in (("none", "", ()), ("class_id", "WHERE class_id = ?", (7,))):
+            for page in args.pages:
+                offset_ms = _time(db, f"SELECT * FROM Student {where} ORDER BY id DESC LIMIT ? OFFSET ?",
+                                  params + (args.limit, (page - 1) * args.limit), args.repeat)
+                last_id = boundary(db, where, params, page, args.limit)
+                if last_id is None and page > 1:
+                    print(f"{label:<10} {page:>6} {'(past the end)':>21}")
+                    continue
+                if last_id is None:
+                    sql, cursor_params = f"SELECT * FROM Student {where} ORDER BY id DESC LIMIT ?", params + (args.limit,)
+                else:
+                    keyset = ("AND" if where else "WHERE") + " id < ?"
+                    sql, cursor_params = (f"SELECT * FROM Student {where} {keyset} ORDER BY id DESC LIMIT ?",
+                                          params + (last_id, args.limit))
+                cursor_ms = _time(db, sql, cursor_params, args.repeat)
+                print(f"{label:<10} {page:>6} {offset_ms:>10.3f} {cursor_ms:>10.3f}")
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
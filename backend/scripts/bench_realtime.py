@@ -0,0 +1,108 @@
+"""Benchmark cross-worker delivery on the realtime bus.
+
+Spawns N worker processes that each join the bus, publish their share of
+events and record how long every event from another worker took to arrive.
+Without --rate the run measures throughput (latency then includes queueing);
+with --rate it measures delivery latency under a steady load.
+
+    python -m scripts.bench_realtime --workers 4 --events 5000
+    python -m scripts.bench_realtime --workers 8 --events 4000 --rate 200
+    python -m scripts.bench_realtime --workers 8 --bus redis
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def _worker(index, args, socket_path, barrier, results):
+    os.environ["REALTIME_SOCKET"] = socket_path
+    from app.core import realtime
+
+    async def main():
+        latencies = []
+        expected = args.events // args.workers * (args.workers - 1)
+        done = asyncio.Event()
+
+        async def on_event(data):
+            if data["w"] == index:
+                return
+            # CLOCK_MONOTONIC is system-wide on Linux, so it is comparable across processes
+            latencies.append((time.monotonic_ns() - data["t"]) / 1e6)
+            if len(latencies) >= expected:
+                done.set()
+
+        realtime.subscribe("bench", on_event)
+        bus = await realtime.start_bus(args.bus)
+        await asyncio.get_running_loop().run_in_executor(None, barrier.wait)
+        # let every client finish connecting to the broker
+        await asyncio.sleep(0.2)
+        started = time.perf_counter()
+        payload = "x" * args.size
+        interval = 1.0 / args.rate if args.rate else 0
+        for i in range(args.events // args.workers):
+            await realtime.publish("bench", {"w": index, "t": time.monotonic_ns(), "p": payload})
+            if interval:
+                await asyncio.sleep(interval)
+            elif i % 64 == 0:
+                await asyncio.sleep(0)
+        try:
+            await asyncio.wait_for(done.wait(), args.timeout)
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+        results.put((index, latencies, elapsed, bus.metrics()))
+        await asyncio.sleep(0.5)  # keep the broker up until peers have drained
+        await bus.stop()
+
+    asyncio.run(main())
+
+
+def _pct(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--events", type=int, default=4000, help="total events across all workers")
+    parser.add_argument("--size", type=int, default=256, help="payload bytes per event")
+    parser.add_argument("--rate", type=float, default=0, help="events/s per worker; 0 publishes as fast as possible")
+    parser.add_argument("--bus", default="unix", choices=["unix", "redis"])
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="bench-rt-"), "bus.sock")
+    barrier = ctx.Barrier(args.workers)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(i, args, socket_path, barrier, results)) for i in range(args.workers)]
+    for p in procs:
+        p.start()
+    rows = [results.get(timeout=args.timeout + 30) for _ in procs]
+    for p in procs:
+        p.join()
+
+    all_latencies = [ms for _, lat, _, _ in rows for ms in lat]
+    expected = args.events // args.workers * args.workers * (args.workers - 1)
+    elapsed = max(e for _, _, e, _ in rows)
+    brokers = [i for i, _, _, m in rows if m.get("is_broker")]
+    print(f"bus={args.bus} workers={args.workers} events={args.events} payload={args.size}B rate={args.rate or 'max'} broker=worker{brokers[0] if brokers else '-'}")
+    print(f"delivered {len(all_latencies)}/{expected} remote deliveries in {elapsed:.3f}s "
+          f"({len(all_latencies) / elapsed:,.0f} deliveries/s)")
+    if all_latencies:
+        print(f"latency ms: p50={_pct(all_latencies, 0.5):.3f} p95={_pct(all_latencies, 0.95):.3f} "
+              f"p99={_pct(all_latencies, 0.99):.3f} max={max(all_latencies):.3f} mean={statistics.fmean(all_latencies):.3f}")
+
+
+if __name__ == "__main__":
+    main()
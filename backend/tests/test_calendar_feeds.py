@@ -0,0 +1,102 @@
+import types
+from datetime import datetime, timezone
+import pytest
+from httpx import AsyncClient
+from passlib.context import CryptContext
+from app.main import app
+from app.db.prisma_client import prisma, init_prisma, close_prisma
+from app.services import calendar_feeds
+
+pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+@pytest.fixture(autouse=True)
+async def db():
+    await init_prisma()
+    for model in (prisma.calendarfeedtoken, prisma.event, prisma.student, prisma.classmodel, prisma.parent, prisma.user):
+        await model.delete_many()
+    yield
+    await close_prisma()
+
+def test_ics_rendering_escapes_folds_and_marks_all_day_events():
+    at = datetime(2025, 3, 10, tzinfo=timezone.utc)
+    ev = types.SimpleNamespace(id=7, title='Sports day; bring water, hats', description='x' * 100, type='sports',
+                               status='scheduled', time=None, starts_at=at, ends_at=at.replace(day=11),
+                               updated_at=at, created_at=at, rrule='FREQ=YEARLY', exdates='2026-03-10')
+    body = calendar_feeds.render_ics([ev], 'School events').decode()
+    assert body.startswith('BEGIN:VCALENDAR\r\n') and body.endswith('END:VCALENDAR\r\n')
+    assert 'SUMMARY:Sports day\\; bring water\\, hats' in body
+    assert 'DTSTART;VALUE=DATE:20250310\r\nDTEND;VALUE=DATE:20250311' in body
+    assert 'EXDATE;VALUE=DATE:20260310' in body and 'UID:event-7@ptsmanager' in body
+    assert all(len(line.encode()) <= 75 for line in body.split('\r\n'))
+    assert '\r\n x' in body  # long description folded
+
+@pytest.mark.asyncio
+async def test_parent_feed_is_token_scoped_cached_and_revalidated():
+    user = await prisma.user.create(data={
+        'name': 'P', 'email': 'p@test.local', 'role': 'parent',
+        'password_hash': pwd_ctx.hash('Password1'), 'status': 'active',
+    })
+    parent = await prisma.parent.create(data={'user_id': user.id})
+    mine = await prisma.classmodel.create(data={'name': 'JSS1'})
+    other = await prisma.classmodel.create(data={'name': 'JSS2'})
+    await prisma.student.create(data={'name': 'Ada', 'parent_id': parent.id, 'class_id': mine.id})
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post('/api/auth/login', json={'email': 'p@test.local', 'password': 'Password1'})
+        headers = {'Authorization': f"Bearer {r.json()['access_token']}"}
+        for title, extra in [('PTA', {}), ('Staff meeting', {'audience': 'teacher'}), ('JSS1 trip', {'class_id': mine.id})]:
+            assert (await client.post('/api/events/', json={'title': title, 'date': '2099-03-04', 'time': '18:00', **extra})).status_code == 200
+
+        feed = (await client.post('/api/calendar/feed-token', headers=headers)).json()
+        url = feed['role_feed'].replace('http://test', '')
+        r = await client.get(url)
+        assert r.status_code == 200 and r.headers['content-type'].startswith('text/calendar')
+        assert 'SUMMARY:PTA' in r.text and 'Staff meeting' not in r.text and 'JSS1 trip' not in r.text
+        builds = calendar_feeds.stats['builds']
+        assert (await client.get(url, headers={'If-None-Match': r.headers['etag']})).status_code == 304
+        assert (await client.get(url, headers={'If-Modified-Since': r.headers['last-modified']})).status_code == 304
+        assert calendar_feeds.stats['builds'] == builds
+
+        class_url = feed['class_feed_template'].replace('http://test', '')
+        r = await client.get(class_url.format(class_id=mine.id))
+        assert 'SUMMARY:JSS1 trip' in r.text and 'X-WR-CALNAME:School events: JSS1' in r.text
+        builds = calendar_feeds.stats['builds']
+        assert (await client.get(class_url.format(class_id=mine.id), headers={'If-None-Match': r.headers['etag']})).status_code == 304
+        assert calendar_feeds.stats['builds'] == builds
+        assert (await client.get(class_url.format(class_id=other.id))).status_code == 404
+
+        await client.post('/api/events/', json={'title': 'Open day', 'date': '2099-04-01'})
+        r2 = await client.get(url, headers={'If-None-Match': r.headers['etag']})
+        assert r2.status_code == 200 and 'SUMMARY:Open day' in r2.text
+
+        await client.post('/api/calendar/feed-token', headers=headers)  # rotating revokes the old URLs
+        assert (await client.get(url)).status_code == 404
+
+@pytest.mark.asyncio
+async def test_event_lists_and_notifications_follow_audience_and_class(monkeypatch):
+    from app.api import events_prisma
+    notified = []
+    monkeypatch.setattr(events_prisma.delivery_queue, 'submit', lambda priority, fn, *args: notified.append(args))
+    user = await prisma.user.create(data={
+        'name': 'P', 'email': 'p@test.local', 'role': 'parent',
+        'password_hash': pwd_ctx.hash('Password1'), 'status': 'active',
+    })
+    parent = await prisma.parent.create(data={'user_id': user.id})
+    mine = await prisma.classmodel.create(data={'name': 'JSS1'})
+    other = await prisma.classmodel.create(data={'name': 'JSS2'})
+    await prisma.student.create(data={'name': 'Ada', 'parent_id': parent.id, 'class_id': mine.id})
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        for title, extra in [('PTA', {}), ('Staff meeting', {'audience': 'teacher'}), ('Budget', {'audience': 'admin'}),
+                             ('JSS1 trip', {'class_id': mine.id}), ('JSS2 trip', {'class_id': other.id})]:
+            assert (await client.post('/api/events/', json={'title': title, 'date': '2099-03-04', **extra})).status_code == 200
+        # teacher- and admin-only events notify no parents; class events only that class's parents
+        assert [args[0] for args in notified] == [[None], [mine.id], [other.id]]
+
+        r = await client.post('/api/auth/login', json={'email': 'p@test.local', 'password': 'Password1'})
+        headers = {'Authorization': f"Bearer {r.json()['access_token']}"}
+        listed = (await client.get('/api/events/', headers=headers)).json()
+        assert sorted(e['title'] for e in listed) == ['JSS1 trip', 'PTA']
+        params = {'from': '2099-03-01', 'to': '2099-03-31'}
+        as_parent = await client.get('/api/events/range', params=params, headers=headers)
+        assert sorted(e['title'] for e in as_parent.json()) == ['JSS1 trip', 'PTA']
+        as_admin = await client.get('/api/events/range', params=params)
+        assert len(as_admin.json()) == 5 and as_admin.headers['etag'] != as_parent.headers['etag']
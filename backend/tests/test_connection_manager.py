@@ -0,0 +1,54 @@
+import asyncio
+import pytest
+from app.api.websockets import ConnectionManager
+
+
+class FakeSocket:
+    def __init__(self, stall: bool = False):
+        self.sent = []
+        self.stall = stall
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, frame: str):
+        if self.stall:
+            await asyncio.sleep(3600)
+        self.sent.append(frame)
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+@pytest.mark.asyncio
+async def test_multiple_tabs_and_role_fanout():
+    mgr = ConnectionManager(queue_size=8, send_timeout=0.5)
+    tab1, tab2, teacher = FakeSocket(), FakeSocket(), FakeSocket()
+    await mgr.connect(1, tab1, role="parent")
+    await mgr.connect(1, tab2, role="parent")
+    await mgr.connect(2, teacher, role="teacher")
+    await mgr.send_personal_message("hello", 1)
+    await mgr.broadcast_to_role("notice", "parent")
+    await asyncio.sleep(0.05)
+    assert tab1.sent == tab2.sent == ["hello", "notice"]
+    assert teacher.sent == []
+    assert mgr.metrics()["connections"] == 3
+
+
+@pytest.mark.asyncio
+async def test_stuck_client_is_evicted_without_stalling_others():
+    mgr = ConnectionManager(queue_size=3, send_timeout=0.1)
+    stuck, healthy = FakeSocket(stall=True), FakeSocket()
+    await mgr.connect(1, stuck, role="parent")
+    await mgr.connect(2, healthy, role="parent")
+    for i in range(5):
+        await mgr.broadcast_to_role(f"m{i}", "parent")
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.3)
+    assert healthy.sent == [f"m{i}" for i in range(5)]
+    assert not mgr.is_connected(1)
+    assert stuck.closed_with == 1013
+    metrics = mgr.metrics()
+    assert metrics["evictions"] == 1 and metrics["frames_dropped"] >= 1
+    assert metrics["roles"] == {"parent": 1}
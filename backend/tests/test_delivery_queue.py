@@ -0,0 +1,63 @@
+import asyncio
+import time
+import pytest
+from app.core.delivery import DeliveryQueue
+
+
+async def _bulk_chunk():
+    # serializing and enqueueing a chunk of frames holds the event loop
+    time.sleep(0.002)
+
+
+async def _urgent_during_broadcast(queue: DeliveryQueue, bulk_jobs: int):
+    latencies, bulk_done = [], []
+
+    async def urgent(submitted_at):
+        latencies.append(time.perf_counter() - submitted_at)
+        bulk_done.append(queue.completed["normal"])
+
+    queue.start()
+    for _ in range(bulk_jobs):
+        queue.submit("normal", _bulk_chunk)
+    for _ in range(10):
+        await asyncio.sleep(0.02)
+        queue.submit("urgent", urgent, time.perf_counter())
+    await queue.stop(drain_timeout=10)
+    return latencies, bulk_done
+
+
+@pytest.mark.asyncio
+async def test_urgent_latency_stays_flat_while_broadcast_drains():
+    queue = DeliveryQueue(workers={"urgent": 1, "high": 1, "normal": 4})
+    latencies, bulk_done = await _urgent_during_broadcast(queue, bulk_jobs=300)
+
+    assert len(latencies) == 10
+    # every urgent job ran while the broadcast was still draining
+    assert bulk_done[-1] < 300
+    # each urgent job waits for at most the bulk chunk already running
+    assert max(latencies) < 0.05
+    assert latencies[-1] < 0.05
+    metrics = queue.metrics()
+    assert metrics["normal"]["completed"] == 300
+    assert metrics["urgent"]["completed"] == 10
+    assert metrics["urgent"]["latency_ms"]["p99"] < metrics["normal"]["latency_ms"]["p50"]
+
+
+@pytest.mark.asyncio
+async def test_failed_jobs_are_counted_and_do_not_stop_the_lane():
+    queue = DeliveryQueue(workers={"urgent": 1, "high": 1, "normal": 1})
+    done = []
+
+    async def boom():
+        raise RuntimeError("smtp down")
+
+    async def ok():
+        done.append(1)
+
+    queue.submit("high", boom)
+    queue.submit("high", ok)
+    queue.submit("bogus", ok)
+    await queue.stop()
+    metrics = queue.metrics()
+    assert metrics["high"]["failed"] == 1 and metrics["high"]["completed"] == 1
+    assert metrics["normal"]["completed"] == 1 and done == [1, 1]
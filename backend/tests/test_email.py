@@ -0,0 +1,104 @@
+import asyncio
+import socket
+from datetime import datetime
+import pytest
+from app.db.prisma_client import prisma, init_prisma, close_prisma
+from app.services import email
+
+aiosmtpd = pytest.importorskip("aiosmtpd.controller")
+
+
+class _Inbox:
+    def __init__(self, reject=()):
+        self.messages = []
+        self.sessions = set()
+        self.reject = set(reject)
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.reject:
+            return "550 no such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(id(session))
+        self.messages.append((envelope.rcpt_tos[0], envelope.content.decode()))
+        return "250 OK"
+
+
+@pytest.fixture
+def smtp_server():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    inbox = _Inbox(reject={"gone@test.local"})
+    controller = aiosmtpd.Controller(inbox, hostname="127.0.0.1", port=port)
+    controller.start()
+    yield inbox, port
+    controller.stop()
+
+
+@pytest.fixture
+async def outbox():
+    await init_prisma()
+    await prisma.emailoutbox.delete_many()
+    yield
+    await close_prisma()
+
+
+def test_templates_are_compiled_once():
+    email._compiled.cache_clear()
+    subject, body = email.render("broadcast", {"name": "Ada", "subject": "Trip", "body": "Bring $5", "sender": "Ms. K"})
+    email.render("broadcast", {"name": "Bo", "subject": "Trip", "body": "x", "sender": "Ms. K"})
+    assert subject == "Trip" and "Hello Ada" in body and "Bring $5" in body
+    assert email._compiled.cache_info().hits == 1
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_connections_across_a_batch(smtp_server):
+    inbox, port = smtp_server
+    pool = email.SmtpPool(host="127.0.0.1", port=port, starttls=False, size=3)
+    messages = [email.build_message(f"p{i}@test.local", "Hi", "Body") for i in range(60)]
+    messages.append(email.build_message("gone@test.local", "Hi", "Body"))
+    results = await pool.send(messages)
+    pool.close()
+
+    assert results[:60] == [None] * 60
+    assert results[60][0] == "failed"
+    assert len(inbox.messages) == 60
+    # one session per pooled connection, not per message
+    assert pool.connects == 3 and len(inbox.sessions) == 3
+
+
+@pytest.mark.asyncio
+async def test_outbox_retries_with_backoff_then_sends(outbox, smtp_server, monkeypatch):
+    inbox, port = smtp_server
+    down = email.SmtpPool(host="127.0.0.1", port=1, starttls=False, size=1, timeout=1)
+    monkeypatch.setattr(email, "transport", down)
+    # flush explicitly instead of on the delivery lane
+    monkeypatch.setattr(email.delivery_queue, "submit", lambda *args: None)
+    await email.enqueue("verify_email", [("new@test.local", {"name": "New", "token": "t0k", "link": "http://x/verify"})], priority="high")
+    assert await email.flush() == 1
+
+    row = await prisma.emailoutbox.find_first()
+    assert row.status == "pending" and row.attempts == 1 and row.next_attempt_at > datetime.utcnow().isoformat()
+    assert await email.flush() == 0  # not due yet
+
+    monkeypatch.setattr(email, "transport", email.SmtpPool(host="127.0.0.1", port=port, starttls=False, size=1))
+    await prisma.emailoutbox.update(where={"id": row.id}, data={"next_attempt_at": datetime.utcnow().isoformat()})
+    assert await email.flush() == 1
+    row = await prisma.emailoutbox.find_first()
+    assert row.status == "sent" and row.sent_at
+    assert inbox.messages[0][0] == "new@test.local" and "t0k" in inbox.messages[0][1]
+    await asyncio.to_thread(email.transport.close)
+
+
+@pytest.mark.asyncio
+async def test_console_backend_logs_headers_only_and_unset_backend_fails(caplog):
+    subject, body = email.render("password_reset", {"name": "Ada", "token": "s3cret-token", "link": "x"})
+    msg = email.build_message("ada@test.local", subject, body)
+    with caplog.at_level("INFO", logger=email.__name__):
+        assert await email.ConsoleTransport().send([msg]) == [None]
+        assert await email.DisabledTransport().send([msg]) == [("failed", "no email backend configured")]
+    assert "ada@test.local" in caplog.text and "Reset your PTS Manager password" in caplog.text
+    assert "s3cret-token" not in caplog.text
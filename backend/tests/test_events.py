@@ -0,0 +1,77 @@
+import pytest
+from httpx import AsyncClient
+from app.main import app
+from app.db.prisma_client import prisma, init_prisma, close_prisma
+from app.services.calendar import event_window
+
+@pytest.fixture(autouse=True)
+async def db():
+    await init_prisma()
+    await prisma.event.delete_many()
+    yield
+    await close_prisma()
+
+@pytest.fixture
+async def client():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        yield ac
+
+def test_event_window_from_free_form_fields():
+    start, end = event_window('2025-03-04', '2:30 PM')
+    assert (start.isoformat(), end.isoformat()) == ('2025-03-04T14:30:00+00:00', '2025-03-04T15:30:00+00:00')
+    start, end = event_window('2025-03-04', 'after lunch')
+    assert (end - start).days == 1  # unparsable time means all-day
+    assert event_window(None, '10:00') == (None, None)
+
+@pytest.mark.asyncio
+async def test_range_returns_overlapping_events_and_revalidates_with_etag(client):
+    for title, date, time, kind in [('PTA', '2025-03-04', '18:00', 'meeting'), ('Sports day', '2025-03-10', None, 'sports'),
+                                    ('Exams', '2025-04-01', '09:00', 'exam')]:
+        r = await client.post('/api/events/', json={'title': title, 'date': date, 'time': time, 'type': kind})
+        assert r.status_code == 200, r.text
+    assert r.json()['status'] == 'scheduled' and r.json()['starts_at'] == '2025-04-01T09:00:00Z'
+
+    r = await client.get('/api/events/range', params={'from': '2025-03-01', 'to': '2025-03-31'})
+    assert [e['title'] for e in r.json()] == ['PTA', 'Sports day']
+    etag = r.headers['etag']
+    assert (await client.get('/api/events/range', params={'from': '2025-03-01', 'to': '2025-03-31', 'type': 'sports'})).json()[0]['title'] == 'Sports day'
+
+    r = await client.get('/api/events/range', params={'from': '2025-03-01', 'to': '2025-03-31'}, headers={'If-None-Match': etag})
+    assert r.status_code == 304
+
+    pta = (await prisma.event.find_first(where={'title': 'PTA'})).id
+    await client.patch(f'/api/events/{pta}', json={'date': '2025-05-06'})
+    r = await client.get('/api/events/range', params={'from': '2025-03-01', 'to': '2025-03-31'}, headers={'If-None-Match': etag})
+    assert r.status_code == 200 and [e['title'] for e in r.json()] == ['Sports day']
+
+    assert (await client.get('/api/events/range', params={'from': '2025-03-31', 'to': '2025-03-01'})).status_code == 400
+
+@pytest.mark.asyncio
+async def test_recurring_event_is_one_row_expanded_per_window(client):
+    r = await client.post('/api/events/', json={'title': 'PTA', 'date': '2025-01-07', 'time': '18:00',
+                                                'rrule': 'FREQ=WEEKLY;BYDAY=TU;UNTIL=20250325', 'exdates': ['2025-02-18']})
+    assert r.status_code == 200, r.text
+    assert r.json()['rrule'] == 'FREQ=WEEKLY;UNTIL=20250325T235959Z;BYDAY=TU'
+    assert await prisma.event.count() == 1
+
+    feb = (await client.get('/api/events/range', params={'from': '2025-02-01', 'to': '2025-03-01'})).json()
+    assert [e['starts_at'][:10] for e in feb] == ['2025-02-04', '2025-02-11', '2025-02-25']
+    assert all(e['occurrence'] and e['id'] == r.json()['id'] for e in feb)
+    assert (await client.get('/api/events/range', params={'from': '2025-04-01', 'to': '2025-05-01'})).json() == []
+
+    bad = await client.post('/api/events/', json={'title': 'X', 'date': '2025-01-07', 'rrule': 'FREQ=HOURLY'})
+    assert bad.status_code == 400
+
+@pytest.mark.asyncio
+async def test_version_comes_from_the_data_and_sees_outside_edits(client, monkeypatch):
+    from app.services import calendar
+    await client.post('/api/events/', json={'title': 'PTA', 'date': '2025-03-04'})
+    version = await calendar.collection_version()
+    # a fresh worker (or a restart) derives the same version, so ETags survive
+    monkeypatch.setitem(calendar._version, 'value', '')
+    assert await calendar.collection_version() == version
+
+    await prisma.event.create(data={'title': 'Imported', 'date': '2025-03-05', 'status': 'scheduled'})
+    assert await calendar.collection_version() == version
+    monkeypatch.setattr(calendar, 'CALENDAR_VERSION_TTL', 0)
+    assert await calendar.collection_version() != version
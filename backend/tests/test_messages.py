@@ -0,0 +1,220 @@
+import pytest
+from httpx import AsyncClient
+from passlib.context import CryptContext
+from app.main import app
+from app.db.prisma_client import prisma, init_prisma, close_prisma
+
+pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+@pytest.fixture(scope="session")
+def event_loop():
+    import asyncio
+    loop = asyncio.get_event_loop()
+    yield loop
+
+@pytest.fixture(scope="session", autouse=True)
+async def prisma_session():
+    await init_prisma()
+    yield
+    await close_prisma()
+
+@pytest.fixture(autouse=True)
+async def clean_db():
+    await prisma.unreadcounter.delete_many()
+    await prisma.conversation.delete_many()
+    await prisma.messagearchivesegment.delete_many()
+    await prisma.messagereceipt.delete_many()
+    await prisma.message.delete_many()
+    await prisma.student.delete_many()
+    await prisma.classmodel.delete_many()
+    await prisma.parent.delete_many()
+    await prisma.user.delete_many()
+    yield
+
+@pytest.fixture
+async def client():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        yield ac
+
+async def _login(client, name, email, role):
+    await prisma.user.create(data={
+        'name': name, 'email': email, 'role': role,
+        'password_hash': pwd_ctx.hash('Password1'), 'status': 'active',
+    })
+    r = await client.post('/api/auth/login', json={'email': email, 'password': 'Password1'})
+    assert r.status_code == 200, r.text
+    return {'Authorization': f"Bearer {r.json()['access_token']}"}
+
+@pytest.mark.asyncio
+async def test_role_announcement_is_stored_once_and_visible_by_role(client):
+    admin = await _login(client, 'Admin', 'admin@test.local', 'admin')
+    parent = await _login(client, 'Parent', 'parent@test.local', 'parent')
+    teacher = await _login(client, 'Teacher', 'teacher@test.local', 'teacher')
+    r = await client.post('/api/messages/broadcast', json={'subject': 'Closed Friday', 'body': 'Holiday', 'audience': 'all_parents'}, headers=admin)
+    assert r.status_code == 200, r.text
+    assert r.json()['sent'] == 1
+    assert await prisma.message.count() == 1
+
+    inbox = (await client.get('/api/messages/', headers=parent)).json()
+    assert [m['subject'] for m in inbox] == ['Closed Friday']
+    assert inbox[0]['read_at'] is None
+    assert (await client.get('/api/messages/', headers=teacher)).json() == []
+
+@pytest.mark.asyncio
+async def test_role_messages_store_a_canonical_role(client):
+    admin = await _login(client, 'Admin', 'admin@test.local', 'admin')
+    parent = await _login(client, 'Parent', 'parent@test.local', 'parent')
+    r = await client.post('/api/messages/', json={'subject': 'Hi', 'body': 'x', 'recipient_role': ' Parent '}, headers=admin)
+    assert r.status_code == 200 and r.json()['recipient_role'] == 'parent'
+    assert [m['subject'] for m in (await client.get('/api/messages/', headers=parent)).json()] == ['Hi']
+    r = await client.post('/api/messages/', json={'subject': 'Hi', 'body': 'x', 'recipient_role': 'staff'}, headers=admin)
+    assert r.status_code == 422
+    assert await prisma.message.count() == 1
+
+@pytest.mark.asyncio
+async def test_only_admin_can_message_a_role(client):
+    parent = await _login(client, 'Parent', 'parent@test.local', 'parent')
+    r = await client.post('/api/messages/', json={'subject': 'Hi all', 'body': 'x', 'recipient_role': 'parent'}, headers=parent)
+    assert r.status_code == 403
+
+@pytest.mark.asyncio
+async def test_websocket_replay_returns_only_newer_visible_messages(client):
+    from app.api.websockets import replay_frames
+    import json
+    admin = await _login(client, 'Admin', 'admin@test.local', 'admin')
+    await _login(client, 'Parent', 'parent@test.local', 'parent')
+    await _login(client, 'Other', 'other@test.local', 'parent')
+    parent = await prisma.user.find_unique(where={'email': 'parent@test.local'})
+    other = await prisma.user.find_unique(where={'email': 'other@test.local'})
+    seen = (await client.post('/api/messages/', json={'subject': 'old', 'body': 'x', 'recipient_id': parent.id}, headers=admin)).json()
+    await client.post('/api/messages/', json={'subject': 'new', 'body': 'x', 'recipient_id': parent.id}, headers=admin)
+    await client.post('/api/messages/', json={'subject': 'not yours', 'body': 'x', 'recipient_id': other.id}, headers=admin)
+    await client.post('/api/messages/broadcast', json={'subject': 'all parents', 'audience': 'all_parents'}, headers=admin)
+
+    frames = [json.loads(f) for f in await replay_frames(parent, seen['id'])]
+    assert [f['subject'] for f in frames] == ['new', 'all parents']
+    # replayed frames carry the same delivery fields as live ones
+    assert frames[0]['priority'] == 'normal' and frames[0]['conversation_key']
+
+    frames = [json.loads(f) for f in await replay_frames(parent, 0, limit=1)]
+    assert frames[0]['subject'] == 'old'
+    assert frames[-1] == {'type': 'replay_truncated', 'last_id': seen['id']}
+
+@pytest.mark.asyncio
+async def test_unread_counters_follow_create_and_batch_read(client):
+    admin = await _login(client, 'Admin', 'admin@test.local', 'admin')
+    parent = await _login(client, 'Parent', 'parent@test.local', 'parent')
+    parent_id = (await client.get('/api/users/me', headers=parent)).json()['id']
+    for subject in ('one', 'two'):
+        await client.post('/api/messages/', json={'subject': subject, 'body': 'x', 'recipient_id': parent_id}, headers=admin)
+    await client.post('/api/messages/broadcast', json={'subject': 'all parents', 'audience': 'all_parents'}, headers=admin)
+
+    counts = (await client.get('/api/messages/unread-count', headers=parent)).json()
+    assert counts == {'direct': 2, 'announcements': 1, 'total': 3}
+
+    latest = (await client.get('/api/messages/', headers=parent)).json()[0]['id']
+    r = await client.post('/api/messages/read', json={'up_to_id': latest}, headers=parent)
+    assert r.status_code == 200, r.text
+    assert r.json()['marked'] == {'direct': 2, 'announcements': 1}
+    assert r.json()['unread']['total'] == 0
+    assert all(m['read_at'] for m in (await client.get('/api/messages/', headers=parent)).json())
+
+@pytest.mark.asyncio
+async def test_search_respects_visibility_and_highlights(client):
+    from app.services.message_search import ensure_search_index
+    await ensure_search_index()
+    admin = await _login(client, 'Admin', 'admin@test.local', 'admin')
+    parent = await _login(client, 'Parent', 'parent@test.local', 'parent')
+    await _login(client, 'Other', 'other@test.local', 'parent')
+    parent_id = (await client.get('/api/users/me', headers=parent)).json()['id']
+    other = await prisma.user.find_unique(where={'email': 'other@test.local'})
+    await client.post('/api/messages/', json={'subject': 'Zoo trip', 'body': 'Bring <b>lunch</b> for the zoo', 'recipient_id': parent_id}, headers=admin)
+    await client.post('/api/messages/', json={'subject': 'Zoo trip', 'body': 'Private note', 'recipient_id': other.id}, headers=admin)
+
+    hits = (await client.get('/api/messages/search', params={'q': 'zoo'}, headers=parent)).json()
+    assert len(hits) == 1
+    assert hits[0]['subject_highlight'] == '<mark>Zoo</mark> trip'
+    assert '&lt;b&gt;lunch&lt;/b&gt;' in hits[0]['snippet']
+
+    assert len((await client.get('/api/messages/search', params={'q': 'lun', 'prefix': 'true'}, headers=parent)).json()) == 1
+    assert len((await client.get('/api/messages/search', params={'q': 'zoo'}, headers=admin)).json()) == 2
+
+@pytest.mark.asyncio
+async def test_inbox_threads_replies_and_pages_by_activity(client):
+    teacher = await _login(client, 'Teacher', 'teacher@test.local', 'teacher')
+    parent = await _login(client, 'Parent', 'parent@test.local', 'parent')
+    await _login(client, 'Other', 'other@test.local', 'parent')
+    parent_id = (await client.get('/api/users/me', headers=parent)).json()['id']
+    other = await prisma.user.find_unique(where={'email': 'other@test.local'})
+    first = (await client.post('/api/messages/', json={'subject': 'Homework', 'body': 'Late again', 'recipient_id': parent_id}, headers=teacher)).json()
+    await client.post('/api/messages/', json={'subject': 'Trip', 'body': 'Signed?', 'recipient_id': other.id}, headers=teacher)
+    reply = (await client.post('/api/messages/', json={'subject': 'Re: Homework', 'body': 'Sorry', 'reply_to_id': first['id']}, headers=parent)).json()
+    assert reply['conversation_key'] == first['conversation_key']
+
+    r = await client.get('/api/messages/inbox', params={'limit': 1}, headers=teacher)
+    page = r.json()
+    assert [c['subject'] for c in page] == ['Re: Homework']
+    assert page[0]['unread_count'] == 1
+    r = await client.get('/api/messages/inbox', params={'limit': 1, 'cursor': r.headers['X-Next-Cursor']}, headers=teacher)
+    assert [c['subject'] for c in r.json()] == ['Trip']
+
+    thread = (await client.get(f"/api/messages/conversations/{first['conversation_key']}", headers=teacher)).json()
+    assert [m['subject'] for m in thread] == ['Re: Homework', 'Homework']
+    await client.post('/api/messages/read', json={'conversation_key': first['conversation_key']}, headers=teacher)
+    assert (await client.get('/api/messages/inbox', headers=teacher)).json()[0]['unread_count'] == 0
+
+@pytest.mark.asyncio
+async def test_old_messages_move_to_archive_and_are_listed_only_on_request(client, tmp_path, monkeypatch):
+    from app.services import message_archive
+    from app.services.message_search import ensure_search_index
+    await ensure_search_index()
+    monkeypatch.setattr(message_archive, 'MESSAGE_ARCHIVE_DIR', str(tmp_path))
+    admin = await _login(client, 'Admin', 'admin@test.local', 'admin')
+    parent = await _login(client, 'Parent', 'parent@test.local', 'parent')
+    parent_id = (await client.get('/api/users/me', headers=parent)).json()['id']
+    old = (await client.post('/api/messages/', json={'subject': 'Old term', 'body': 'archive me', 'recipient_id': parent_id}, headers=admin)).json()
+    await prisma.message.update(where={'id': old['id']}, data={'created_at': '2001-01-01T00:00:00'})
+    await client.post('/api/messages/', json={'subject': 'This term', 'body': 'keep me', 'recipient_id': parent_id}, headers=admin)
+
+    assert await message_archive.archive_batch(message_archive.retention_cutoff()) == 1
+    assert await prisma.message.count() == 1
+    assert (await client.get('/api/messages/unread-count', headers=parent)).json()['direct'] == 1
+
+    hot = (await client.get('/api/messages/', headers=parent)).json()
+    assert [m['subject'] for m in hot] == ['This term']
+    both = (await client.get('/api/messages/', params={'include_archived': 'true'}, headers=parent)).json()
+    assert [(m['subject'], m['archived']) for m in both] == [('This term', False), ('Old term', True)]
+    hits = (await client.get('/api/messages/search', params={'q': 'archive', 'include_archived': 'true'}, headers=parent)).json()
+    assert [h['subject'] for h in hits] == ['Old term']
+
+@pytest.mark.asyncio
+async def test_class_broadcast_inserts_one_row_per_parent_and_queues_delivery(client, monkeypatch):
+    from app.api import messages_prisma
+    from app.core.delivery import delivery_queue
+    jobs = []
+    monkeypatch.setattr(delivery_queue, 'submit', lambda priority, fn, *args: jobs.append((priority, fn, args)))
+    admin = await _login(client, 'Admin', 'admin@test.local', 'admin')
+    cls = await prisma.classmodel.create(data={'name': 'JSS1'})
+    parent_ids = []
+    for i in range(3):
+        await _login(client, f'P{i}', f'p{i}@test.local', 'parent')
+        user = await prisma.user.find_unique(where={'email': f'p{i}@test.local'})
+        parent = await prisma.parent.create(data={'user_id': user.id})
+        parent_ids.append(user.id)
+        # the first parent has two children in the class but gets one message
+        for _ in range(2 if i == 0 else 1):
+            await prisma.student.create(data={'name': f'Kid of P{i}', 'class_id': cls.id, 'parent_id': parent.id})
+
+    r = await client.post('/api/messages/broadcast', json={'subject': 'Trip', 'body': 'Monday', 'audience': 'class',
+                                                           'class_id': cls.id, 'priority': 'high'}, headers=admin)
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body['sent'] == body['recipient_count'] == 3
+    rows = await prisma.message.find_many(order={'id': 'asc'})
+    assert sorted(m.recipient_id for m in rows) == sorted(parent_ids)
+    assert {m.broadcast_id for m in rows} == {body['broadcast_id']}
+
+    assert [(p, fn) for p, fn, _ in jobs] == [('high', messages_prisma._deliver_broadcast)]
+    await jobs[0][1](*jobs[0][2])
+    pushes = [args for _, fn, args in jobs if fn is messages_prisma._push_frames]
+    assert sorted(uid for frames, _ in pushes for uid, _ in frames) == sorted(parent_ids)
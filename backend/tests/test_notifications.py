@@ -0,0 +1,61 @@
+import pytest
+from httpx import AsyncClient
+from passlib.context import CryptContext
+from app.main import app
+from app.db.prisma_client import prisma, init_prisma, close_prisma
+from app.services import digest
+
+pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+@pytest.fixture(autouse=True)
+async def db():
+    await init_prisma()
+    for model in (prisma.digestitem, prisma.notificationpreference, prisma.emailoutbox, prisma.student, prisma.parent, prisma.user):
+        await model.delete_many()
+    yield
+    await close_prisma()
+
+async def _parent_with_children(email, *names):
+    user = await prisma.user.create(data={'name': email.split('@')[0], 'email': email, 'role': 'parent', 'password_hash': 'x'})
+    parent = await prisma.parent.create(data={'user_id': user.id})
+    kids = [await prisma.student.create(data={'name': n, 'parent_id': parent.id}) for n in names]
+    return user, kids
+
+@pytest.mark.asyncio
+async def test_digest_coalesces_per_user_and_reports_reduction():
+    busy, (ada, bo) = await _parent_with_children('busy@test.local', 'Ada', 'Bo')
+    eager, (cy,) = await _parent_with_children('eager@test.local', 'Cy')
+    quiet, (di,) = await _parent_with_children('quiet@test.local', 'Di')
+    await digest.set_preference(busy.id, 'digest')
+    await digest.set_preference(eager.id, 'realtime')
+    # quiet never chose a mode and gets the default, which is off
+
+    items = []
+    for kid in (ada, bo, cy, di):
+        items += [(kid.id, 'attendance', '{student} was marked present'), (kid.id, 'result', '{student} has a new Maths result')]
+    result = await digest.notify_parents(items)
+    assert result == {'realtime': 2, 'buffered': 4}
+
+    run = await digest.send_digests()
+    assert run['items'] == 4 and run['digests'] == 1
+    mail = await prisma.emailoutbox.find_many(where={'template': 'digest'})
+    assert [m.to_address for m in mail] == ['busy@test.local']
+    assert 'Ada was marked present' in mail[0].context and 'Bo has a new Maths result' in mail[0].context
+
+    metrics = await digest.digest_metrics()
+    assert metrics['notifications_digested'] == 4 and metrics['digests_sent'] == 1
+    assert metrics['reduction'] == 0.75
+    assert (await digest.send_digests())['items'] == 0
+
+@pytest.mark.asyncio
+async def test_preference_endpoint_validates_mode():
+    await prisma.user.create(data={
+        'name': 'P', 'email': 'p@test.local', 'role': 'parent',
+        'password_hash': pwd_ctx.hash('Password1'), 'status': 'active',
+    })
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post('/api/auth/login', json={'email': 'p@test.local', 'password': 'Password1'})
+        headers = {'Authorization': f"Bearer {r.json()['access_token']}"}
+        assert (await client.get('/api/notifications/preferences', headers=headers)).json() == {'mode': digest.NOTIFY_DEFAULT_MODE}
+        assert (await client.put('/api/notifications/preferences', json={'mode': 'Digest'}, headers=headers)).json() == {'mode': 'digest'}
+        assert (await client.put('/api/notifications/preferences', json={'mode': 'hourly'}, headers=headers)).status_code == 400
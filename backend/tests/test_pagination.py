@@ -0,0 +1,46 @@
+from datetime import datetime, timezone
+import pytest
+from fastapi import HTTPException
+from httpx import AsyncClient
+from app.main import app
+from app.core import pagination
+from app.db.prisma_client import prisma, init_prisma, close_prisma
+
+@pytest.fixture
+async def db():
+    await init_prisma()
+    await prisma.student.delete_many()
+    yield
+    await close_prisma()
+
+def test_cursor_round_trips_sort_key_and_id():
+    at = datetime(2025, 3, 4, 9, 30, tzinfo=timezone.utc)
+    cursor = pagination.cursor_for({'id': 42, 'created_at': at}, sort='created_at')
+    assert pagination.parse_cursor(cursor, sort='created_at') == [at, 42]
+    assert pagination.after_where([at, 42], sort='created_at') == {
+        'OR': [{'created_at': {'lt': at}}, {'created_at': at, 'id': {'lt': 42}}]}
+    assert pagination.after_where(pagination.parse_cursor(pagination.cursor_for({'id': 7}))) == {'id': {'lt': 7}}
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", pagination.encode_cursor(["name", "x", 1]), pagination.encode_cursor(["id"])])
+def test_foreign_or_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(HTTPException) as e:
+        pagination.parse_cursor(cursor)
+    assert e.value.status_code == 400
+
+@pytest.mark.asyncio
+async def test_walking_students_by_cursor_matches_offset_pages(db):
+    await prisma.student.create_many(data=[{'name': f'S{i}'} for i in range(23)])
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        by_offset = []
+        for offset in range(0, 23, 10):
+            by_offset += [s['id'] for s in (await client.get('/api/students/', params={'offset': offset, 'limit': 10})).json()]
+        by_cursor, params = [], {'limit': 10}
+        while True:
+            r = await client.get('/api/students/', params=params)
+            by_cursor += [s['id'] for s in r.json()]
+            if 'x-next-cursor' not in r.headers:
+                break
+            params = {'limit': 10, 'cursor': r.headers['x-next-cursor']}
+        assert by_cursor == by_offset == sorted(by_offset, reverse=True) and len(by_cursor) == 23
+        bad = await client.get('/api/students/', params={'offset': 10, 'cursor': params['cursor']})
+        assert bad.status_code == 400
@@ -0,0 +1,38 @@
+import asyncio
+import pytest
+from app.core import realtime
+
+
+@pytest.mark.asyncio
+async def test_unix_bus_relays_between_workers_and_fails_over(tmp_path):
+    received = []
+
+    async def on_event(data):
+        received.append(data["n"])
+
+    realtime.subscribe("test.ping", on_event)
+    path = str(tmp_path / "bus.sock")
+    first, second = realtime.UnixSocketBus(path), realtime.UnixSocketBus(path)
+    await first.start()
+    await second.start()
+    assert first.is_broker and not second.is_broker
+
+    # handled locally by the publisher and once by the other worker
+    await second.publish("test.ping", {"n": 1})
+    await asyncio.sleep(0.05)
+    assert received == [1, 1]
+
+    # the surviving worker takes over as broker and new workers join it
+    await first.stop()
+    await asyncio.sleep(0.3)
+    third = realtime.UnixSocketBus(path)
+    await third.start()
+    await asyncio.sleep(0.1)
+    assert second.is_broker and not third.is_broker
+
+    received.clear()
+    await third.publish("test.ping", {"n": 2})
+    await asyncio.sleep(0.05)
+    assert received == [2, 2]
+    await third.stop()
+    await second.stop()
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from app.services import recurrence
+
+UTC = timezone.utc
+HOUR = timedelta(hours=1)
+
+
+def _starts(rrule, dtstart, window_start, window_end, exdates=()):
+    return [s.strftime("%Y-%m-%d %H:%M") for s, _ in
+            recurrence.occurrences(rrule, dtstart, HOUR, window_start, window_end, tuple(exdates))]
+
+
+def test_weekly_pta_meeting_until_end_of_term_with_a_skipped_week():
+    dtstart = datetime(2025, 1, 7, 18, 0, tzinfo=UTC)  # a Tuesday
+    starts = _starts("FREQ=WEEKLY;BYDAY=TU;UNTIL=20250325", dtstart,
+                     datetime(2025, 1, 1, tzinfo=UTC), datetime(2025, 7, 1, tzinfo=UTC), ["2025-02-18"])
+    assert len(starts) == 11
+    assert starts[0] == "2025-01-07 18:00" and starts[-1] == "2025-03-25 18:00"
+    assert "2025-02-18 18:00" not in starts
+
+
+def test_monthly_ordinal_weekdays_and_month_days():
+    dtstart = datetime(2025, 1, 31, 15, 0, tzinfo=UTC)
+    window = (datetime(2025, 1, 1, tzinfo=UTC), datetime(2025, 5, 1, tzinfo=UTC))
+    assert _starts("FREQ=MONTHLY;BYDAY=-1FR", dtstart, *window) == [
+        "2025-01-31 15:00", "2025-02-28 15:00", "2025-03-28 15:00", "2025-04-25 15:00"]
+    # months without a 31st are skipped, not clamped
+    assert _starts("FREQ=MONTHLY", dtstart, *window) == ["2025-01-31 15:00", "2025-03-31 15:00"]
+
+
+def test_count_includes_exception_dates_and_sets_series_end():
+    dtstart = datetime(2025, 3, 3, 9, 0, tzinfo=UTC)
+    rule = recurrence.parse_rrule("FREQ=DAILY;COUNT=5;BYDAY=MO,WE,FR")
+    assert recurrence.series_end(rule, dtstart, HOUR) == datetime(2025, 3, 12, 10, 0, tzinfo=UTC)
+    starts = _starts(rule.to_rrule(), dtstart, dtstart, dtstart + timedelta(days=30), ["2025-03-05"])
+    assert starts == ["2025-03-03 09:00", "2025-03-07 09:00", "2025-03-10 09:00", "2025-03-12 09:00"]
+
+
+def test_endless_series_expands_only_the_requested_window_and_caches_it():
+    dtstart = datetime(2015, 9, 1, 8, 0, tzinfo=UTC)
+    window = (datetime(2035, 9, 1, tzinfo=UTC), datetime(2035, 10, 1, tzinfo=UTC))
+    before = recurrence.cache_stats()
+    starts = _starts("FREQ=WEEKLY;INTERVAL=2;BYDAY=MO", dtstart, *window)
+    assert starts == ["2035-09-03 08:00", "2035-09-17 08:00"]
+    assert _starts("FREQ=WEEKLY;INTERVAL=2;BYDAY=MO", dtstart, *window) == starts
+    assert recurrence.cache_stats()["hits"] > before["hits"]
+
+
+def test_occurrence_that_started_before_the_window_still_overlaps_it():
+    dtstart = datetime(2025, 6, 30, 23, 30, tzinfo=UTC)
+    occ = recurrence.occurrences("FREQ=DAILY", dtstart, HOUR, datetime(2025, 7, 1, tzinfo=UTC), datetime(2025, 7, 1, 1, tzinfo=UTC))
+    assert [s.day for s, _ in occ] == [30]
+
+
+@pytest.mark.parametrize("rule", ["FREQ=HOURLY", "FREQ=WEEKLY;BYSETPOS=1", "FREQ=WEEKLY;BYDAY=XX",
+                                  "FREQ=DAILY;COUNT=2;UNTIL=20250101", "FREQ=WEEKLY;BYDAY=2TU", "FREQ=DAILY;COUNT=0"])
+def test_unsupported_rules_are_rejected(rule):
+    with pytest.raises(ValueError):
+        recurrence.parse_rrule(rule)
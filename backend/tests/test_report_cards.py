@@ -0,0 +1,74 @@
+import pytest
+from httpx import AsyncClient
+from passlib.context import CryptContext
+from app.main import app
+from app.db.prisma_client import prisma, init_prisma, close_prisma
+from app.services import report_cards
+
+pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+@pytest.fixture(autouse=True)
+async def db(tmp_path, monkeypatch):
+    await init_prisma()
+    for model in (prisma.reportcard, prisma.result, prisma.classranking, prisma.student, prisma.classmodel,
+                  prisma.parent, prisma.teacher, prisma.user):
+        await model.delete_many()
+    monkeypatch.setattr(report_cards, "REPORT_CARD_DIR", str(tmp_path))
+    # render in the default thread pool so the calls can be counted here
+    rendered = []
+    render = report_cards.render_to_file
+    monkeypatch.setattr(report_cards, "_get_pool", lambda: None)
+    monkeypatch.setattr(report_cards, "render_to_file", lambda path, card: rendered.append(card["student"]["id"]) or render(path, card))
+    yield rendered
+    await close_prisma()
+
+async def _login(client, email, role):
+    user = await prisma.user.create(data={'name': email.split('@')[0], 'email': email, 'role': role,
+                                          'password_hash': pwd_ctx.hash('Password1'), 'status': 'active'})
+    r = await client.post('/api/auth/login', json={'email': email, 'password': 'Password1'})
+    return user, {'Authorization': f"Bearer {r.json()['access_token']}"}
+
+@pytest.mark.asyncio
+async def test_unchanged_cards_reuse_their_digest_and_changes_rerender(db):
+    rendered = db
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        tuser, headers = await _login(client, 'teacher@test.local', 'teacher')
+        teacher = await prisma.teacher.create(data={'user_id': tuser.id})
+        cls = await prisma.classmodel.create(data={'name': 'JSS1', 'teacher_id': teacher.id})
+        a = await prisma.student.create(data={'name': 'A', 'class_id': cls.id})
+        b = await prisma.student.create(data={'name': 'B', 'class_id': cls.id})
+        for st, score in ((a, 70), (b, 50)):
+            await client.post('/api/results/', json={'student_id': st.id, 'subject': 'Maths', 'term': '1st-term', 'score': score, 'grade': 'B'}, headers=headers)
+
+        params = {'class_id': cls.id, 'term': '1st-term'}
+        first = (await client.post('/api/report-cards/generate', params=params, headers=headers)).json()
+        assert (first['rendered'], first['cached']) == (2, 0) and sorted(rendered) == [a.id, b.id]
+
+        again = (await client.post('/api/report-cards/generate', params=params, headers=headers)).json()
+        assert (again['rendered'], again['cached']) == (0, 2) and len(rendered) == 2
+        assert [c['digest'] for c in again['cards']] == [c['digest'] for c in first['cards']]
+
+        await client.post('/api/results/', json={'student_id': b.id, 'subject': 'English', 'term': '1st-term', 'score': 90, 'grade': 'A'}, headers=headers)
+        changed = (await client.post('/api/report-cards/generate', params=params, headers=headers)).json()
+        digests = {c['student_id']: c['digest'] for c in changed['cards']}
+        assert digests[b.id] != {c['student_id']: c['digest'] for c in first['cards']}[b.id]
+        assert b.id in rendered[2:]
+        card = await prisma.reportcard.find_unique(where={'student_id_term': {'student_id': b.id, 'term': '1st-term'}})
+        assert card.digest == digests[b.id]
+
+@pytest.mark.asyncio
+async def test_parent_downloads_only_their_own_childs_card(db):
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        tuser, theaders = await _login(client, 'teacher@test.local', 'teacher')
+        teacher = await prisma.teacher.create(data={'user_id': tuser.id})
+        cls = await prisma.classmodel.create(data={'name': 'JSS1', 'teacher_id': teacher.id})
+        puser, pheaders = await _login(client, 'parent@test.local', 'parent')
+        parent = await prisma.parent.create(data={'user_id': puser.id})
+        mine = await prisma.student.create(data={'name': 'Mine', 'class_id': cls.id, 'parent_id': parent.id})
+        other = await prisma.student.create(data={'name': 'Other', 'class_id': cls.id})
+        await client.post('/api/report-cards/generate', params={'class_id': cls.id, 'term': '1st-term'}, headers=theaders)
+
+        r = await client.get(f'/api/report-cards/{mine.id}', params={'term': '1st-term'}, headers=pheaders)
+        assert r.status_code == 200 and 'Mine' in r.text
+        r = await client.get(f'/api/report-cards/{other.id}', params={'term': '1st-term'}, headers=pheaders)
+        assert r.status_code == 403
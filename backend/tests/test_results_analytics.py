@@ -0,0 +1,190 @@
+import pytest
+from array import array
+from httpx import AsyncClient
+from passlib.context import CryptContext
+from app.main import app
+from app.db.prisma_client import prisma, init_prisma, close_prisma
+from app.services import result_stats
+from app.services.result_stats import summarize, stats_cache
+from app.services.rankings import dense_rank
+from app.services import result_trends
+from app.services.result_trends import trends_cache
+
+pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+@pytest.fixture(scope="session")
+def event_loop():
+    import asyncio
+    loop = asyncio.get_event_loop()
+    yield loop
+
+@pytest.fixture(scope="session", autouse=True)
+async def prisma_session():
+    await init_prisma()
+    yield
+    await close_prisma()
+
+@pytest.fixture(autouse=True)
+async def clean_db():
+    await prisma.result.delete_many()
+    await prisma.classranking.delete_many()
+    await prisma.student.delete_many()
+    await prisma.classmodel.delete_many()
+    await prisma.teacher.delete_many()
+    await prisma.user.delete_many()
+    stats_cache.clear()
+    trends_cache.clear()
+    yield
+
+@pytest.fixture
+async def client():
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        yield ac
+
+async def _teacher_with_class(client):
+    user = await prisma.user.create(data={
+        'name': 'Teacher', 'email': 'teacher@test.local', 'role': 'teacher',
+        'password_hash': pwd_ctx.hash('Password1'), 'status': 'active',
+    })
+    teacher = await prisma.teacher.create(data={'user_id': user.id})
+    cls = await prisma.classmodel.create(data={'name': 'JSS2', 'teacher_id': teacher.id})
+    login = await client.post('/api/auth/login', json={'email': 'teacher@test.local', 'password': 'Password1'})
+    headers = {'Authorization': f"Bearer {login.json()['access_token']}"}
+    return teacher, cls, headers
+
+def test_summarize_matches_reference_values():
+    s = summarize(array('i', [35, 40, 44, 45, 50, 59, 60, 69, 70, 100, 100]))
+    assert s['count'] == 11
+    assert s['median'] == 59
+    assert s['stddev'] == 21.27
+    assert s['percentiles']['p25'] == 44.5
+    assert s['histogram'] == {'A': 3, 'B': 2, 'C': 2, 'D': 1, 'E': 2, 'F': 1}
+    assert summarize(array('i'))['count'] == 0
+
+@pytest.mark.asyncio
+async def test_stats_endpoint_and_invalidation(client):
+    teacher, cls, headers = await _teacher_with_class(client)
+    students = [await prisma.student.create(data={'name': f'S{i}', 'class_id': cls.id}) for i in range(3)]
+    for st, score in zip(students, (40, 60, 80)):
+        r = await client.post('/api/results/', json={'student_id': st.id, 'subject': 'Maths', 'term': '1st-term', 'score': score, 'grade': 'B'}, headers=headers)
+        assert r.status_code == 200, r.text
+    r = await client.get(f'/api/results/stats?class_id={cls.id}&term=1st-term', headers=headers)
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body['overall']['mean'] == 60
+    assert body['subjects']['Maths']['count'] == 3
+
+    # A new write must be reflected immediately
+    await client.post('/api/results/', json={'student_id': students[0].id, 'subject': 'English', 'term': '1st-term', 'score': 100, 'grade': 'A'}, headers=headers)
+    r = await client.get(f'/api/results/stats?class_id={cls.id}&term=1st-term&subject=English', headers=headers)
+    assert r.json()['overall']['count'] == 1
+    assert list(r.json()['subjects']) == ['English']
+
+@pytest.mark.asyncio
+async def test_trends_series_class_average_and_invalidation(client):
+    teacher, cls, headers = await _teacher_with_class(client)
+    a = await prisma.student.create(data={'name': 'A', 'class_id': cls.id})
+    b = await prisma.student.create(data={'name': 'B', 'class_id': cls.id})
+    for st, subject, term, score in ((a, 'Maths', '1st-term', 60), (b, 'Maths', '1st-term', 40),
+                                     (a, 'Maths', '2nd-term', 80), (a, 'English', '2nd-term', 70)):
+        await client.post('/api/results/', json={'student_id': st.id, 'subject': subject, 'term': term, 'score': score, 'grade': 'B'}, headers=headers)
+    r = await client.get(f'/api/results/trends?student_id={a.id}', headers=headers)
+    assert r.status_code == 200, r.text
+    assert r.json() == {'student_id': a.id, 'terms': ['1st-term', '2nd-term'], 'subjects': {
+        'English': {'score': [None, 70], 'class_avg': [None, 70.0]},
+        'Maths': {'score': [60, 80], 'class_avg': [50.0, 80.0]},
+    }}
+    assert trends_cache.get(a.id) is not None
+
+    # a classmate's result moves A's class average, so A's cached series must go
+    await client.post('/api/results/', json={'student_id': b.id, 'subject': 'Maths', 'term': '2nd-term', 'score': 100, 'grade': 'A'}, headers=headers)
+    assert trends_cache.get(a.id) is None
+    r = await client.get(f'/api/results/trends?student_id={a.id}', headers=headers)
+    assert r.json()['subjects']['Maths']['class_avg'] == [50.0, 90.0]
+
+def test_dense_rank_ties_share_position():
+    ranked = dense_rank([
+        {'student_id': 3, 'total': 150, 'subject_count': 2},
+        {'student_id': 1, 'total': 180, 'subject_count': 2},
+        {'student_id': 2, 'total': 150, 'subject_count': 2},
+        {'student_id': 4, 'total': 90, 'subject_count': 1},
+    ])
+    assert [(r['student_id'], r['position']) for r in ranked] == [(1, 1), (2, 2), (3, 2), (4, 3)]
+    assert all(r['class_size'] == 4 for r in ranked)
+
+@pytest.mark.asyncio
+async def test_rankings_follow_result_writes(client):
+    teacher, cls, headers = await _teacher_with_class(client)
+    a = await prisma.student.create(data={'name': 'A', 'class_id': cls.id})
+    b = await prisma.student.create(data={'name': 'B', 'class_id': cls.id})
+    await client.post('/api/results/', json={'student_id': a.id, 'subject': 'Maths', 'term': '1st-term', 'score': 70, 'grade': 'A'}, headers=headers)
+    r = await client.post('/api/results/', json={'student_id': b.id, 'subject': 'Maths', 'term': '1st-term', 'score': 60, 'grade': 'B'}, headers=headers)
+    r = await client.get(f'/api/results/rankings?class_id={cls.id}&term=1st-term', headers=headers)
+    assert r.status_code == 200, r.text
+    assert [x['student_id'] for x in r.json()['rankings']] == [a.id, b.id]
+
+    await client.post('/api/results/', json={'student_id': b.id, 'subject': 'English', 'term': '1st-term', 'score': 30, 'grade': 'F'}, headers=headers)
+    r = await client.get(f'/api/results/rankings?class_id={cls.id}&term=1st-term', headers=headers)
+    assert [(x['student_id'], x['position']) for x in r.json()['rankings']] == [(b.id, 1), (a.id, 2)]
+
+@pytest.mark.asyncio
+async def test_bulk_gradebook_csv_reports_cell_errors(client):
+    teacher, cls, headers = await _teacher_with_class(client)
+    a = await prisma.student.create(data={'name': 'A', 'class_id': cls.id})
+    b = await prisma.student.create(data={'name': 'B', 'class_id': cls.id})
+    csv_body = f"student_id,Maths,English\n{a.id},80,65\n{b.id},abc,70\n999999,50,50\n"
+    r = await client.post(f'/api/results/bulk?class_id={cls.id}&term=1st-term', content=csv_body,
+                          headers={**headers, 'Content-Type': 'text/csv'})
+    assert r.status_code == 200, r.text
+    body = r.json()
+    assert body['created'] == 3
+    assert {(e['row'], e['subject']) for e in body['errors']} == {(2, 'Maths'), (3, 'Maths'), (3, 'English')}
+
+    # Re-uploading the same cells updates instead of duplicating
+    r = await client.post('/api/results/bulk', json={'class_id': cls.id, 'term': '1st-term', 'rows': [{'student_id': a.id, 'scores': {'Maths': 90}}]}, headers=headers)
+    assert r.json()['updated'] == 1
+    assert await prisma.result.count(where={'student_id': a.id}) == 2
+
+@pytest.mark.asyncio
+async def test_bulk_gradebook_keeps_other_classes_rows(client):
+    teacher, cls, headers = await _teacher_with_class(client)
+    other = await prisma.classmodel.create(data={'name': 'JSS3', 'teacher_id': teacher.id})
+    a = await prisma.student.create(data={'name': 'A', 'class_id': cls.id})
+    await client.post('/api/results/bulk', json={'class_id': cls.id, 'term': '1st-term', 'rows': [{'student_id': a.id, 'scores': {'Maths': 55}}]}, headers=headers)
+    await prisma.student.update(where={'id': a.id}, data={'class_id': other.id})
+    r = await client.post('/api/results/bulk', json={'class_id': other.id, 'term': '1st-term', 'rows': [{'student_id': a.id, 'scores': {'Maths': 90}}]}, headers=headers)
+    assert (r.json()['created'], r.json()['updated']) == (1, 0)
+    assert sorted((x.class_id, x.score) for x in await prisma.result.find_many(where={'student_id': a.id})) == [(cls.id, 55), (other.id, 90)]
+
+    r = await client.post('/api/results/bulk', content='{not json', headers={**headers, 'Content-Type': 'application/json'})
+    assert r.status_code == 422
+
+    rows = [{'student_id': a.id, 'scores': [80]}, {'student_id': a.id, 'scores': '80'}, {'student_id': a.id, 'scores': {'English': 70}}]
+    r = await client.post('/api/results/bulk', json={'class_id': other.id, 'term': '1st-term', 'rows': rows}, headers=headers)
+    assert r.status_code == 200, r.text
+    assert r.json()['created'] == 1 and [e['row'] for e in r.json()['errors']] == [1, 2]
+
+    r = await client.post('/api/results/bulk', json={'class_id': other.id, 'term': '  ', 'rows': rows}, headers=headers)
+    assert r.status_code == 400
+    r = await client.post(f'/api/results/bulk?class_id={other.id}&term=%20', content=f"student_id,Maths\n{a.id},50\n",
+                          headers={**headers, 'Content-Type': 'text/csv'})
+    assert r.status_code == 400
+
+@pytest.mark.asyncio
+async def test_stats_invalidation_reaches_every_worker_through_the_bus():
+    stats_cache.set((1, '1st-term'), {'overall': {}})
+    stats_cache.set((2, '1st-term'), {'overall': {}})
+    # what another worker's results.changed publish delivers here
+    await result_stats._on_results_changed({'class_id': 1, 'term': '1st-term', 'student_ids': [5]})
+    assert stats_cache.get((1, '1st-term')) is None
+    assert stats_cache.get((2, '1st-term')) is not None
+
+@pytest.mark.asyncio
+async def test_trends_invalidation_reaches_every_worker_through_the_bus():
+    trends_cache.set(1, ({'student_id': 1}, frozenset({10})))
+    trends_cache.set(2, ({'student_id': 2}, frozenset()))
+    trends_cache.set(3, ({'student_id': 3}, frozenset({20})))
+    # what another worker's results.changed publish delivers here
+    await result_trends._on_results_changed({'class_id': 10, 'term': '1st-term', 'student_ids': [2]})
+    assert trends_cache.get(1) is None and trends_cache.get(2) is None
+    assert trends_cache.get(3) is not None
@@ -0,0 +1,66 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+import pytest
+from app.core import realtime
+from app.core.scheduler import Job, Scheduler
+from app.db.prisma_client import prisma, init_prisma, close_prisma
+from app.services import reminders
+
+@pytest.fixture(autouse=True)
+async def db():
+    await init_prisma()
+    for table in ("ScheduledJob", "SchedulerLease", "EventReminder"):
+        await prisma.execute_raw(f"DELETE FROM {table}")
+    await prisma.event.delete_many()
+    yield
+    await close_prisma()
+
+def test_daily_jobs_run_at_the_next_local_hour_and_interval_jobs_coalesce():
+    now = datetime(2025, 3, 4, 10, 30, tzinfo=timezone.utc)
+    every = Job("tick", None, every=60)
+    assert every.following(now - timedelta(seconds=30), now) == now + timedelta(seconds=30)
+    assert every.following(now - timedelta(hours=5), now) == now + timedelta(seconds=60)  # missed runs happen once
+    nightly = Job("nightly", None, daily_at=(2, 0))
+    local = nightly.following(now, now).astimezone()
+    assert (local.hour, local.minute) == (2, 0) and timedelta(0) < local - now <= timedelta(days=1)
+
+@pytest.mark.asyncio
+async def test_only_the_leader_runs_jobs_and_state_survives_a_restart():
+    runs = []
+    async def tick():
+        runs.append(1)
+
+    first, second = Scheduler(lease_seconds=5), Scheduler(lease_seconds=5)
+    for s in (first, second):
+        s.add("tick", tick, every=3600)
+        s.start()
+    await asyncio.sleep(0.3)
+    assert [first.is_leader, second.is_leader].count(True) == 1 and runs == [1]
+    await first.stop()
+    await second.stop()
+
+    restarted = Scheduler(lease_seconds=5)
+    restarted.add("tick", tick, every=3600)
+    restarted.start()
+    await asyncio.sleep(0.3)
+    status = await restarted.status()
+    await restarted.stop()
+    assert runs == [1]  # next run is an hour out, not repeated on restart
+    job = status["jobs"][0]
+    assert job["name"] == "tick" and job["runs"] == 1 and job["last_status"] == "ok" and job["lag_ms"] >= 0
+
+@pytest.mark.asyncio
+async def test_event_reminder_is_pushed_once_per_occurrence():
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    start = now + timedelta(minutes=30)
+    await prisma.event.create(data={'title': 'PTA meeting', 'audience': 'parent', 'starts_at': start,
+                                    'ends_at': start + timedelta(hours=1), 'time': start.strftime('%H:%M')})
+    frames = []
+    async def capture(data):
+        frames.append((data["role"], json.loads(data["frame"])))
+    realtime.subscribe("ws.role", capture)
+
+    assert await reminders.send_due_reminders(now) == {"sent": 1}
+    assert await reminders.send_due_reminders(now + timedelta(minutes=1)) == {"sent": 0}
+    assert [(role, f["text"]) for role, f in frames] == [("parent", "PTA meeting in 30 minutes")]
@@ -0,0 +1,107 @@
+import pytest
+from httpx import AsyncClient
+from passlib.context import CryptContext
+from app.main import app
+from app.core import scope as scope_mod
+from app.db.prisma_client import prisma, init_prisma, close_prisma
+
+pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+@pytest.fixture(autouse=True)
+async def db():
+    await init_prisma()
+    for model in (prisma.result, prisma.student, prisma.classmodel, prisma.parent, prisma.teacher, prisma.user):
+        await model.delete_many()
+    scope_mod._scope_cache.clear()
+    yield
+    await close_prisma()
+
+async def _account(email, role, profile=None):
+    user = await prisma.user.create(data={'name': email.split('@')[0], 'email': email, 'role': role,
+                                          'password_hash': pwd_ctx.hash('Password1'), 'status': 'active'})
+    linked = await getattr(prisma, profile).create(data={'user_id': user.id}) if profile else None
+    return user, linked
+
+async def _headers(client, email):
+    r = await client.post('/api/auth/login', json={'email': email, 'password': 'Password1'})
+    return {'Authorization': f"Bearer {r.json()['access_token']}"}
+
+async def _school():
+    t1_user, t1 = await _account('t1@test.local', 'teacher', 'teacher')
+    t2_user, t2 = await _account('t2@test.local', 'teacher', 'teacher')
+    p_user, parent = await _account('p@test.local', 'parent', 'parent')
+    await _account('admin@test.local', 'admin')
+    await _account('nobody@test.local', 'teacher')
+    c1 = await prisma.classmodel.create(data={'name': 'JSS1', 'teacher_id': t1.id})
+    c2 = await prisma.classmodel.create(data={'name': 'JSS2', 'teacher_id': t2.id})
+    s1 = await prisma.student.create(data={'name': 'S1', 'class_id': c1.id, 'parent_id': parent.id})
+    s2 = await prisma.student.create(data={'name': 'S2', 'class_id': c1.id})
+    s3 = await prisma.student.create(data={'name': 'S3', 'class_id': c2.id})
+    results = {}
+    for st, cls, teacher in ((s1, c1, t1), (s2, c1, t1), (s3, c2, t2)):
+        results[st.id] = await prisma.result.create(data={'student_id': st.id, 'class_id': cls.id, 'teacher_id': teacher.id,
+                                                          'subject': 'Maths', 'term': '1st-term', 'score': 50, 'grade': 'C'})
+    return {'t1': t1, 'c1': c1, 'c2': c2, 's1': s1, 's2': s2, 's3': s3, 'parent': parent, 'results': results}
+
+async def _ids(client, path, headers, key='id'):
+    r = await client.get(path, headers=headers)
+    assert r.status_code == 200, r.text
+    return sorted(x[key] for x in r.json())
+
+@pytest.mark.asyncio
+async def test_teacher_and_parent_see_only_their_own_students_and_results():
+    school = await _school()
+    s1, s2, s3 = school['s1'].id, school['s2'].id, school['s3'].id
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        teacher = await _headers(client, 't1@test.local')
+        assert await _ids(client, '/api/students/', teacher) == [s1, s2]
+        assert await _ids(client, '/api/results/', teacher, 'student_id') == [s1, s2]
+        assert await _ids(client, '/api/classes/', teacher) == [school['c1'].id]
+
+        parent = await _headers(client, 'p@test.local')
+        assert await _ids(client, '/api/students/', parent) == [s1]
+        assert await _ids(client, '/api/results/', parent, 'student_id') == [s1]
+
+        nobody = await _headers(client, 'nobody@test.local')
+        assert await _ids(client, '/api/students/', nobody) == []
+        assert await _ids(client, '/api/results/', nobody, 'student_id') == []
+
+@pytest.mark.asyncio
+async def test_result_writes_outside_scope_are_forbidden():
+    school = await _school()
+    other = school['results'][school['s3'].id]
+    own = school['results'][school['s1'].id]
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        teacher = await _headers(client, 't1@test.local')
+        assert (await client.patch(f'/api/results/{other.id}', json={'score': 99}, headers=teacher)).status_code == 403
+        assert (await client.delete(f'/api/results/{other.id}', headers=teacher)).status_code == 403
+        parent = await _headers(client, 'p@test.local')
+        assert (await client.patch(f'/api/results/{own.id}', json={'score': 99}, headers=parent)).status_code == 403
+        assert (await client.patch(f'/api/results/{own.id}', json={'score': 99}, headers=teacher)).status_code == 200
+        assert (await prisma.result.find_unique(where={'id': other.id})).score == 50
+
+@pytest.mark.asyncio
+async def test_scope_follows_class_and_parent_relinks():
+    school = await _school()
+    s1, s2, s3 = school['s1'].id, school['s2'].id, school['s3'].id
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        admin = await _headers(client, 'admin@test.local')
+        teacher = await _headers(client, 't1@test.local')
+        parent = await _headers(client, 'p@test.local')
+        assert await _ids(client, '/api/students/', teacher) == [s1, s2]
+        assert await _ids(client, '/api/students/', parent) == [s1]
+
+        r = await client.patch(f"/api/classes/{school['c2'].id}", json={'teacher_id': school['t1'].id}, headers=admin)
+        assert r.status_code == 200, r.text
+        assert await _ids(client, '/api/students/', teacher) == [s1, s2, s3]
+
+        r = await client.patch(f'/api/students/{s2}', json={'parent_id': school['parent'].id}, headers=admin)
+        assert r.status_code == 200, r.text
+        assert await _ids(client, '/api/students/', parent) == [s1, s2]
+
+@pytest.mark.asyncio
+async def test_invalidation_reaches_every_worker_through_the_bus():
+    scope_mod._scope_cache.set(('teacher', 1), scope_mod.AccessScope('teacher', 1))
+    # what another worker's publish delivers here
+    await scope_mod._on_scopes_changed({})
+    assert scope_mod._scope_cache.get(('teacher', 1)) is None
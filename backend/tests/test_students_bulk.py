@@ -0,0 +1,61 @@
+import json
+import pytest
+from httpx import AsyncClient
+from app.main import app
+from app.services.enrolment import rows_from_csv, validate_rows
+from app.db.prisma_client import prisma, init_prisma, close_prisma
+
+@pytest.fixture
+async def db():
+    await init_prisma()
+    await prisma.student.delete_many()
+    await prisma.classmodel.delete_many()
+    yield
+    await close_prisma()
+
+def _lines(r):
+    return [json.loads(line) for line in r.text.splitlines()]
+
+def test_duplicates_and_unknown_names_are_caught_in_memory():
+    rows = rows_from_csv("Name,Class,roll_no,Email\nAda,JSS1,R1,ada@x.test\nBen,JSS9,R2,\nCy,JSS1,R1,\nDee,,R3,ADA@x.test\n,JSS1,R4,\n")
+    valid, errors = validate_rows(rows, {'JSS1': 7}, {7}, {}, set(), taken_roll_nos={'R3'}, taken_emails=set())
+    assert [(r.name, r.class_id) for r in valid] == [('Ada', 7)]
+    assert {e['row']: e['errors'] for e in errors} == {
+        2: ["Unknown class 'JSS9'"],
+        3: ['roll_no R1 repeats row 1'],
+        4: ['roll_no R3 already exists', 'email ada@x.test repeats row 1'],
+        5: ['Missing name'],
+    }
+
+@pytest.mark.asyncio
+async def test_bulk_import_creates_valid_rows_and_reports_the_rest(db):
+    jss1 = await prisma.classmodel.create(data={'name': 'JSS1'})
+    await prisma.student.create(data={'name': 'Existing', 'roll_no': 'R0'})
+    body = "\n".join(json.dumps(r) for r in [
+        {'name': 'Ada', 'class': 'JSS1', 'roll_no': 'R1'},
+        {'name': 'Ben', 'class': 'JSS2'},
+        {'name': 'Cy', 'roll_no': 'R0'},
+        {'name': 'Dee', 'class_id': jss1.id},
+    ])
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        r = await client.post('/api/students/bulk', content=body, headers={'content-type': 'application/x-ndjson'})
+        assert r.status_code == 200
+        lines = _lines(r)
+        assert [l.get('status') for l in lines[:4]] == ['created', 'error', 'error', 'created']
+        assert lines[-1] == {'summary': {'rows': 4, 'created': 2, 'errors': 2, 'skipped': 0}}
+        created = await prisma.student.find_many(where={'id': {'in': [lines[0]['id'], lines[3]['id']]}}, order={'id': 'asc'})
+        assert [(s.name, s.class_id) for s in created] == [('Ada', jss1.id), ('Dee', jss1.id)]
+
+        r = await client.post('/api/students/bulk', params={'atomic': 'true'}, content="name,class\nEve,JSS1\nFay,JSS3\n",
+                              headers={'content-type': 'text/csv'})
+        assert [l.get('status') for l in _lines(r)[:2]] == ['skipped', 'error']
+        assert await prisma.student.count() == 3
+
+@pytest.mark.asyncio
+async def test_ten_thousand_rows_in_one_request(db):
+    await prisma.classmodel.create_many(data=[{'name': f'C{i}'} for i in range(20)])
+    body = "name,class,roll_no,email\n" + "".join(f"S{i},C{i % 20},R{i:05d},s{i}@school.test\n" for i in range(10_000))
+    async with AsyncClient(app=app, base_url="http://test", timeout=120) as client:
+        r = await client.post('/api/students/bulk', content=body, headers={'content-type': 'text/csv'})
+    assert _lines(r)[-1]['summary']['created'] == 10_000
+    assert await prisma.student.count() == 10_000
@@ -0,0 +1,45 @@
+import asyncio
+import pytest
+from httpx import AsyncClient
+from app.main import app
+from app.core import totals
+from app.db.prisma_client import prisma, init_prisma, close_prisma
+
+@pytest.fixture(autouse=True)
+async def db():
+    await init_prisma()
+    await prisma.student.delete_many()
+    await prisma.classmodel.delete_many()
+    yield
+    await close_prisma()
+
+async def _meta(client, **params):
+    r = await client.get('/api/students/', params={'with_meta': 'true', 'limit': 5, **params})
+    return r.json()['meta']
+
+@pytest.mark.asyncio
+async def test_totals_follow_creates_and_deletes_without_recounting():
+    jss1 = await prisma.classmodel.create(data={'name': 'JSS1'})
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        for i in range(3):
+            assert (await client.post('/api/students/', json={'name': f'S{i}', 'class_id': jss1.id})).status_code == 200
+        assert (await _meta(client))['total'] == 3
+        counts = totals.stats['counts']
+
+        created = (await client.post('/api/students/', json={'name': 'S3'})).json()
+        assert (await _meta(client))['total'] == 4
+        await client.delete(f"/api/students/{created['id']}")
+        assert await _meta(client, offset=5) == {'total': 3, 'offset': 5, 'limit': 5, 'approximate': False}
+        assert totals.stats['counts'] == counts
+
+        # a change the cache cannot follow: exact mode recounts, approximate answers at once
+        await prisma.student.create(data={'name': 'Imported'})
+        await totals.invalidate('student')
+        assert await _meta(client, approximate='true') == {'total': 3, 'offset': 0, 'limit': 5, 'approximate': True}
+        assert (await _meta(client))['total'] == 4 and totals.stats['counts'] == counts + 1
+
+def test_where_matching_only_claims_what_it_understands():
+    assert totals._matches({'class_id': {'in': [1, 2]}}, {'class_id': 2, 'id': 9}) is True
+    assert totals._matches({'parent_id': 4}, {'parent_id': 5}) is False
+    assert totals._matches({'name': {'contains': 'a'}}, {'name': 'Ada'}) is None
+    assert totals._matches({'class_id': 1}, {'id': 9}) is None